@@ -0,0 +1,82 @@
+"""Benchmark rendering LaTeX table definitions.
+
+The vectorized `latex_tabular` renderer, used by `Latex.table`, is timed
+against `DataFrame.to_latex`, which it replaces, for mixed tables of
+integers, floats and strings of 1k, 100k and 1M cells.
+
+Run from the repository root:
+
+    python benchmarks/bench_latex_tables.py
+"""
+
+import argparse
+import os
+import sys
+from timeit import repeat
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kallysto.formatter import latex_tabular
+
+
+def make_table(cells, columns=10, seed=0):
+    """A table of cells cells, with integer, float and string columns."""
+    
+    rows = max(cells // columns, 1)
+    random = np.random.default_rng(seed)
+    
+    data = {}
+    
+    for i in range(columns):
+        kind = i % 3
+        
+        if kind == 0:
+            data['int_{}'.format(i)] = random.integers(0, 10**6, rows)
+        elif kind == 1:
+            data['float_{}'.format(i)] = random.normal(size=rows)
+        else:
+            data['str_{}'.format(i)] = np.array(['item_{}'.format(j % 997) for j in range(rows)])
+            
+    return pd.DataFrame(data)
+
+
+def best_time(render, repeats):
+    """The best time, in seconds, of a number of renders."""
+    return min(repeat(render, repeat=repeats, number=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--cells', type=int, nargs='+', default=[1000, 100000, 1000000],
+        help='the numbers of cells in the tables.')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    
+    print('{:>10} {:>14} {:>14} {:>10}'.format(
+        'cells', 'to_latex (s)', 'tabular (s)', 'speedup'))
+    
+    for cells in args.cells:
+        table = make_table(cells)
+        
+        tabular = best_time(lambda: latex_tabular(table), args.repeats)
+        
+        # The Styler behind to_latex fails beyond its max elements.
+        try:
+            assert latex_tabular(table) == table.to_latex(escape=True)
+            
+        except ValueError:
+            print('{:>10} {:>14} {:>14.4f} {:>10}'.format(cells, 'failed', tabular, '-'))
+            continue
+        
+        to_latex = best_time(lambda: table.to_latex(escape=True), args.repeats)
+        
+        print('{:>10} {:>14.4f} {:>14.4f} {:>9.1f}x'.format(
+            cells, to_latex, tabular, to_latex / tabular))
+
+
+if __name__ == '__main__':
+    main()
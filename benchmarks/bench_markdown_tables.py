@@ -0,0 +1,53 @@
+"""Benchmark rendering Markdown table definitions.
+
+The column-wise `pipe_table` renderer, used by `Markdown.table`, is timed
+against tabulate's pipe format, which it replaces, for the mixed tables of
+integers, floats and strings of bench_latex_tables, of 1k, 100k and 1M
+cells, and for a wide table.
+
+Run from the repository root:
+
+    python benchmarks/bench_markdown_tables.py
+"""
+
+import argparse
+import os
+import sys
+
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_latex_tables import best_time, make_table
+from kallysto.formatter import pipe_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--cells', type=int, nargs='+', default=[1000, 100000, 1000000],
+        help='the numbers of cells in the tables.')
+    parser.add_argument(
+        '--wide', type=int, default=200, help='the columns of the wide table.')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    
+    print('{:>18} {:>14} {:>14} {:>10}'.format(
+        'table', 'tabulate (s)', 'pipe (s)', 'speedup'))
+    
+    tables = [('{} cells'.format(cells), make_table(cells)) for cells in args.cells]
+    tables.append(('{} columns'.format(args.wide), make_table(args.wide * 500, args.wide)))
+    
+    for label, table in tables:
+        assert pipe_table(table) == tabulate(table, headers='keys', tablefmt='pipe')
+        
+        tabulated = best_time(
+            lambda: tabulate(table, headers='keys', tablefmt='pipe'), args.repeats)
+        piped = best_time(lambda: pipe_table(table), args.repeats)
+        
+        print('{:>18} {:>14.4f} {:>14.4f} {:>9.1f}x'.format(
+            label, tabulated, piped, tabulated / piped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark the time to create a Publication link.
+
+The time to construct a Publication is measured against the number of
+notebooks already registered in the publication's includes file, for
+eager setup (the default) and for lazy setup, which defers creating the
+datastore until the first export. Every eager construction reads the
+includes file, so its time grows with the number of notebooks registered.
+
+Run from the repository root:
+
+    python benchmarks/bench_publication_startup.py
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from timeit import repeat
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kallysto.publication import Publication
+
+
+def register_notebooks(pub_path, title, notebooks):
+    """Register a number of notebooks in a publication's includes file."""
+    
+    for i in range(notebooks):
+        Publication(
+            notebook='nb{}'.format(i), title=title, pub_path=pub_path).close()
+
+
+def time_construction(pub_path, title, repeats, number, **options):
+    """The best time, in ms, to construct (and close) a Publication."""
+    
+    def construct():
+        Publication(
+            notebook='bench', title=title, pub_path=pub_path, **options).close()
+        
+    return min(repeat(construct, repeat=repeats, number=number)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--notebooks', type=int, nargs='+', default=[1, 10, 100, 1000],
+        help='the numbers of notebooks registered in the includes file.')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+    
+    print('{:>10} {:>12} {:>12}'.format('notebooks', 'eager (ms)', 'lazy (ms)'))
+    
+    for notebooks in args.notebooks:
+        with tempfile.TemporaryDirectory() as pub_path:
+            pub_path += '/'
+            title = 'bench_{}'.format(notebooks)
+            
+            register_notebooks(pub_path, title, notebooks)
+            
+            eager = time_construction(pub_path, title, args.repeats, args.number)
+            lazy = time_construction(
+                pub_path, title, args.repeats, args.number, lazy_setup=True)
+            
+        print('{:>10} {:>12.3f} {:>12.3f}'.format(notebooks, eager, lazy))
+
+
+if __name__ == '__main__':
+    main()
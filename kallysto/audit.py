@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+
+
+# $$\                $$\ $$\                       $$\
+# $$ |               $$ |$$ |                      $$ |
+# $$ |  $$\ $$$$$$\  $$ |$$ |$$\   $$\  $$$$$$$\ $$$$$$\    $$$$$$\
+# $$ | $$  |\____$$\ $$ |$$ |$$ |  $$ |$$  _____|\_$$  _|  $$  __$$\
+# $$$$$$  / $$$$$$$ |$$ |$$ |$$ |  $$ |\$$$$$$\    $$ |    $$ /  $$ |
+# $$  _$$< $$  __$$ |$$ |$$ |$$ |  $$ | \____$$\   $$ |$$\ $$ |  $$ |
+# $$ | \$$\\$$$$$$$ |$$ |$$ |\$$$$$$$ |$$$$$$$  |  \$$$$  |\$$$$$$  |
+# \__|  \__|\_______|\__|\__| \____$$ |\_______/    \____/  \______/
+#                            $$\   $$ |
+#                            \$$$$$$  |
+#                             \______/
+#
+# Copyright 2017 Barry Smnyth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice & this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""The Kallysto audit log and its index.
+
+The audit log, kallysto.log, is an append-only JSON Lines file with one
+entry for each export (or each value of a Values export), recording its
+uid, time, publication title, notebook, name, export type, the paths to its
+files, its digest and whether its files were written or left unchanged.
+
+To avoid contention between many concurrent writers, each writer can
+instead append to its own live segment, kallysto-<writer>.log, alongside
+kallysto.log. `compact_log` folds the writers' segments back into
+kallysto.log.
+
+Each live segment may be rotated, when it grows too large or too old, into
+archive segments, kallysto.log.<timestamp>.gz (or .xz), which are never
+modified. `read_log` merges the entries of all of the segments, lazily, in
+the order they were logged.
+
+A secondary index, a SQLite database alongside the log, records the name,
+notebook and time of each entry, with its segment and the offset and length
+of its line (uncompressed), so that the history of an export or notebook can
+be found without scanning and parsing the whole log. The index is brought up
+to date lazily, when it is queried, by indexing any complete lines appended
+since the last query. The log remains the record; the index can be deleted
+at any time and will be rebuilt.
+"""
+
+import gzip
+import heapq
+import json
+import lzma
+import os
+import re
+import sqlite3
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from glob import glob
+from shutil import copyfileobj
+from tempfile import TemporaryDirectory
+
+from kallysto.fileio import atomic_path, locked
+
+INDEX_FILENAME = 'kallysto.idx'  # The index, in the logs directory.
+
+# The compression used for archive segments, by name, and their extensions.
+COMPRESSIONS = {'gzip': '.gz', 'xz': '.xz'}
+OPENERS = {'.gz': gzip.open, '.xz': lzma.open}
+
+# The most log segments that are open, or locked, at once; more segments are
+# merged, or compacted, in batches.
+MAX_OPEN_SEGMENTS = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    segment TEXT PRIMARY KEY,
+    indexed INTEGER NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entries (
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    name TEXT,
+    notebook TEXT,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS entries_by_name ON entries (name, time);
+CREATE INDEX IF NOT EXISTS entries_by_notebook ON entries (notebook, time);
+CREATE INDEX IF NOT EXISTS entries_by_time ON entries (time);
+"""
+
+
+# -- Segments ------------------------------------------------------------
+
+def open_segment(segment_file):
+    """Open a log segment, archived or live, for reading uncompressed bytes."""
+    
+    opener = OPENERS.get(os.path.splitext(segment_file)[1], open)
+    
+    return opener(segment_file, 'rb')
+
+
+def is_archive(segment_file):
+    """Is the log segment a (compressed, immutable) archive?"""
+    return os.path.splitext(segment_file)[1] in OPENERS
+
+
+def writer_segment(log_file, writer):
+    """The live log segment for a single writer, e.g. kallysto-nb-123.log."""
+    
+    stem, extension = os.path.splitext(log_file)
+    
+    return '{}-{}{}'.format(stem, re.sub(r'[^\w.-]+', '_', writer), extension)
+
+
+def live_segments(log_file):
+    """The live segments of the audit log; the log, then any writer segments."""
+    
+    stem, extension = os.path.splitext(log_file)
+    
+    return [log_file] + sorted(glob(glob_escape(stem) + '-*' + extension))
+
+
+def log_segments(log_file):
+    """The segments of the audit log, archives (oldest first) then the live log.
+    
+    Archives are found by name, for the log and for any writer, since the
+    writer segments that they were rotated from may have been compacted.
+    """
+    
+    stem, extension = os.path.splitext(log_file)
+    
+    archives = [
+        archive for pattern in [glob_escape(log_file), glob_escape(stem) + '-*' + extension]
+        for archive in glob(pattern + '.*') if is_archive(archive)]
+    
+    # By the time in their names, e.g. kallysto-nb-123.log.<time>.gz.
+    archives.sort(key=lambda archive: (archive.rsplit('.', 2)[-2], archive))
+    
+    return archives + live_segments(log_file)
+
+
+def glob_escape(path):
+    """Escape glob's special characters in a path."""
+    return ''.join('[{}]'.format(c) if c in '*?[' else c for c in path)
+
+
+def segment_lines(segment_file):
+    """Iterate over the (time, line) pairs of a log segment.
+    
+    Lines that are not JSON entries (e.g. from older versions of Kallysto)
+    are given a time of 0, so that they are merged ahead of the entries.
+    """
+    
+    if not os.path.isfile(segment_file):
+        return
+    
+    with open_segment(segment_file) as segment:
+        for line in segment:
+            entry = parse_entry(line)
+            yield (entry.get('time') or 0) if entry else 0, line
+
+
+def merged_lines(segment_files):
+    """Merge the lines of log segments, each in time order, by time.
+    
+    At most MAX_OPEN_SEGMENTS segments are open at once. Beyond that the
+    segments are merged in batches, into temporary segments, which are
+    then merged in turn.
+    """
+    
+    segment_files = list(segment_files)
+    
+    if len(segment_files) <= MAX_OPEN_SEGMENTS:
+        yield from heapq.merge(
+            *(segment_lines(segment_file) for segment_file in segment_files),
+            key=lambda time_and_line: time_and_line[0])
+        return
+    
+    with TemporaryDirectory() as spool_path:
+        spooled = []
+        
+        for start in range(0, len(segment_files), MAX_OPEN_SEGMENTS):
+            spooled.append(os.path.join(spool_path, '{}.log'.format(len(spooled))))
+            
+            with open(spooled[-1], 'wb') as spool:
+                spool.writelines(line for _, line in merged_lines(
+                    segment_files[start:start + MAX_OPEN_SEGMENTS]))
+                
+        yield from merged_lines(spooled)
+
+
+def read_log(log_file):
+    """Iterate over the entries of the audit log, across its segments.
+    
+    Each segment is in time order, so the segments are merged lazily, by
+    time. Lines that are not JSON entries are skipped.
+    """
+    
+    for _, line in merged_lines(log_segments(log_file)):
+        entry = parse_entry(line)
+        
+        if entry is not None:
+            yield entry
+
+
+def log_started(log_file):
+    """The time of the first entry in the live log, or None if it is empty."""
+    
+    if not os.path.isfile(log_file):
+        return None
+    
+    with open(log_file, 'rb') as log:
+        for line in log:
+            entry = parse_entry(line)
+            
+            if entry is not None:
+                return entry.get('time')
+            
+    return None
+
+
+def rotate_log(log_file, index_file, compression='gzip'):
+    """Archive the live log as a compressed segment and start a new live log.
+    
+    The live log is renamed, so that writers append to a new live log, and
+    then compressed. The index entries for the live log are transferred to
+    the archive, which is indexed to its end on the next query.
+    
+    Args:
+        log_file: the live audit log.
+        index_file: the audit log index.
+        compression: 'gzip' or 'xz'.
+        
+    Returns:
+        The path of the archive segment.
+    """
+    
+    # Name archives by time (UTC), so that they sort in order.
+    archive_file = None
+    
+    while archive_file is None or os.path.exists(archive_file):
+        archive_file = '{}.{}{}'.format(
+            log_file, datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f'), 
+            COMPRESSIONS[compression])
+    
+    uncompressed_file = archive_file[:-len(COMPRESSIONS[compression])]
+    
+    os.replace(log_file, uncompressed_file)
+    open(log_file, 'a').close()
+    
+    if os.path.isfile(index_file):
+        rename_segment(
+            index_file, os.path.basename(log_file), os.path.basename(archive_file))
+    
+    with open(uncompressed_file, 'rb') as uncompressed:
+        with OPENERS[COMPRESSIONS[compression]](archive_file + '.tmp', 'wb') as archive:
+            copyfileobj(uncompressed, archive)
+            
+    os.replace(archive_file + '.tmp', archive_file)
+    os.remove(uncompressed_file)
+    
+    return archive_file
+
+
+def compact_log(log_file, index_file):
+    """Fold the writers' live log segments into the audit log.
+    
+    The entries of the log and the writers' segments are merged, by time,
+    into a new log, which replaces the log; the writers' segments are then
+    removed. Each live segment's lock is held meanwhile so that no entries
+    are written to them; writers start new segments with their next entry.
+    The writers' segments are folded in batches, so that no more than
+    MAX_OPEN_SEGMENTS segments are locked at once. Archived segments are
+    left as they are.
+    
+    Args:
+        log_file: the audit log.
+        index_file: the audit log index.
+        
+    Returns:
+        The number of writer segments folded into the log.
+    """
+    
+    writers = live_segments(log_file)[1:]
+    batch = MAX_OPEN_SEGMENTS - 1  # And the log.
+    
+    return sum(
+        fold_segments(log_file, index_file, writers[start:start + batch])
+        for start in range(0, len(writers), batch))
+
+
+def fold_segments(log_file, index_file, writers):
+    """Fold some of the writers' live log segments into the audit log.
+    
+    Returns:
+        The number of writer segments folded into the log.
+    """
+    
+    with ExitStack() as stack:
+        
+        segments = [log_file] + writers
+        
+        for segment_file in segments:
+            stack.enter_context(locked(segment_file))
+            
+        # Segments may have been folded by another process meanwhile.
+        segments = [segment for segment in segments if os.path.isfile(segment)]
+        writers = [segment for segment in segments if segment != log_file]
+        
+        if not writers:
+            return 0
+        
+        with atomic_path(log_file) as compacted:
+            with open(compacted, 'wb') as log:
+                log.writelines(line for _, line in merged_lines(segments))
+                
+        for segment_file in writers:
+            os.remove(segment_file)
+            
+        # The log's offsets have changed; it is re-indexed on the next query.
+        if os.path.isfile(index_file):
+            forget_segments(
+                index_file, [os.path.basename(segment) for segment in segments])
+        
+    return len(writers)
+
+
+def forget_segments(index_file, segments):
+    """Remove the index entries of log segments, so they are re-indexed."""
+    
+    connection = connect(index_file)
+    
+    try:
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            
+            for segment in segments:
+                connection.execute('DELETE FROM entries WHERE segment = ?', (segment,))
+                connection.execute('DELETE FROM segments WHERE segment = ?', (segment,))
+            
+    finally:
+        connection.close()
+
+
+def rename_segment(index_file, segment, new_segment):
+    """Transfer the index entries of a log segment to a new segment name."""
+    
+    connection = connect(index_file)
+    
+    try:
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'UPDATE entries SET segment = ? WHERE segment = ?', (new_segment, segment))
+            connection.execute(
+                'UPDATE segments SET segment = ? WHERE segment = ?', (new_segment, segment))
+            
+    finally:
+        connection.close()
+
+
+# -- Index ---------------------------------------------------------------
+
+def connect(index_file):
+    """Open (creating if necessary) the audit log index."""
+    
+    connection = sqlite3.connect(index_file, timeout=30, isolation_level=None)
+    connection.executescript(SCHEMA)
+    
+    return connection
+
+
+def update_index(connection, segment_file):
+    """Index the complete lines appended to a log segment since last indexed.
+    
+    Lines that are not JSON entries (e.g. from older versions of Kallysto)
+    are skipped. If the live log is shorter than its indexed length then it
+    has been replaced and it is re-indexed from the start. Archives are
+    indexed to their end, once.
+    
+    Args:
+        connection: the open index.
+        segment_file: the live audit log, or an archive segment.
+    """
+    
+    segment = os.path.basename(segment_file)
+    archived = is_archive(segment_file)
+    
+    # Writers wait, so that concurrent readers don't index the same lines.
+    connection.execute('BEGIN IMMEDIATE')
+    
+    try:
+        row = connection.execute(
+            'SELECT indexed, complete FROM segments WHERE segment = ?', 
+            (segment,)).fetchone()
+        indexed, complete = row if row else (0, False)
+        
+        if not complete and os.path.isfile(segment_file):
+            
+            if not archived and os.path.getsize(segment_file) < indexed:
+                connection.execute('DELETE FROM entries WHERE segment = ?', (segment,))
+                indexed = 0
+            
+            with open_segment(segment_file) as log:
+                log.seek(indexed)
+                new_lines = log.read()
+            
+            # Only index complete lines; a partial line is picked up next time.
+            if not archived:
+                new_lines = new_lines[:new_lines.rfind(b'\n') + 1]
+            
+            entries, offset = [], indexed
+            
+            for line in new_lines.splitlines(True):
+                entry = parse_entry(line)
+                
+                if entry is not None:
+                    entries.append((
+                        segment, offset, len(line), entry.get('name'),
+                        entry.get('notebook'), entry.get('time')))
+                    
+                offset += len(line)
+                
+            connection.executemany(
+                'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)', entries)
+            
+            connection.execute(
+                'INSERT OR REPLACE INTO segments VALUES (?, ?, ?)', 
+                (segment, offset, archived))
+        
+        connection.execute('COMMIT')
+        
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+        
+        
+def parse_entry(line):
+    """Parse an audit log line, returning None if it is not a JSON entry."""
+    
+    try:
+        entry = json.loads(line.decode('utf-8'))
+        
+    except ValueError:
+        return None
+        
+    return entry if isinstance(entry, dict) else None
+
+
+def history(log_file, index_file, name=None, notebook=None, since=None, until=None):
+    """Find audit log entries using the audit log index.
+    
+    Args:
+        log_file: the live audit log; its archives are also searched.
+        index_file: the audit log index.
+        name: only entries for exports with this name.
+        notebook: only entries from this notebook.
+        since: only entries logged at or after this time (seconds since epoch).
+        until: only entries logged before this time (seconds since epoch).
+        
+    Returns:
+        A list of matching entries (dicts), in the order they were logged.
+    """
+    
+    logs_path = os.path.dirname(log_file)
+    
+    connection = connect(index_file)
+    
+    try:
+        for segment_file in log_segments(log_file):
+            update_index(connection, segment_file)
+        
+        criteria = [
+            ('name = ?', name), ('notebook = ?', notebook),
+            ('time >= ?', since), ('time < ?', until)]
+        criteria = [(test, value) for test, value in criteria if value is not None]
+        
+        query = 'SELECT segment, offset, length FROM entries'
+        
+        if criteria:
+            query += ' WHERE ' + ' AND '.join(test for test, _ in criteria)
+            
+        locations = connection.execute(
+            query + ' ORDER BY segment, offset', 
+            [value for _, value in criteria]).fetchall()
+        
+    finally:
+        connection.close()
+    
+    entries, segment_name, segment = [], None, None
+    
+    # Read each segment's entries in file order, so compressed segments
+    # are only decompressed once, moving forwards.
+    try:
+        for location_segment, offset, length in locations:
+            
+            if location_segment != segment_name:
+                if segment is not None:
+                    segment.close()
+                segment_name = location_segment
+                segment = open_segment(os.path.join(logs_path, segment_name))
+                
+            segment.seek(offset)
+            entries.append(json.loads(segment.read(length).decode('utf-8')))
+            
+    finally:
+        if segment is not None:
+            segment.close()
+    
+    return sorted(entries, key=lambda entry: entry.get('time') or 0)
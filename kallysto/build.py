@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+
+# $$\                $$\ $$\                       $$\
+# $$ |               $$ |$$ |                      $$ |
+# $$ |  $$\ $$$$$$\  $$ |$$ |$$\   $$\  $$$$$$$\ $$$$$$\    $$$$$$\
+# $$ | $$  |\____$$\ $$ |$$ |$$ |  $$ |$$  _____|\_$$  _|  $$  __$$\
+# $$$$$$  / $$$$$$$ |$$ |$$ |$$ |  $$ |\$$$$$$\    $$ |    $$ /  $$ |
+# $$  _$$< $$  __$$ |$$ |$$ |$$ |  $$ | \____$$\   $$ |$$\ $$ |  $$ |
+# $$ | \$$\\$$$$$$$ |$$ |$$ |\$$$$$$$ |$$$$$$$  |  \$$$$  |\$$$$$$  |
+# \__|  \__|\_______|\__|\__| \____$$ |\_______/    \____/  \______/
+#                            $$\   $$ |
+#                            \$$$$$$  |
+#                             \______/
+#
+# Copyright 2017 Barry Smnyth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice & this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Build manifests and stamp files, for make, latexmk and friends.
+
+The datastore changes on every notebook run, even when every export is the
+same as before, so its files say little to a build tool about whether the
+publication needs rebuilding. Instead, each notebook keeps a manifest of its
+exports, by name, with a build digest of each export's content and
+definition, and the time that the build digest last changed. Only then are
+the stamp files touched: one per export, one per notebook and one for the
+publication, all in `_kallysto/build/`:
+
+    _kallysto/build/kallysto.stamp                   Any export changed.
+    _kallysto/build/<notebook>.stamp                 An export of notebook changed.
+    _kallysto/build/<notebook>/<name>.stamp          Export name changed.
+    _kallysto/build/<notebook>.manifest.json         The notebook's manifest.
+
+so that e.g. a Makefile rule for a paper can depend on `kallysto.stamp`.
+Scripts can ask which exports are `stale` since the last build instead.
+"""
+
+import hashlib
+import json
+import os
+from time import time
+
+from kallysto.fileio import atomic_path, locked
+
+
+STAMP_FILENAME = 'kallysto.stamp'  # The publication's stamp file.
+BUILT_FILENAME = 'built.stamp'  # Touched by `mark_built`.
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+# -- Manifests -----------------------------------------------------------------
+
+def build_digest(digest, body):
+    """The build digest of an export; its content digest and definition body.
+    
+    The definition's meta-data, such as its export time, is left out, so an
+    export that is exported again with the same content and definition keeps
+    its build digest.
+    """
+    
+    return hashlib.sha1('{}\n{}'.format(digest, body).encode()).hexdigest()
+
+
+def manifest_file(build_path, notebook):
+    """The path to a notebook's manifest, in a publication's build folder."""
+    return os.path.join(build_path, notebook + MANIFEST_SUFFIX)
+
+
+def read_manifest(manifest_file):
+    """Read a manifest; a dict of {'export', 'digest', 'mtime'} by name."""
+    
+    if not os.path.isfile(manifest_file):
+        return {}
+    
+    with open(manifest_file, 'r') as manifest:
+        return json.load(manifest)
+
+
+def touch(filepath, when):
+    """Create a file if need be and set its modification time."""
+    
+    with open(filepath, 'a'):
+        pass
+    
+    os.utime(filepath, (when, when))
+    
+    
+def update_manifest(build_path, notebook, exports):
+    """Record the latest exports of a notebook and stamp those that changed.
+    
+    Args:
+        build_path: the publication's build folder.
+        notebook: the name of the exporting notebook.
+        exports: (name, kind, build digest) triples, for the latest exports.
+    
+    Returns:
+        The names of the exports whose build digest changed, or that are new.
+    """
+    
+    filepath = manifest_file(build_path, notebook)
+    stamps_path = os.path.join(build_path, notebook)
+    
+    with locked(filepath):
+        manifest = read_manifest(filepath)
+        now = time()
+        
+        changed = [
+            name for name, kind, digest in exports
+            if manifest.get(name, {}).get('digest') != digest]
+        
+        if not changed:
+            return []
+        
+        manifest.update(
+            (name, dict(export=kind, digest=digest, mtime=now))
+            for name, kind, digest in exports if name in changed)
+        
+        with atomic_path(filepath) as temp_file:
+            with open(temp_file, 'w') as manifest_out:
+                json.dump(manifest, manifest_out, indent=1, sort_keys=True)
+            
+        # Export stamps first, so the notebook and publication stamps are
+        # never older than the exports they cover.
+        os.makedirs(stamps_path, exist_ok=True)
+        
+        for name in changed:
+            touch(os.path.join(stamps_path, name + '.stamp'), now)
+            
+        touch(os.path.join(build_path, notebook + '.stamp'), now)
+        touch(os.path.join(build_path, STAMP_FILENAME), now)
+    
+    return changed
+
+
+# -- Staleness ----------------------------------------------------------------
+
+def mark_built(build_path):
+    """Note that the publication has been built, for `stale`."""
+    
+    os.makedirs(build_path, exist_ok=True)
+    touch(os.path.join(build_path, BUILT_FILENAME), time())
+    
+
+def stale(build_path, since=None):
+    """Find the exports that changed since the last build.
+    
+    Args:
+        build_path: the publication's build folder.
+        since: the time of the last build; seconds since the epoch, or the
+        path of a build output, e.g. the compiled paper, whose modification
+        time is used. By default the time of the last `mark_built`. Every
+        export is stale if there was no build.
+        
+    Returns:
+        (notebook, name) pairs of the stale exports, sorted.
+    """
+    
+    if since is None:
+        since = os.path.join(build_path, BUILT_FILENAME)
+    
+    if not isinstance(since, (int, float)):
+        since = os.path.getmtime(since) if os.path.exists(since) else 0
+        
+    if not os.path.isdir(build_path):
+        return []
+    
+    found = []
+    
+    for filename in sorted(os.listdir(build_path)):
+        if filename.endswith(MANIFEST_SUFFIX):
+            notebook = filename[:-len(MANIFEST_SUFFIX)]
+            
+            found.extend(
+                (notebook, name) for name, entry in sorted(
+                    read_manifest(os.path.join(build_path, filename)).items())
+                if entry['mtime'] > since)
+            
+    return found
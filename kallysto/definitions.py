@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+
+# $$\                $$\ $$\                       $$\
+# $$ |               $$ |$$ |                      $$ |
+# $$ |  $$\ $$$$$$\  $$ |$$ |$$\   $$\  $$$$$$$\ $$$$$$\    $$$$$$\
+# $$ | $$  |\____$$\ $$ |$$ |$$ |  $$ |$$  _____|\_$$  _|  $$  __$$\
+# $$$$$$  / $$$$$$$ |$$ |$$ |$$ |  $$ |\$$$$$$\    $$ |    $$ /  $$ |
+# $$  _$$< $$  __$$ |$$ |$$ |$$ |  $$ | \____$$\   $$ |$$\ $$ |  $$ |
+# $$ | \$$\\$$$$$$$ |$$ |$$ |\$$$$$$$ |$$$$$$$  |  \$$$$  |\$$$$$$  |
+# \__|  \__|\_______|\__|\__| \____$$ |\_______/    \____/  \______/
+#                            $$\   $$ |
+#                            \$$$$$$  |
+#                             \______/
+#
+# Copyright 2017 Barry Smnyth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice & this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Indexed definitions files.
+
+The standard definitions files are written for Latex, or for Kallysto's
+markdown converter, which has to parse a whole file to find any one
+definition. An indexed definitions file stores the body of each definition
+(the text that replaces a reference to it) as a length-prefixed record,
+
+    <name>\t<length>\n<body>\n
+
+where length is the length of the UTF-8 encoded body in bytes, so that
+records can be read without parsing their bodies, whatever they contain.
+A sidecar index file has one JSON line per record, with the name, export
+type, digest, and the offset and length of the body, so that individual
+definitions can be read by random access. Both files are append-only; the
+last record for a name is its current definition.
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+RECORDS_FILENAME = '_definitions.kdb'  # The indexed definitions file.
+INDEX_FILENAME = '_definitions.kdx'    # Its sidecar index.
+
+
+def write_definitions(records_file, index_file, entries):
+    """Append definitions to an indexed definitions file and its index.
+    
+    Args:
+        records_file: the indexed definitions file.
+        index_file: the sidecar index file.
+        entries: a list of (name, export type, body, digest) tuples.
+    """
+    
+    index = []
+    
+    with open(records_file, 'ab') as records:
+        
+        records.seek(0, os.SEEK_END)
+        
+        for name, export, body, digest in entries:
+            body = body.encode('utf-8')
+            
+            records.write('{}\t{}\n'.format(name, len(body)).encode('utf-8'))
+            
+            index.append(json.dumps(OrderedDict([
+                ('name', name), ('export', export), ('digest', digest),
+                ('offset', records.tell()), ('length', len(body))])))
+            
+            records.write(body + b'\n')
+            
+    with open(index_file, 'a') as index_lines:
+        index_lines.write(''.join(line + '\n' for line in index))
+        
+        
+def read_index(index_file):
+    """Read the index of an indexed definitions file.
+    
+    Returns:
+        A dict of the latest index entry for each name, in export order.
+    """
+    
+    index = OrderedDict()
+    
+    with open(index_file, 'r') as index_lines:
+        for line in index_lines:
+            if line.strip():
+                entry = json.loads(line)
+                index.pop(entry['name'], None)
+                index[entry['name']] = entry
+            
+    return index
+
+
+def read_definitions(records_file, index_file, names=None):
+    """Read definitions from an indexed definitions file.
+    
+    Only the requested definitions are read, by seeking to their bodies.
+    
+    Args:
+        records_file: the indexed definitions file.
+        index_file: the sidecar index file.
+        names: the names of the definitions to read; all if None.
+        
+    Returns:
+        A dict of definitions, {name:body}
+    """
+    
+    index = read_index(index_file)
+    
+    if names is not None:
+        index = OrderedDict(
+            (name, index[name]) for name in names if name in index)
+    
+    definitions = OrderedDict()
+    
+    with open(records_file, 'rb') as records:
+        
+        # Read in file order, to keep the seeks moving forwards.
+        for entry in sorted(index.values(), key=lambda entry: entry['offset']):
+            records.seek(entry['offset'])
+            definitions[entry['name']] = records.read(entry['length']).decode('utf-8')
+            
+    return definitions
+
@@ -34,17 +34,114 @@
 
 
 
+import hashlib
+import io
+import json
 import logging
 import os
 import sys
 from collections import OrderedDict, namedtuple
+from contextlib import ExitStack
+from itertools import chain
 
 
 from time import time, strftime
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
+from kallysto.storage import LocalStorage
+
+# The strategies for choosing the rows of a truncated table definition.
+TRUNCATE_STRATEGIES = ('head', 'tail', 'sample')
+
+
+# Image formats that can be encoded from a single Agg (RGBA) raster, and
+# the names of their encoders; PIL has no 'tif' encoder, only 'tiff'.
+RASTER_FORMATS = {'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg', 'tif': 'tiff', 'tiff': 'tiff'}
+
+
+def render_raster(image, dpi):
+    """Draw a matplotlib figure once, with Agg, as an RGBA array at dpi."""
+    
+    raw = io.BytesIO()
+    image.savefig(raw, format='rgba', dpi=dpi)
+    
+    # The raster size follows the figure's bbox at the given dpi.
+    width, height = (int(inches * dpi) for inches in image.get_size_inches())
+    
+    return np.frombuffer(raw.getvalue(), np.uint8).reshape(height, width, 4)
+
+
+def digest_figure(image, data_digest, formats, dpis, dpi):
+    """Digest a figure's image, data digest, image formats and dpis.
+    
+    Matplotlib figures are drawn once, with Agg at dpi, to digest them and
+    the raster is returned so that it can be reused when saving raster
+    formats at the same dpi.
+    
+    Returns:
+        The digest and a dict of the rasters drawn, by dpi.
+    """
+    
+    rasters = {}
+    
+    if dpi is not None and hasattr(image, 'get_size_inches'):
+        try:
+            rasters = {dpi: render_raster(image, dpi)}
+        except ValueError:
+            pass
+        
+    return Export.digest_components(
+        data_digest, rasters.get(dpi, image), formats, dpis), rasters
+
+
+def save_images(image, image_paths, dpis, rasters=None, storage=None):
+    """Save a figure image in several formats, drawing it as few times as possible.
+    
+    Raster formats are encoded from one Agg raster per dpi, so a figure that
+    is saved as png and jpg at the same dpi is only drawn once; each vector
+    format (pdf, svg, eps etc.) needs its own draw by its own backend.
+    
+    Args:
+        image: the figure image.
+        image_paths: an ordered dict of image format to filepath.
+        dpis: a dict of image format to dpi (None for the savefig default).
+        rasters: a dict of dpi to RGBA rasters that have already been drawn.
+        storage: the datastore's storage backend; local files by default.
+    """
+    
+    from matplotlib import image as mpl_image
+    
+    storage = storage or LocalStorage()
+    
+    rasters = dict(rasters or {})
+    
+    for format, filepath in image_paths.items():
+        dpi = dpis.get(format)
+        
+        if format in RASTER_FORMATS and dpi is not None:
+            try:
+                if dpi not in rasters:
+                    rasters[dpi] = render_raster(image, dpi)
+                    
+                with storage.write(filepath, 'wb') as image_file:
+                    mpl_image.imsave(
+                        image_file, rasters[dpi], format=RASTER_FORMATS[format], dpi=dpi)
+                continue
+                
+            # Not a plain matplotlib figure; let it save itself.
+            except (AttributeError, ValueError):
+                pass
+            
+        with storage.write(filepath, 'wb') as image_file:
+            if dpi is None:
+                image.savefig(image_file, format=format)
+            else:
+                image.savefig(image_file, format=format, dpi=dpi)
+
+
 # -- Export base class ---------------------------------------------------
 
 
@@ -72,6 +169,8 @@ class Export():
 
     display_logger = logging.getLogger("Kallysto")
     
+    payload = ()  # The attributes holding the export's payload.
+    
     
 # -- Export creation ---------------------------------------------------------
 
@@ -91,6 +190,11 @@ class Export():
         self.def_str = None
         self.log_str = None
 
+        # Content digest of the export payload and whether it matched
+        # the digest stored for the previous export of the same name.
+        self.digest = None
+        self.unchanged = False
+
         # Add the new export object to the subclass export dict.
 #         cls._exports[name] = self
         
@@ -104,7 +208,8 @@ class Export():
         return pub.export(self)
 
     
-    def save_export_component(self, component, save_method, filepath):
+    def save_export_component(self, component, save_method, filepath, 
+                              storage, mode='w'):
         """Safely save an export component to the Kallysto data store.
         
         Write the export component to file in an appropriate format, 
@@ -117,18 +222,252 @@ class Export():
             component: export component such as data or a fig/image.
             save_method: a suitable method that can write the data to file.
             filepath: where to write the data.
+            storage: the datastore's storage backend.
+            mode: the mode of the file passed to save_method; 'w' or 'wb'.
         """
         
         # Check that the component has the save method.
         if hasattr(component, save_method):
             self.display_logger.info('Saving %s.', filepath)
-            getattr(component, save_method)(filepath)
+            
+            # The storage replaces the file once written, so readers never
+            # see a partial file.
+            with storage.write(filepath, mode) as file:
+                getattr(component, save_method)(file)
             
         else: 
             self.display_logger.warning(
                 'Could not generate %s. Missing %s.', filepath, save_method)
 
     
+    def save_data(self, data, pub):
+        """Save export data to the Kallysto data store in the pub's data format.
+        
+        Table and figure data are written as CSV by default, or in a columnar
+        format (parquet or feather) that preserves dtypes and that can be
+        memory-mapped when it is read back. For columnar formats a secondary
+        CSV copy of the data can also be written.
+        
+        Args:
+            data: the export's dataframe.
+            pub: the target publication.
+        """
+        
+        filepath = pub.data_file(self.data_file)
+        
+        # The columnar formats store dataframes rather than series.
+        columnar = data.to_frame() if isinstance(data, pd.Series) else data
+        
+        if pub.data_format == 'csv':
+            self.save_export_component(data, 'to_csv', filepath, pub.storage)
+            
+        elif pub.data_format == 'parquet':
+            self.save_export_component(
+                columnar, 'to_parquet', filepath, pub.storage, mode='wb')
+            
+        # Pandas' to_feather cannot store a non-default index so use pyarrow
+        # directly, which keeps the index in the schema metadata. The file is
+        # left uncompressed so that it can be memory-mapped.
+        elif isinstance(columnar, pd.DataFrame):
+            from pyarrow import feather
+            
+            self.display_logger.info('Saving %s.', filepath)
+            
+            with pub.storage.write(filepath, 'wb') as file:
+                feather.write_feather(columnar, file, compression='uncompressed')
+            
+        else:
+            self.display_logger.warning(
+                'Could not generate %s. Missing dataframe.', filepath)
+            
+        # The optional secondary CSV copy.
+        if self.csv_file:
+            self.save_export_component(
+                data, 'to_csv', pub.data_file(self.csv_file), pub.storage)
+
+            
+    def save_data_chunks(self, chunks, pub):
+        """Stream export data to the Kallysto data store, one chunk at a time.
+        
+        Each dataframe chunk is appended to the data file (and csv copy) as
+        it is read, so that only one chunk needs to be held in memory. The
+        columnar formats are written with pyarrow's incremental writers,
+        using the schema of the first chunk.
+        
+        Args:
+            chunks: an iterable of dataframe chunks.
+            pub: the target publication.
+            
+        Returns:
+            The digest of the chunks, if the publication needs digests, and
+            the total number of rows written.
+        """
+        
+        filepath = pub.data_file(self.data_file)
+        self.display_logger.info('Streaming %s.', filepath)
+        
+        sha, rows, writer, schema = hashlib.sha1(), 0, None, None
+        
+        # The chunks are streamed to new files, which replace the data file
+        # (and csv copy) once every chunk has been written.
+        with ExitStack() as stack:
+            
+            data_file = stack.enter_context(pub.storage.write(
+                filepath, 'w' if pub.data_format == 'csv' else 'wb'))
+            
+            if self.csv_file:
+                csv_file = stack.enter_context(
+                    pub.storage.write(pub.data_file(self.csv_file)))
+            
+            try:
+                for i, chunk in enumerate(chunks):
+                    
+                    if isinstance(chunk, pd.Series):
+                        chunk = chunk.to_frame()
+                        
+                    header = i == 0
+                    
+                    if pub.data_format == 'csv':
+                        chunk.to_csv(data_file, header=header)
+                        
+                    else:
+                        import pyarrow as pa
+                        
+                        # Keep the index as a column; a range index stored as
+                        # metadata would only describe the first chunk.
+                        table = pa.Table.from_pandas(
+                            chunk, schema=schema, preserve_index=True)
+                        
+                        if writer is None:
+                            schema = table.schema
+                            
+                            if pub.data_format == 'parquet':
+                                from pyarrow import parquet
+                                writer = parquet.ParquetWriter(data_file, schema)
+                                
+                            else:
+                                writer = pa.ipc.new_file(data_file, schema)
+                                
+                        writer.write_table(table)
+                        
+                    if self.csv_file:
+                        chunk.to_csv(csv_file, header=header)
+                        
+                    if pub.needs_digests:
+                        sha.update(self.digest_components(chunk).encode())
+                        
+                    rows += len(chunk)
+                    
+            finally:
+                if writer is not None:
+                    writer.close()
+                
+        return sha.hexdigest() if pub.needs_digests else None, rows
+
+    
+    @staticmethod
+    def digest_components(*components):
+        """Calculate a content digest for a set of export components.
+        
+        Dataframes (and series) are hashed using pandas' own row hashing,
+        figures are hashed by rendering them to a raw (RGBA) buffer, which
+        is much cheaper than rendering a PDF, and anything else is hashed
+        based on its string representation.
+        
+        Args:
+            components: the export components (values, data, figs) to hash.
+            
+        Returns:
+            A hex digest string.
+        """
+        
+        sha = hashlib.sha1()
+        
+        for component in components:
+            
+            if isinstance(component, (pd.DataFrame, pd.Series)):
+                if isinstance(component, pd.DataFrame):
+                    sha.update(repr(list(component.columns)).encode())
+                else:
+                    sha.update(repr(component.name).encode())
+                
+                try:
+                    hashed = pd.util.hash_pandas_object(component, index=True)
+                    sha.update(hashed.values.tobytes())
+                    
+                # Unhashable cell values (e.g. lists); fall back to csv.
+                except TypeError:
+                    sha.update(component.to_csv().encode())
+                    
+            elif isinstance(component, np.ndarray):
+                sha.update(component.tobytes())
+                
+            elif hasattr(component, 'savefig'):
+                raw = io.BytesIO()
+                component.savefig(raw, format='raw')
+                sha.update(raw.getvalue())
+                
+            else:
+                sha.update(str(component).encode())
+                
+        return sha.hexdigest()
+
+    
+    def gen_log_entry(self, pub, **paths):
+        """Generate the export's audit log entry, a line of JSON.
+        
+        Args:
+            pub: the target publication.
+            paths: the datastore paths of the export's files, by field name;
+              these are logged relative to the logs directory.
+        """
+        
+        logged = time()
+        
+        entry = OrderedDict([
+            ('uid', self.uid),
+            ('time', logged),
+            ('logged', datetime.fromtimestamp(logged).astimezone().isoformat()),
+            ('title', pub.title),
+            ('notebook', pub.notebook),
+            ('notebook_path', pub.relative_path(pub.notebook_file, pub.logs_path)),
+            ('run', pub.run),
+            ('name', self.name),
+            ('export', self.__class__.__name__),
+        ])
+        
+        entry.update(
+            (field, pub.relative_path(path, pub.logs_path)) for field, path in paths.items())
+        
+        # All of the files written by the export, e.g. for garbage collection.
+        entry['files'] = [
+            pub.relative_path(path, pub.logs_path) for path in self.files(pub)]
+        
+        entry['digest'] = self.digest
+        entry['status'] = 'unchanged' if self.unchanged else 'written'
+        
+        return json.dumps(entry)
+    
+    
+    def files(self, pub):
+        """The data store paths of the files written by the export."""
+        
+        return [pub.data_file(file) 
+                for file in [self.data_file, getattr(self, 'csv_file', None)] if file]
+    
+    
+    def release(self):
+        """Drop the export's payload, once it has been persisted.
+        
+        Lean publications release the payload of each export so that
+        notebooks do not hold on to large values, dataframes and figures
+        after they have been exported; see `ExportRecord`.
+        """
+        
+        for attr in self.payload:
+            setattr(self, attr, None)
+
+    
     def path_to(self, from_loc, to_loc):
         """Calculate the relative path from from_loc to to_loc."""
         
@@ -146,17 +485,91 @@ class Export():
         return Value(name, value)
 
     @classmethod
-    def table(cls, name, data, caption, overwrite=True):
-        """Create Table export with a name check."""
-        return Table(name, data, caption)
+    def values(cls, values, name_template=None, name=None, overwrite=True):
+        """Create a Values export of many named values with a name check.
+        
+        The values may be a dict, series or dataframe of atomic values.
+        """
+        return Values(values, name_template, name)
+
+    @classmethod
+    def table(cls, name, data, caption, overwrite=True,
+              max_rows=None, max_cols=None, truncate=None):
+        """Create Table export with a name check.
+        
+        The data may be a dataframe or an iterator of dataframe chunks.
+        """
+        return Table(name, data, caption, max_rows, max_cols, truncate)
 
     @classmethod
     def figure(cls, name, image, data, caption, text_width=1, 
-               format='pdf', overwrite=True):
-        """Create Figure export with a name check."""
-        return Figure(name, image, data, caption, text_width, format)
+               format='pdf', overwrite=True, dpi=None):
+        """Create Figure export with a name check.
+        
+        The format may be a single image format or a list of formats.
+        """
+        return Figure(name, image, data, caption, text_width, format, dpi)
     
 
+# -- Export records ------------------------------------------------------
+
+
+class ExportRecord(object):
+    """A compact record of an export that has been written to a publication.
+    
+    Lean publications return records in place of their exports, which
+    release their payloads (values, data, figures) once they have been
+    persisted. A record keeps just enough meta-data to locate the export
+    in the Kallysto data store and to reload its data on demand.
+    
+    Attributes:
+        name: the export name.
+        uid: the export's unique id.
+        kind: the type of export (Value, Table or Figure).
+        digest: the content digest of the export.
+        data_file: the name of the export's data file.
+        image_file: the name of the export's image file, for figures.
+        pub: the publication the export was written to.
+    """
+    
+    __slots__ = ('name', 'uid', 'kind', 'digest', 'data_file', 'image_file', 'pub')
+    
+    def __init__(self, export, pub):
+        self.name = export.name
+        self.uid = export.uid
+        self.kind = export.__class__.__name__
+        self.digest = export.digest
+        self.data_file = getattr(export, 'data_file', None)
+        self.image_file = getattr(export, 'image_file', None)
+        self.pub = pub
+        
+    def __repr__(self):
+        return ('ExportRecord({name!r}, {kind!r}, {digest!r})').format(
+            name=self.name, kind=self.kind, digest=self.digest)
+    
+    @property
+    def data_path(self):
+        """The datastore path to the export's data file."""
+        return self.pub.data_file(self.data_file)
+    
+    @property
+    def image_path(self):
+        """The datastore path to the export's image file, if any."""
+        return self.pub.fig_file(self.image_file) if self.image_file else None
+    
+    def load(self):
+        """Reload the export's data from the data store.
+        
+        Returns:
+            The dataframe of a table or figure, or the text of a value.
+        """
+        
+        if self.kind == 'Value':
+            return self.pub.storage.read_text(self.data_path)
+            
+        return self.pub.load_data(self.data_file)
+    
+    
 # -- Value ---------------------------------------------------------------
 
 
@@ -174,6 +587,8 @@ class Value(Export):
     """
 #     _exports = OrderedDict()  # Dict of exports, keyed on name.
 
+    payload = ('value',)
+
     def __init__(self, name, value):
         """
         Initialise a new Value instance and add to _exports.
@@ -205,15 +620,12 @@ class Value(Export):
     def gen_log_str(self, pub):
         
         # Set the log message.
-        return ('{log_id},{logged},{title},{notebook},'
-                        '{export},{data_path}').format(
-                            log_id=self.uid,
-                            logged=strftime('%X %x %Z'),
-                            title=pub.title,
-                            notebook=self.path_to(pub.logs_path, pub.notebook_file),
-                            export=self.__class__.__name__,
-                            data_path=self.path_to(pub.logs_path, pub.data_file(self.data_file))
-        )
+        return self.gen_log_entry(
+            pub, data_path=pub.data_file(self.data_file))
+
+    def gen_digest(self):
+        """The digest of the exported value."""
+        return self.digest_components(self.value)
 
 # -- Value, Public API ---------------------------------------------------
 
@@ -224,23 +636,165 @@ class Value(Export):
         the export 'transfer'.
         """
 
+        # Create the datastore, if the publication was created lazily.
+        pub.setup()
+
         # Set the definition string using the value formatter.
         self.def_str = pub.formatter.value(self, pub)
 
+        # Check whether the value has changed since it was last exported.
+        if pub.needs_digests:
+            self.digest = self.gen_digest()
+            
+        self.unchanged = pub.is_unchanged(self, *self.files(pub))
+
         self.log_str = self.gen_log_str(pub)
 
-        # Save the value to a text file.
+        # Save the value to a text file, unless it is unchanged.
         # Note we cannot use `save_export_component` because the
         # data is a string and strings have no attribute to write
         # to a file and it seems unnecessary to wrap values in a new
         # class just to provide this.
-        with open(pub.data_file(self.data_file), "w+") as value_file:
-            value_file.write(str(self.value))
+        if not self.unchanged:
+            with pub.storage.write(pub.data_file(self.data_file)) as value_file:
+                value_file.write(str(self.value))
+                
+            pub.store_blobs(*self.files(pub))
                     
         # Call the super __gt__ to complete the export transfer 
         # via Publciation (updating definitions, writing log etc.)
         return super().__gt__(pub)
 
+# -- Values --------------------------------------------------------------
+
+
+class Values(Export):
+    """Export many atomic values, each with its own name, in one go.
+    
+    Values exports a dict, series or dataframe of atomic values as a set
+    of individually named value definitions. The names are generated
+    from a name template, which is formatted with the key of each dict
+    or series value, or with the row and col of each dataframe value.
+    All of the values are written to one consolidated data file, and
+    their definitions and log entries are written with a single append.
+
+    Attributes:
+        data: a dataframe of the values, indexed by definition name.
+        members: the individual Value exports.
+        data_file: the name of the consolidated data file.
+    """
+    
+    payload = ('data', 'members')
+    
+    def __init__(self, values, name_template=None, name=None):
+        """
+        Initialise a new Values export.
+        
+        Args:
+          values: a dict, series or dataframe of values.
+          name_template: a format string for the value names; the default
+            is '{key}' for dicts and series and '{row}{col}' for dataframes.
+          name: the name of the export, used for its data file; by default
+            it is based on the value names.
+        """
+        
+        if isinstance(values, pd.DataFrame):
+            name_template = name_template or '{row}{col}'
+            items = [(name_template.format(row=row, col=col), value)
+                     for row, series in values.iterrows()
+                     for col, value in series.items()]
+        else:
+            name_template = name_template or '{key}'
+            items = [(name_template.format(key=key), value)
+                     for key, value in values.items()]
+            
+        names = [value_name for value_name, _ in items]
+        
+        if name is None:
+            name = 'values{}'.format(
+                hashlib.sha1('\n'.join(names).encode()).hexdigest()[:8])
+            
+        super().__init__(name, self, self.__class__)
+        
+        self.data = pd.DataFrame(
+            {'value': [value for _, value in items]}, 
+            index=pd.Index(names, name='name'))
+        
+        self.data_file = "{}.values.csv".format(name)
+        
+        # The individual values share the export's meta-data and data file.
+        self.members = []
+        
+        for value_name, value in items:
+            member = Value(value_name, value)
+            member.uid, member.created = self.uid, self.created
+            member.data_file = self.data_file
+            self.members.append(member)
+
+# -- Override repr and str -----------------------------------------------
+
+    def __repr__(self):
+        return ('Values({data!r}, name={name!r})').format(
+            name=self.name,
+            data=self.data)
+
+    def __str__(self):
+        return "VALUES,{uid},{created},{name},{data_file}".format(
+            uid=self.uid, created=self.created,
+            name=self.name, data_file=self.data_file)
+    
+    def gen_log_str(self, pub):
+        """One log line per value, each referring to the consolidated file."""
+        
+        for member in self.members:
+            member.unchanged = self.unchanged
+            
+        return '\n'.join(member.gen_log_str(pub) for member in self.members)
+    
+    def gen_digest(self):
+        """The digest of the values and their names."""
+        return self.digest_components(self.data)
+
+# -- Values, Public API --------------------------------------------------
+
+    def __gt__(self, pub):
+        """Export self (Values) to publication.
+        
+        The definitions of all of the values are generated as one block
+        and the values are saved to the consolidated data file, before
+        calling __gt__ in super to initiate the export 'transfer'.
+        """
+
+        # Create the datastore, if the publication was created lazily.
+        pub.setup()
+        
+        # The definitions of the values, as separate entries.
+        for member in self.members:
+            member.def_str = pub.formatter.value(member, pub)
+            
+            if pub.needs_digests:
+                member.digest = member.gen_digest()
+            
+        self.def_str = '\n'.join(member.def_str for member in self.members)
+        
+        # Check whether the values have changed since they were last exported.
+        if pub.needs_digests:
+            self.digest = self.gen_digest()
+            
+        self.unchanged = pub.is_unchanged(self, *self.files(pub))
+        
+        self.log_str = self.gen_log_str(pub)
+        
+        if not self.unchanged:
+            self.save_export_component(
+                self.data, 'to_csv', pub.data_file(self.data_file), pub.storage)
+            pub.store_blobs(*self.files(pub))
+            
+        # Call the super __gt__ to complete the export transfer 
+        # via Publciation (updating definitions, writing log etc.)
+        return super().__gt__(pub)
+    
+
 # -- Table ---------------------------------------------------------------
 
 class Table(Export):
@@ -263,21 +817,51 @@ class Table(Export):
 
 # -- Table creation ------------------------------------------------------
 
-    def __init__(self, name, data, caption):
+    preview_rows = 20  # The rows of a streamed table shown in its definition.
+    
+    payload = ('data',)
+
+    def __init__(self, name, data, caption,
+                 max_rows=None, max_cols=None, truncate=None):
         """
         Initialise a new Table.
 
         Args:
           name: name of the export.
-          data: dataframe corresponding to the table.
+          data: dataframe corresponding to the table, or an iterator of
+            dataframe chunks (e.g. from `pd.read_csv(..., chunksize=...)`).
           caption: table caption.
+          max_rows: the maximum rows shown in the table definition; defaults
+            to the publication's table_max_rows.
+          max_cols: the maximum columns shown in the table definition;
+            defaults to the publication's table_max_cols.
+          truncate: how rows are chosen when there are too many (head, tail
+            or sample); defaults to the publication's table_truncate.
         """
         super().__init__(name, self, self.__class__)
 
         # The table-specific fields.
-        self.data = data
+        
+        # The data may be an iterator of dataframe chunks, which are streamed
+        # to the data store on export, leaving a preview of the first chunk.
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            self.data, self.chunks = data, None
+        else:
+            self.data, self.chunks = None, iter(data)
+            
+        self.rows = None  # The number of rows streamed.
+        
         self.data_file = "{}.csv".format(name)
+        self.csv_file = None  # Secondary csv copy of columnar data.
         self.caption = caption
+        
+        # The rendering budget for the table definition; the full data
+        # is always written to the data file.
+        if truncate is not None and truncate not in TRUNCATE_STRATEGIES:
+            raise ValueError('Unknown truncate strategy {!r}; expected one of {}.'.format(
+                truncate, ', '.join(TRUNCATE_STRATEGIES)))
+            
+        self.max_rows, self.max_cols, self.truncate = max_rows, max_cols, truncate
 
 # -- Override repr and str -----------------------------------------------
 
@@ -294,20 +878,84 @@ class Table(Export):
     
     def gen_log_str(self, pub):
         
-        # Set the log message.
-        return ('{log_id},{logged},{title},{notebook},'
-                        '{export},{data_path}').format(
-            log_id=self.uid,
-            logged=strftime('%X %x %Z'),
-            title=pub.title,
-            notebook=self.path_to(pub.logs_path, pub.notebook_file),
+        # Set the log message, with the path to the data file.
+        return self.gen_log_entry(
+            pub, data_path=pub.data_file(self.data_file))
 
-            export=self.__class__.__name__, # TABLE
-            
-            # The path to the data file.
-            data_path=self.path_to(pub.logs_path, pub.data_file(self.data_file))
+    def gen_digest(self):
+        """The digest of the table data."""
+        return self.digest_components(self.data)
+        
 
-        )
+    def preview(self, pub):
+        """The (possibly truncated) table data shown in the table definition.
+        
+        The table's rendering budget (max rows/cols and truncate strategy)
+        falls back to the publication's budget. Columns beyond the budget
+        are dropped and rows are chosen from the head, the tail, or by a
+        (reproducible) sample, keeping their original order. Streamed tables
+        can only be previewed from the head of their first chunk.
+        
+        Returns:
+            The data to show and a description of any truncation, or None.
+        """
+        
+        max_rows = self.max_rows if self.max_rows is not None else pub.table_max_rows
+        max_cols = self.max_cols if self.max_cols is not None else pub.table_max_cols
+        truncate = self.truncate or pub.table_truncate
+        
+        data = self.data
+        
+        rows = self.rows if self.rows is not None else len(data)
+        cols = data.shape[1] if isinstance(data, pd.DataFrame) else 1
+        
+        if max_cols is not None and cols > max_cols:
+            data = data.iloc[:, :max_cols]
+            
+        if max_rows is not None and len(data) > max_rows:
+            
+            if truncate == 'tail' and self.rows is None:
+                data = data.tail(max_rows)
+                
+            elif truncate == 'sample' and self.rows is None:
+                data = data.iloc[sorted(
+                    np.random.RandomState(0).choice(len(data), max_rows, replace=False))]
+                
+            else:
+                data = data.head(max_rows)
+                
+        # Streamed previews always come from the head.
+        if self.rows is not None:
+            truncate = 'head'
+            
+        shown_cols = data.shape[1] if isinstance(data, pd.DataFrame) else 1
+        
+        if (len(data), shown_cols) == (rows, cols):
+            return data, None
+        
+        return data, '{} of {} rows, {} of {} columns ({})'.format(
+            len(data), rows, shown_cols, cols, truncate)
+        
+        
+    def stream_data(self, pub):
+        """Stream the table's chunks to the data store, keeping a preview."""
+        
+        chunks, self.chunks = self.chunks, None
+        
+        first = next(chunks, None)
+        if first is None:
+            first = pd.DataFrame()
+            
+        # Keep a bounded preview for the definition, but not the chunk.
+        max_rows = self.max_rows if self.max_rows is not None else pub.table_max_rows
+        
+        self.data = first.head(
+            max_rows if max_rows is not None else self.preview_rows).copy()
+        
+        chunks = chain([first], chunks)
+        del first
+        
+        self.digest, self.rows = self.save_data_chunks(chunks, pub)
         
 
 # -- Table, Public API ---------------------------------------------------
@@ -320,15 +968,40 @@ class Table(Export):
         __gt__ in super to initiate the export 'transfer'.
         """
 
+        # Create the datastore, if the publication was created lazily.
+        pub.setup()
+
+        # The data file(s) depend on the publication's data format.
+        self.data_file, self.csv_file = pub.data_filenames(self.name)
+        
+        # Streamed data is written as it is read, before the definition,
+        # which is based on a preview; so it is never skipped as unchanged.
+        if self.chunks is not None:
+            self.stream_data(pub)
+            pub.store_blobs(*self.files(pub))
+            
+        elif self.rows is not None:
+            raise ValueError(
+                'Streamed table {} can only be exported once.'.format(self.name))
+
         # Set the definition string using the table formatter.
         self.def_str = pub.formatter.table(self, pub)
         
+        # Check whether the data has changed since it was last exported.
+        if self.rows is None:
+            if pub.needs_digests:
+                self.digest = self.gen_digest()
+                
+            self.unchanged = pub.is_unchanged(self, *self.files(pub))
+        
         # And the log string.
         self.log_str = self.gen_log_str(pub)
         
-        # Save the data to .csv
+        # Save the data, unless it is unchanged or has been streamed.
         # The data is saved from the nb so needs to use path from nb.
-        self.save_export_component(self.data, 'to_csv', pub.data_file(self.data_file))
+        if not self.unchanged and self.rows is None:
+            self.save_data(self.data, pub)
+            pub.store_blobs(*self.files(pub))
         
         # Call the super __gt__ to complete the export transfer 
         # via Publciation (updating definitions, writing log etc.)
@@ -347,21 +1020,27 @@ class Figure(Export):
     image - the figure image.
     data - the dataframe associated with the figure.
     caption - the caption for the figure.
-    format - the format of the saved image (pdf or png)
+    format - the format(s) of the saved image (e.g. pdf or png)
 
     Attributes:
         data: the pandas dataframe related to the image.
         data_file: path to the data_file.
-        image_file: path to the image_file.
+        image_file: path to the image_file (of the primary format).
+        image_files: dict of image format to image file.
         caption: caption text for the figure.
-        format: the format of the image (e.g. pdf, png)
+        format: the primary format of the image (e.g. pdf, png)
+        formats: all of the image formats.
+        dpi: the image dpi, or a dict of dpi per image format.
     """
 #     _exports = OrderedDict()  # Dict of exports, keyed on name.
 
 # -- Figure creation -----------------------------------------------------
 
+    payload = ('image', 'data')
+    
+
     def __init__(self,
-                 name, image, data, caption, text_width=1, format='pdf'):
+                 name, image, data, caption, text_width=1, format='pdf', dpi=None):
         """Initialise a new Figure.
 
         Args:
@@ -369,7 +1048,10 @@ class Figure(Export):
           image: the figure image.
           data: dataframe corresponding to teh table.
           caption: table caption.
-          format: png or pdf.
+          format: png or pdf, or a list of formats such as ['pdf', 'png'];
+            the first format is the primary format.
+          dpi: the dpi for all formats or a dict of dpi per format, e.g.
+            {'png': 300}; defaults to the savefig dpi.
         """
 
         super().__init__(name, self, self.__class__)
@@ -378,15 +1060,23 @@ class Figure(Export):
         self.image = image
         self.data = data
         self.caption = caption
-        self.format = format
+        self.formats = [format] if isinstance(format, str) else list(format)
+        self.format = self.formats[0]
+        self.dpi = dpi
         self.text_width = text_width
 
         # The source-data file; use .fig to tag as fig datafile.
         self.data_file = "{}.fig.csv".format(name)     
+        self.csv_file = None  # Secondary csv copy of columnar data.
         
-        self.image_file = "{}.{}".format(name, format)  # The figure image.
+        # The figure images, one per format.
+        self.image_files = OrderedDict(
+            (format, "{}.{}".format(name, format)) for format in self.formats)
+        self.image_file = self.image_files[self.format]
 
         self.fig_scale = 1     # Scaling of figures.
+        
+        self.rasters = {}  # Rasters drawn while digesting, by dpi.
 
 # -- Override repr and str -----------------------------------------------
 
@@ -397,7 +1087,7 @@ class Figure(Export):
             image=self.image,
             data=self.data,
             caption=self.caption,
-            format=self.format)
+            format=self.format if len(self.formats) == 1 else self.formats)
 
     def __str__(self):
         return "FIGURE,{uid},{created},{name},{image_file},{data_file}".format(
@@ -406,20 +1096,118 @@ class Figure(Export):
             data_file=self.data_file)
     
     def gen_log_str(self, pub):
-
         
-        return ('{log_id},{logged},{title},{notebook},'
-                        '{export},{figs_path},{data_path}s').format(
-            log_id=self.uid,
-            logged=strftime('%X %x %Z'),
-            title=pub.title,
-            notebook=self.path_to(pub.logs_path, pub.notebook_file),
-
-            figs_path=self.path_to(pub.logs_path, pub.fig_file(self.image_file)),
-            data_path=self.path_to(pub.logs_path, pub.data_file(self.data_file)),
+        # Set the log message, with the paths to the image and data files.
+        return self.gen_log_entry(
+            pub, 
+            image_path=pub.fig_file(self.image_file),
+            data_path=pub.data_file(self.data_file))
+
+    def gen_digest(self):
+        """The digest of the figure data, image, image formats and dpis.
+        
+        The figure is drawn once, at its default dpi, to digest it and the
+        raster is kept so that it can be reused when saving its images.
+        """
+        
+        digest, self.rasters = digest_figure(self.image, *self.digest_parts())
+        
+        return digest
+    
+    
+    def digest_parts(self):
+        """The parts of the figure's digest, other than its image.
+        
+        Returns:
+            The digest of its data, its formats and their dpis, and the dpi
+            at which the image is drawn to digest it; see `digest_figure`.
+        """
+        
+        return (self.digest_components(self.data), self.formats, 
+                [self.image_dpi(format) for format in self.formats], 
+                self.image_dpi(None))
+    
+    
+    def image_dpi(self, format):
+        """The dpi for an image format; the savefig default if not given."""
+        
+        if isinstance(self.dpi, dict) and format in self.dpi:
+            return self.dpi[format]
+        
+        elif self.dpi is not None and not isinstance(self.dpi, dict):
+            return self.dpi
+        
+        # Matplotlib's default, which may defer to the figure's dpi.
+        from matplotlib import rcParams
+        
+        dpi = rcParams['savefig.dpi']
+        
+        return getattr(self.image, 'dpi', None) if dpi == 'figure' else dpi
+    
+    
+    def image_file_for(self, formatter):
+        """The image file in the format preferred by the formatter.
+        
+        Formatters list the image formats they prefer, in order; if none of
+        them were exported the image in the primary format is used.
+        """
+        
+        for format in getattr(formatter, 'image_formats', ()):
+            if format in self.image_files:
+                return self.image_files[format]
+            
+        return self.image_file
+    
+    
+    def save_images(self, pub):
+        """Save the figure image in each of its formats."""
+        
+        if not hasattr(self.image, 'savefig'):
+            self.display_logger.warning(
+                'Could not generate %s. Missing savefig.', pub.fig_file(self.image_file))
+            return
+        
+        image_paths = self.image_paths(pub)
+        
+        for filepath in image_paths.values():
+            self.display_logger.info('Saving %s.', filepath)
+        
+        save_images(
+            self.image, image_paths, self.image_dpis(), self.rasters, pub.storage)
+        
+        self.rasters = {}  # Free the rasters.
+        
+        
+    def files(self, pub):
+        """The data store paths of the figure's images and data files."""
+        return list(self.image_paths(pub).values()) + super().files(pub)
+    
+    
+    def image_paths(self, pub):
+        """The datastore paths of the figure images, by format."""
+        return OrderedDict(
+            (format, pub.fig_file(image_file)) 
+            for format, image_file in self.image_files.items())
+    
+    
+    def image_dpis(self):
+        """The dpi of the figure images, by format."""
+        return {format: self.image_dpi(format) for format in self.formats}
+        
 
-            export=self.__class__.__name__  # FIGURE
-        )
+    def release(self):
+        """Drop the figure's payload, closing it if it is managed by pyplot.
+        
+        Pyplot keeps a reference to every open figure, so the figure is only
+        freed if it is closed too (which also stops it being shown inline).
+        """
+        
+        if 'matplotlib.pyplot' in sys.modules and self.image is not None:
+            sys.modules['matplotlib.pyplot'].close(self.image)
+            
+        self.rasters = {}
+            
+        super().release()
         
 
 # -- Figure, Public API --------------------------------------------------
@@ -430,21 +1218,48 @@ class Figure(Export):
         This methods is responsible for (a) writing the csv file to hold
         the table data, (b) generating the log string and (c) calling 
         __gt__ in super to initiate the export 'transfer'.
+        
+        If the publication renders figures in the background then the
+        Future of the render is returned instead and the export transfer
+        is completed by `pub.wait()`. The figure is then digested, and its
+        data saved, once the render has completed; see `pub.render`.
         """
 
+        # Create the datastore, if the publication was created lazily.
+        pub.setup()
+
+        # The data file(s) depend on the publication's data format.
+        self.data_file, self.csv_file = pub.data_filenames(self.name + '.fig')
+
         # Set the definition string using the figure formatter.
         self.def_str = pub.formatter.figure(self, pub)
+        
+        # Render the image in the background if the publication has render
+        # workers; the export completes when the pub is waited on.
+        if pub.render_workers:
+            return pub.render(self)
     
+        # Check whether the data or image have changed since last exported.
+        if pub.needs_digests:
+            self.digest = self.gen_digest()
+            
+        self.unchanged = pub.is_unchanged(self, *self.files(pub))
+        
         # Set the log message.
         self.log_str = self.gen_log_str(pub)
         
-        # Paths to data/im
-        # Save the data to .csv
-        # The data is saved from the nb so needs to use path from nb.
-        self.save_export_component(self.data, 'to_csv', pub.data_file(self.data_file))
+        if not self.unchanged:
+            
+            # Save the data.
+            # The data is saved from the nb so needs to use path from nb.
+            self.save_data(self.data, pub)
 
-        # Save the image.
-        self.save_export_component(self.image, 'savefig', pub.fig_file(self.image_file))
+            # Save the image, in each format.
+            self.save_images(pub)
+            
+            pub.store_blobs(*self.files(pub))
+            
+        self.rasters = {}
 
         # Call the super __gt__ to complete the export transfer 
         # via Publciation (updating definitions, writing log etc.)
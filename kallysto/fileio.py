@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+
+# $$\                $$\ $$\                       $$\
+# $$ |               $$ |$$ |                      $$ |
+# $$ |  $$\ $$$$$$\  $$ |$$ |$$\   $$\  $$$$$$$\ $$$$$$\    $$$$$$\
+# $$ | $$  |\____$$\ $$ |$$ |$$ |  $$ |$$  _____|\_$$  _|  $$  __$$\
+# $$$$$$  / $$$$$$$ |$$ |$$ |$$ |  $$ |\$$$$$$\    $$ |    $$ /  $$ |
+# $$  _$$< $$  __$$ |$$ |$$ |$$ |  $$ | \____$$\   $$ |$$\ $$ |  $$ |
+# $$ | \$$\\$$$$$$$ |$$ |$$ |\$$$$$$$ |$$$$$$$  |  \$$$$  |\$$$$$$  |
+# \__|  \__|\_______|\__|\__| \____$$ |\_______/    \____/  \______/
+#                            $$\   $$ |
+#                            \$$$$$$  |
+#                             \______/
+#
+# Copyright 2017 Barry Smnyth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice & this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Safe writes to the Kallysto datastore by concurrent notebooks.
+
+Data, image and definitions files are written to a temporary file in the
+same directory, which then replaces the target file in a single atomic
+rename, so a reader sees either the old file or the new one and never a
+half-written one.
+
+Shared files that are appended to or updated in place (the audit log, the
+includes file, definitions files and the digests file) are protected by an
+advisory lock, held for the duration of the update. Each file has its own
+lock file, alongside it, so writers to different files never wait on each
+other.
+"""
+
+import os
+from contextlib import contextmanager
+from itertools import count
+
+try:
+    import fcntl
+    
+    def lock_file(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        
+    def unlock_file(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        
+except ImportError:  # Windows.
+    import msvcrt
+    
+    def lock_file(file):
+        file.seek(0)
+        
+        # LK_LOCK only retries for 10 seconds, so keep trying.
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+        
+    def unlock_file(file):
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Distinguishes the temporary files of concurrent writes in one process.
+temp_counter = count()
+
+
+def lock_path(filepath):
+    """The lock file for a shared file; a hidden file alongside it."""
+    
+    folder, filename = os.path.split(filepath)
+    
+    return os.path.join(folder, '.{}.lock'.format(filename))
+
+
+@contextmanager
+def locked(filepath):
+    """Hold an exclusive advisory lock on a shared file.
+    
+    The lock is only advisory, it excludes other writers that also use
+    `locked`, and it is released when the block exits.
+    
+    Args:
+        filepath: the shared file; it need not exist.
+    """
+    
+    with open(lock_path(filepath), 'a+') as lock:
+        lock_file(lock)
+        
+        try:
+            yield
+            
+        finally:
+            unlock_file(lock)
+            
+            
+def temp_path(filepath):
+    """A unique temporary path, in the same directory, for writing filepath.
+    
+    The temporary file is hidden, and it keeps the extension of filepath so
+    that writers that infer the format from the extension still work.
+    """
+    
+    folder, filename = os.path.split(filepath)
+    
+    return os.path.join(folder, '.tmp-{}-{}.{}'.format(
+        os.getpid(), next(temp_counter), filename))
+
+
+@contextmanager
+def atomic_path(filepath):
+    """Write a file via a temporary file that replaces it atomically.
+    
+    Yields the temporary path to write to. If the block succeeds the
+    temporary file (if written) replaces filepath, otherwise it is removed.
+    
+        with atomic_path(filepath) as temp:
+            df.to_csv(temp)
+    """
+    
+    temp = temp_path(filepath)
+    
+    try:
+        yield temp
+        
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+        
+    if os.path.exists(temp):
+        os.replace(temp, filepath)
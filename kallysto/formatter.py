@@ -43,19 +43,408 @@ figure fromatters. Each formatter method accepts an export object and a
 publication object as arguments so that the formatted definition can refer to
 data from the export object or the publication."""
 
+import datetime
 import os
+import re
+import numpy as np
 import pandas as pd
+from operator import itemgetter
+from string import Formatter as FormatParser
 from time import time, strftime
+from pandas.api.types import (
+    is_bool_dtype, is_complex, is_float, is_float_dtype, is_integer_dtype, is_numeric_dtype)
 from tabulate import tabulate
 
+
+class Template(object):
+    """A str.format template, compiled once into a printf-style template.
+    
+    A definition is formatted for every export, so rather than having
+    str.format parse its template every time, the template is parsed once,
+    when the formatter is defined, into a printf-style template and a getter
+    for its fields. Only plain replacement fields, e.g. {name}, are supported.
+    """
+    
+    def __init__(self, template):
+        
+        pieces, fields = [], []
+        
+        for literal, field, spec, conversion in FormatParser().parse(template):
+            pieces.append(literal.replace('%', '%%'))
+            
+            if field is not None:
+                if spec or conversion or not field.isidentifier():
+                    raise ValueError('Unsupported template field {!r}.'.format(field))
+                
+                pieces.append('%s')
+                fields.append(field)
+                
+        self.template = ''.join(pieces)
+        self.fields = tuple(fields)
+        
+        # itemgetter returns a bare value, not a tuple, for a single field.
+        self.values = (
+            itemgetter(*fields) if len(fields) > 1
+            else lambda values: tuple(values[field] for field in fields))
+        
+        
+    def format(self, **values):
+        """Format the template, as str.format would."""
+        return self.template % self.values(values)
+    
+
+# -- Table rendering -----------------------------------------------------------
+
+# LaTeX's special characters, and the spaces that follow those escaped by
+# control words, which would otherwise swallow them; as pandas escapes them.
+LATEX_SPECIAL = re.compile(r'([\\~^])( ?)|[&%$#_{}]')
+LATEX_ESCAPES = {
+    '\\': '\\textbackslash ', '~': '\\textasciitilde ', '^': '\\textasciicircum '}
+
+# Characters, other than new lines, that str.splitlines also splits on.
+LINE_BREAKS = re.compile(r'[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+def latex_escape(match):
+    """The escaped form of a LATEX_SPECIAL match."""
+    
+    char, space = match.group(1), match.group(2)
+    
+    if char is None:
+        return '\\' + match.group()
+    
+    return LATEX_ESCAPES[char] + ('\\space ' if space else '')
+
+
+def format_cell(value, precision, escape):
+    """Format a single table cell, label or name, as DataFrame.to_latex does."""
+    
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value) is True):
+        return 'NaN'
+    
+    if isinstance(value, str):
+        return LATEX_SPECIAL.sub(latex_escape, value) if escape else value
+    
+    if is_float(value) or is_complex(value):
+        return '{:.{}f}'.format(value, precision)
+    
+    return str(value)
+
+
+def format_cells(values, precision, escape):
+    """Format a column, or the index or column labels, as a list of strings.
+    
+    The common dtypes are formatted a column at a time, without checking the
+    type of each cell; others a cell at a time, by format_cell.
+    """
+    
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    dtype = values.dtype
+    
+    if len(values) == 0:
+        return []
+    
+    # Integers and bools can't be missing, with numpy dtypes.
+    if is_bool_dtype(dtype) and dtype == np.bool_:
+        return np.where(values.to_numpy(), 'True', 'False').tolist()
+    
+    # Mapping a format over a column's values is quicker than numpy.char.
+    if is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+        return list(map(str, values.tolist()))
+    
+    if is_float_dtype(dtype) and isinstance(dtype, np.dtype):
+        array = values.to_numpy()
+        cells = list(map('%.{}f'.format(precision).__mod__, array.tolist()))
+        
+        for missing in np.flatnonzero(np.isnan(array)).tolist():
+            cells[missing] = 'NaN'
+            
+        return cells
+    
+    # Columns of strings, with or without missing values; each distinct
+    # string is escaped once. Missing values have code -1, i.e. the last.
+    if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        codes, strings = pd.factorize(values)
+        
+        cells = [LATEX_SPECIAL.sub(latex_escape, string) if escape else string 
+                 for string in strings.tolist()]
+        
+        return np.array(cells + ['NaN'], dtype=object)[codes].tolist()
+    
+    return [format_cell(value, precision, escape) for value in values.tolist()]
+
+
+def latex_tabular(data, escape=True, indent=''):
+    """Render a dataframe as a LaTeX tabular, as DataFrame.to_latex does.
+    
+    The output matches `data.to_latex(escape=escape)` for dataframes with a
+    flat index and columns. But, rather than formatting cell by cell through
+    pandas' Styler and its templates, columns are formatted a whole column
+    at a time and the indented output is assembled in one pass. It also
+    renders tables beyond the Styler's limit of 262144 cells.
+    
+    Args:
+        data: the dataframe, or a series.
+        escape: escape LaTeX's special characters in strings.
+        indent: the indent of each line after the first, e.g. to nest the
+          tabular in a definition.
+        
+    Returns:
+        The tabular, ending with a new line.
+    """
+    
+    # A series is shown as a one column frame, as Series.to_latex does.
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+        
+    # The Styler handles hierarchical indexes and empty frames.
+    if (isinstance(data.index, pd.MultiIndex) or isinstance(data.columns, pd.MultiIndex) 
+            or len(data.columns) == 0):
+        return indent.join(data.to_latex(escape=escape).splitlines(True))
+    
+    precision = pd.get_option('styler.format.precision')
+    
+    column_format = 'l' + ''.join(
+        'r' if is_numeric_dtype(dtype) else 'l' for dtype in data.dtypes)
+    
+    def name(value):
+        return '' if value is None else format_cell(value, precision, escape)
+    
+    lines = ['\\begin{{tabular}}{{{}}}'.format(column_format), '\\toprule']
+    
+    lines.append(' & '.join(
+        [name(data.columns.name)] + format_cells(data.columns, precision, escape)) + ' \\\\')
+    
+    if data.index.name is not None:
+        lines.append(' & '.join([name(data.index.name)] + [''] * len(data.columns)) + ' \\\\')
+        
+    lines.append('\\midrule')
+    
+    # The rows, joined a column at a time.
+    columns = [format_cells(data.index, precision, escape)] + [
+        format_cells(data.iloc[:, i], precision, escape) for i in range(len(data.columns))]
+    
+    if len(data):
+        lines.append((' \\\\\n' + indent).join(map(' & '.join, zip(*columns))) + ' \\\\')
+    
+    lines.extend(['\\bottomrule', '\\end{tabular}'])
+    
+    tabular = ('\n' + indent).join(lines) + '\n'
+    
+    # Cells that span lines are indented line by line, as str.splitlines does.
+    if indent and (LINE_BREAKS.search(tabular) 
+                   or tabular.count('\n') != len(lines) + max(len(data) - 1, 0)):
+        return indent.join(latex_tabular(data, escape).splitlines(True))
+        
+    return tabular
+
+
+# tabulate's numbers with thousands separators, which it parses as numbers.
+THOUSANDS_NUMBER = re.compile(r'^(([+-]?[0-9]{1,3})(?:,([0-9]{3}))*)?(?(1)\.[0-9]*|\.[0-9]+)?$')
+
+# The ranks of the column types tabulate infers from cell types, from the
+# least to the most generic; cells of other types aren't handled.
+CELL_RANKS = dict.fromkeys([type(None)], 0)
+CELL_RANKS.update(dict.fromkeys([bool], 1))
+CELL_RANKS.update(dict.fromkeys([int, np.int8, np.int16, np.int32, np.int64], 2))
+CELL_RANKS.update(dict.fromkeys(
+    [float, np.float16, np.float32, np.float64, np.bool_,
+     np.uint8, np.uint16, np.uint32, np.uint64], 3))
+CELL_RANKS.update(dict.fromkeys(
+    [str, pd.Timestamp, datetime.datetime, datetime.date, datetime.time], 5))
+
+
+def is_plain_text(string):
+    """Is a string shown as is by tabulate, rather than parsed as a number?
+    
+    Strings that tabulate would parse as numbers or bools, or that have
+    non-printable or non-ASCII characters, whose widths tabulate measures
+    differently, are not plain.
+    """
+    
+    if (string in ('', 'True', 'False') or not (string.isascii() and string.isprintable())
+            or THOUSANDS_NUMBER.match(string)):
+        return False
+    
+    try:
+        float(string)
+        
+    except ValueError:
+        return True
+    
+    return False
+
+
+def afterpoint(cell):
+    """The digits after the decimal point of a number, as tabulate counts them."""
+    
+    # Ints, and the bools that may share a column with them, have no point.
+    if not cell or cell in ('True', 'False') or cell.lstrip('-').isdigit():
+        return -1
+    
+    point = cell.rfind('.')
+    point = cell.rfind('e') if point < 0 else point
+    
+    return len(cell) - point - 1 if point >= 0 else -1
+
+
+def pipe_cells(values, kind):
+    """Format a column, or the index, for a pipe table, as tabulate does.
+    
+    Args:
+        values: a list of the column's values.
+        kind: the kind of the dtype of the array the values came from; 
+          tabulate sees numpy scalars, rather than Python values, in numeric
+          arrays.
+            
+    Returns:
+        The formatted cells and the type of the column, int, float or str,
+        or None if the column's values are not handled.
+    """
+    
+    # Numeric arrays; only numpy's signed integers count as ints to tabulate.
+    if kind == 'i':
+        return list(map(str, values)), int
+    
+    if kind in 'ufb':
+        return list(map('%g'.__mod__, map(float, values))), float
+    
+    if kind != 'O':
+        return None
+    
+    # Columns of Python values; the type of the column is the most generic
+    # of the types of its values, starting from bool.
+    types = set(map(type, values))
+    
+    if not types.issubset(CELL_RANKS):
+        return None
+    
+    rank = max([1] + [CELL_RANKS[cell_type] for cell_type in types])
+    
+    if str in types and not all(
+            map(is_plain_text, {value for value in values if type(value) is str})):
+        return None
+    
+    if rank == 3:
+        return ['' if value is None else '%g' % float(value) for value in values], float
+    
+    cells = ['' if value is None else str(value) for value in values]
+    
+    if rank == 5 and not all(cell.isascii() and cell.isprintable() for cell in set(cells)):
+        return None
+    
+    return cells, int if rank == 2 else str
+
+
+def pipe_table(data):
+    """Render a dataframe as a Markdown pipe table, as tabulate does.
+    
+    The output is identical to `tabulate(data, headers='keys', tablefmt='pipe')`.
+    But rather than parse, type and measure every cell, each column is typed
+    from the types of its values, and formatted, aligned and measured a whole
+    column at a time. Tables that tabulate would treat specially, e.g. with
+    strings that look like numbers or multi-line or wide characters, are
+    rendered by tabulate.
+    
+    Args:
+        data: the dataframe, or a series.
+        
+    Returns:
+        The table, without a final new line.
+    """
+    
+    # A series is shown as a one column frame.
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+        
+    def fallback():
+        return tabulate(data, headers='keys', tablefmt='pipe')
+    
+    if (isinstance(data.index, pd.MultiIndex) or isinstance(data.columns, pd.MultiIndex) 
+            or data.empty):
+        return fallback()
+    
+    headers = ['' if data.index.name is None else str(data.index.name)] + list(
+        map(str, data.columns))
+    
+    if not all(header.isascii() and header.isprintable() for header in headers):
+        return fallback()
+    
+    # tabulate reads the values as one array, so e.g. ints are floats in a
+    # table of ints and floats.
+    values = data.values
+    
+    columns = [pipe_cells(data.index.tolist(), 'O')] + [
+        pipe_cells(values[:, i].tolist(), values.dtype.kind) for i in range(values.shape[1])]
+    
+    if None in columns:
+        return fallback()
+    
+    header_cells, lines, rule = [], [], []
+    
+    for i, (header, (cells, column_type)) in enumerate(zip(headers, columns)):
+        
+        numeric = column_type is not str
+        
+        # Numbers are aligned on their decimal points, and to the right.
+        if column_type is float:
+            points = list(map(afterpoint, cells))
+            most = max(points)
+            
+            if min(points) != most:
+                cells = [cell + ' ' * (most - point) for cell, point in zip(cells, points)]
+                
+        elif not numeric:
+            cells = [cell.strip() for cell in cells]
+            
+        width = max(len(header) + 2, max(map(len, cells)))
+        
+        if numeric:
+            columns[i] = [cell.rjust(width) for cell in cells]
+            header_cells.append(header.rjust(width))
+            rule.append('-' * (width + 1) + ':')
+            
+        else:
+            columns[i] = [cell.ljust(width) for cell in cells]
+            header_cells.append(header.ljust(width))
+            rule.append(':' + '-' * (width + 1))
+            
+    lines.append('| ' + ' | '.join(header_cells) + ' |')
+    lines.append('|' + '|'.join(rule) + '|')
+    lines.extend('| ' + ' | '.join(row) + ' |' for row in zip(*columns))
+    
+    return '\n'.join(lines)
+
+
 # -- For Latex exports ---------------------------------------------------------
 
 class Formatter():
     
     def __init__(self):
         pass
+
+    body_end = '}\n\n'  # Every definition string ends with its body and this.
+    
+    @classmethod
+    def definition_body(cls, def_str, name):
+        """Extract the body of a definition from its definition string.
         
-class Latex():
+        The body is the text that a reference to the definition stands
+        for, e.g. the value of a value export, without the meta-data.
+        """
+        
+        marker = cls.body_marker.format(name=name)
+        start = def_str.index(marker) + len(marker)
+        
+        return def_str[start:-len(cls.body_end)]
+
+    @staticmethod
+    def truncated(truncated):
+        """Generate the meta data line noting a truncated table definition."""
+        return '% Truncated: {}\n'.format(truncated) if truncated else ''
+    
+        
+class Latex(Formatter):
     """Generate formatted latex definitions for exports.
 
     Each definition is implemented as a Latex \newcommand. But in fact we
@@ -66,92 +455,108 @@ class Latex():
     src_path = 'tex/'                    # The src latex dir
     includes_filename = 'kallysto.tex'  # The name of the includes file
     defs_filename = '_definitions.tex'
+    name_pattern = r'^\\renewcommand\{\\([^}]*)\}'  # Finds a definition's name.
+    body_marker = '\\renewcommand{{\\{name}}}{{\n'  # Precedes a definition's body.
+    image_formats = ('pdf', 'eps', 'png', 'jpg', 'jpeg')  # In order of preference.
+
+    # The definition templates.
+    value_template = Template(
+        '% Uid: {uid}\n'
+        '% Created: {created}\n'
+        '% Exported: {exported}\n'
+        '% Title: {title}\n'
+        '% Notebook: {notebook}\n'
+        '% Data file: {data_file}\n'
+        '\\providecommand{{\{name}}}{{\n'
+        'dummy}}\n'
+        '\\renewcommand{{\{name}}}{{\n'
+        '{value}}}\n\n')
+
+    table_template = Template(
+        '% Uid: {uid}\n'
+        '% Created: {created}\n'
+        '% Exported: {exported}\n'
+        '% Title: {title}\n'
+        '% Notebook: {notebook}\n'
+        '% Data file: {data_file}\n'
+        '{truncated}'
+        '\\providecommand{{\{name}}}{{\n'
+        'dummy}}\n'
+        '\\renewcommand{{\{name}}}{{\n'
+        '    \\begin{{table}}[htbp]\n'
+        '        \\centering\n'
+        '        {definition}\n'
+        '        \\caption{{{caption}}}\n'
+        '        \\label{{{name}}}\n'
+        '    \\end{{table}}\n'
+        '}}\n\n')
+
+    figure_template = Template(
+        '% Uid: {uid}\n'
+        '% Created: {created}\n'
+        '% Exported: {exported}\n'
+        '% Title: {title}\n'
+        '% Notebook: {notebook}\n'
+        '% Image file: {image_file}\n'
+        '% Data file: {data_file}\n'
+        '\\providecommand{{\{name}}}{{\n'
+        'dummy}}\n'
+        '\\renewcommand{{\{name}}}{{\n'
+        '    \\begin{{figure}}\n'
+        '        \\center\n'
+        '        \\includegraphics[width={text_width}\\textwidth]'
+        '{{{image_file}}}\n'
+        '        \\caption{{{caption}}}\n'
+        '        \\label{{{name}}}\n'
+        '    \\end{{figure}}\n'
+        '}}\n\n')
     
 
     @staticmethod
     def value(export, pub):
-        msg = ('% Uid: {uid}\n'
-               '% Created: {created}\n'
-               '% Exported: {exported}\n'
-               '% Title: {title}\n'
-               '% Notebook: {notebook}\n'
-               '% Data file: {data_file}\n'
-               '\\providecommand{{\{name}}}{{\n'
-               'dummy}}\n'
-               '\\renewcommand{{\{name}}}{{\n'
-               '{value}}}\n\n')
-        
-        return msg.format(uid=export.uid,
-                          created=export.created,
-                          exported=strftime('%X %x %Z'),
-                          title=pub.title,
-                          notebook=export.path_to(pub.src_path, pub.notebook_file),
-                          data_file=export.path_to(pub.src_path, pub.data_file(export.data_file)),       
-                          name=export.name,
-                          value=export.value)
+        return Latex.value_template.format(
+            uid=export.uid,
+            created=export.created,
+            exported=strftime('%X %x %Z'),
+            title=pub.title,
+            notebook=pub.relative_path(pub.notebook_file, pub.src_path),
+            data_file=pub.relative_path(pub.data_file(export.data_file), pub.src_path),
+            name=export.name,
+            value=export.value)
 
     @staticmethod
     def table(export, pub):
-        msg = ('% Uid: {uid}\n'
-               '% Created: {created}\n'
-               '% Exported: {exported}\n'
-               '% Title: {title}\n'
-               '% Notebook: {notebook}\n'
-               '% Data file: {data_file}\n'
-               '\\providecommand{{\{name}}}{{\n'
-               'dummy}}\n'
-               '\\renewcommand{{\{name}}}{{\n'
-               '    \\begin{{table}}[htbp]\n'
-               '        \\centering\n'
-               '        {definition}\n'
-               '        \\caption{{{caption}}}\n'
-               '        \\label{{{name}}}\n'
-               '    \\end{{table}}\n'
-               '}}\n\n')
+        # The definition shows the table data within its rendering budget.
+        data, truncated = export.preview(pub)
         
-        indented = '\t\t\t'.join(export.data.to_latex().splitlines(True))
+        indented = latex_tabular(data, indent='\t\t\t')
         
-        return msg.format(uid=export.uid,
-                          created=export.created,
-                          exported=strftime('%X %x %Z'),
-                          title=pub.title,
-                          notebook=export.path_to(pub.src_path, pub.notebook_file),
-                          data_file=export.path_to(pub.src_path, pub.data_file(export.data_file)), 
-                          name=export.name,
-                          caption=export.caption,
-                          definition=indented)
+        return Latex.table_template.format(
+            uid=export.uid,
+            created=export.created,
+            exported=strftime('%X %x %Z'),
+            title=pub.title,
+            notebook=pub.relative_path(pub.notebook_file, pub.src_path),
+            data_file=pub.relative_path(pub.data_file(export.data_file), pub.src_path),
+            name=export.name,
+            caption=export.caption,
+            truncated=Latex.truncated(truncated),
+            definition=indented)
 
     @staticmethod
     def figure(export, pub):
-        msg = ('% Uid: {uid}\n'
-               '% Created: {created}\n'
-               '% Exported: {exported}\n'
-               '% Title: {title}\n'
-               '% Notebook: {notebook}\n'
-               '% Image file: {image_file}\n'
-               '% Data file: {data_file}\n'
-               '\\providecommand{{\{name}}}{{\n'
-               'dummy}}\n'
-               '\\renewcommand{{\{name}}}{{\n'
-               '    \\begin{{figure}}\n'
-               '        \\center\n'
-               '        \\includegraphics[width={text_width}\\textwidth]'
-               '{{{image_file}}}\n'
-               '        \\caption{{{caption}}}\n'
-               '        \\label{{{name}}}\n'
-               '    \\end{{figure}}\n'
-               '}}\n\n')
-
-        return msg.format(uid=export.uid,
-                          created=export.created,
-                          exported=strftime('%X %x %Z'),
-                          title=pub.title,
-                          notebook=export.path_to(pub.src_path, pub.notebook_file),
-                          data_file=export.path_to(pub.src_path, pub.data_file(export.data_file)), 
-                          name=export.name,
-                          text_width=export.text_width,
-                          caption=export.caption,
-                          image_file=export.path_to(pub.src_path, pub.fig_file(export.image_file)))
+        return Latex.figure_template.format(
+            uid=export.uid,
+            created=export.created,
+            exported=strftime('%X %x %Z'),
+            title=pub.title,
+            notebook=pub.relative_path(pub.notebook_file, pub.src_path),
+            data_file=pub.relative_path(pub.data_file(export.data_file), pub.src_path),
+            name=export.name,
+            text_width=export.text_width,
+            caption=export.caption,
+            image_file=pub.relative_path(
+                pub.fig_file(export.image_file_for(Latex)), pub.src_path))
 
     @staticmethod
     def include(pub):
@@ -165,80 +570,94 @@ class Latex():
 
 
     
-class Markdown():
+class Markdown(Formatter):
     
     src_path = 'md/'                    # The src markdown dir
     includes_filename = 'kallysto.kmd'  # The name of the includes file
     defs_filename = '_definitions.kmd'
+    name_pattern = r'^\{([^:\n]*):'  # Finds a definition's name.
+    body_marker = '{{{name}:'  # Precedes a definition's body.
+    image_formats = ('svg', 'png', 'jpg', 'jpeg', 'gif')  # In order of preference.
+
+    # The definition templates.
+    value_template = Template(
+        '% Uid: {uid}\n'
+        '% Created: {created}\n'
+        '% Exported: {exported}\n'
+        '% Title: {title}\n'
+        '% Notebook: {notebook}\n'
+        '% Data file: {data_file}\n'
+        '{{{name}:{value}}}\n\n')
+
+    table_template = Template(
+        '% Uid: {uid}\n'
+        '% Created: {created}\n'
+        '% Exported: {exported}\n'
+        '% Title: {title}\n'
+        '% Notebook: {notebook}\n'
+        '% Data file: {data_file}\n'
+        '{truncated}'
+        '{{{name}:{definition}}}\n\n')
+
+    figure_template = Template(
+        '% Uid: {uid}\n'
+        '% Created: {created}\n'
+        '% Exported: {exported}\n'
+        '% Title: {title}\n'
+        '% Notebook: {notebook}\n'
+        '% Image file: {image_file}\n'
+        '% Data file: {data_file}\n'
+        '{{{name}:{definition}}}\n\n')
 
 
     @staticmethod
     def value(export, pub):
-        msg = ('% Uid: {uid}\n'
-               '% Created: {created}\n'
-               '% Exported: {exported}\n'
-               '% Title: {title}\n'
-               '% Notebook: {notebook}\n'
-               '% Data file: {data_file}\n'
-               '{{{name}:{value}}}\n\n')
-        
-        return msg.format(uid=export.uid,
-                          created=export.created,
-                          exported=strftime('%X %x %Z'),
-                          title=pub.title,
-                          notebook=export.path_to(pub.src_path, pub.notebook_file),
-                          data_file=export.path_to(pub.src_path, pub.data_file(export.data_file)),          
-                          name=export.name,
-                          value=export.value)
+        return Markdown.value_template.format(
+            uid=export.uid,
+            created=export.created,
+            exported=strftime('%X %x %Z'),
+            title=pub.title,
+            notebook=pub.relative_path(pub.notebook_file, pub.src_path),
+            data_file=pub.relative_path(pub.data_file(export.data_file), pub.src_path),
+            name=export.name,
+            value=export.value)
 
     @staticmethod
     def table(export, pub):
-        msg = ('% Uid: {uid}\n'
-               '% Created: {created}\n'
-               '% Exported: {exported}\n'
-               '% Title: {title}\n'
-               '% Notebook: {notebook}\n'
-               '% Data file: {data_file}\n'
-               '{{{name}:{definition}}}\n\n')
-
-        # For the table definition we use tabulate to produce a simple
-        # ascii based table which befores the defintion.
-        def_str = tabulate(export.data, headers='keys', tablefmt='pipe')
+        # For the table definition we produce a simple ascii based (pipe)
+        # table, as tabulate would, which befores the defintion; within the
+        # table's rendering budget.
+        data, truncated = export.preview(pub)
+        def_str = pipe_table(data)
         
-        return msg.format(uid=export.uid,
-                          created=export.created,
-                          exported=strftime('%X %x %Z'),
-                          title=pub.title,
-                          notebook=export.path_to(pub.src_path, pub.notebook_file),
-                          data_file=export.path_to(pub.src_path, pub.data_file(export.data_file)),   
-                          name=export.name,
-                          definition=def_str)
+        return Markdown.table_template.format(
+            uid=export.uid,
+            created=export.created,
+            exported=strftime('%X %x %Z'),
+            title=pub.title,
+            notebook=pub.relative_path(pub.notebook_file, pub.src_path),
+            data_file=pub.relative_path(pub.data_file(export.data_file), pub.src_path),
+            name=export.name,
+            truncated=Markdown.truncated(truncated),
+            definition=def_str)
 
     @staticmethod
     def figure(export, pub):
-        msg = ('% Uid: {uid}\n'
-               '% Created: {created}\n'
-               '% Exported: {exported}\n'
-               '% Title: {title}\n'
-               '% Notebook: {notebook}\n'
-               '% Image file: {image_file}\n'
-               '% Data file: {data_file}\n'
-               '{{{name}:{definition}}}\n\n')
-
-        def_str = '![{}]({} "{}")'.format(
-            export.name, 
-            export.path_to(pub.src_path, pub.fig_file(export.image_file)), 
-            export.caption)
+        image_file = pub.relative_path(
+            pub.fig_file(export.image_file_for(Markdown)), pub.src_path)
+        
+        def_str = '![{}]({} "{}")'.format(export.name, image_file, export.caption)
         
-        return msg.format(uid=export.uid,
-                          created=export.created,
-                          exported=strftime('%X %x %Z'),
-                          title=pub.title,
-                          notebook=export.path_to(pub.src_path, pub.notebook_file),
-                          data_file=export.path_to(pub.src_path, pub.data_file(export.data_file)),
-                          image_file=export.path_to(pub.src_path, pub.fig_file(export.image_file)),
-                          name=export.name,
-                          definition=def_str)
+        return Markdown.figure_template.format(
+            uid=export.uid,
+            created=export.created,
+            exported=strftime('%X %x %Z'),
+            title=pub.title,
+            notebook=pub.relative_path(pub.notebook_file, pub.src_path),
+            data_file=pub.relative_path(pub.data_file(export.data_file), pub.src_path),
+            image_file=image_file,
+            name=export.name,
+            definition=def_str)
 
 
     @staticmethod
@@ -37,6 +37,9 @@
 import os
 import re
 
+from kallysto import definitions
+from kallysto.fileio import locked
+
 def to_markdown(kmd_file, include_file):
     """Convert a Kallysto markdown file to a standard markdown file.
     
@@ -50,8 +53,9 @@ def to_markdown(kmd_file, include_file):
         include_file: a text file with a list of paths to export defintion files.
     """
     
-    # Read the export definitions.
-    defs_dict = include_defintions(include_file)
+    # Read the export definitions; indexed definitions files are only
+    # read for the definitions that the kmd_file refers to.
+    defs_dict = include_defintions(include_file, find_references(kmd_file))
     
     # Replace the references in the kmd_file with the
     # corresponding definition and return the resulting md.
@@ -66,11 +70,23 @@ def to_markdown(kmd_file, include_file):
     return md_file
     
     
-def include_defintions(include_file):
+def find_references(kmd_file):
+    """Find the names of the definitions referenced in the kmd_file."""
+    
+    with open(kmd_file, 'r') as kmd:
+        return set(re.findall(r'\{(.*?)\}', kmd.read(), re.DOTALL))
+    
+    
+def include_defintions(include_file, names=None):
     """Read in the Kallysto definitions referenced in the include_file.
     
+    If a definitions file has an indexed definitions file alongside it
+    then the definitions are read from that instead, by random access.
+    
     Args:
         include_file: a text file with a list of paths to export defintion files.
+        names: the names of the definitions needed; all if None. Only
+          indexed definitions files can be read selectively.
         
     Returns:
         A dict of definitions, {name:value}
@@ -89,9 +105,20 @@ def include_defintions(include_file):
             
             # Locate the definitions_file relative to the cwd.
             path_to_defs = os.path.relpath(
-                path_to_include + '/' + definitions_file, start=cwd)
-        
-            defs_dict = read_definitions(path_to_defs, defs_dict)
+                path_to_include + '/' + definitions_file.strip(), start=cwd)
+            
+            defs_dir = os.path.dirname(path_to_defs)
+            records_file = os.path.join(defs_dir, definitions.RECORDS_FILENAME)
+            index_file = os.path.join(defs_dir, definitions.INDEX_FILENAME)
+            
+            # The lock keeps the records and index consistent while reading.
+            if os.path.isfile(index_file):
+                with locked(records_file):
+                    defs_dict.update(
+                        definitions.read_definitions(records_file, index_file, names))
+                
+            else:
+                defs_dict = read_definitions(path_to_defs, defs_dict)
         
         return defs_dict
 
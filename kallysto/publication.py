@@ -34,12 +34,174 @@
 
 # -- Publication ---------------------------------------------------------
 
+import hashlib
 import logging
 import os
+import pickle
+import re
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait)
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain
+from multiprocessing import get_context
 from shutil import rmtree
+from time import mktime, strftime, strptime, time
+from uuid import uuid4
 
+import pandas as pd
+
+from kallysto import audit, build, definitions
 from kallysto.formatter import Latex, Markdown
-from kallysto.export import Export
+from kallysto.export import (
+    Export, ExportRecord, TRUNCATE_STRATEGIES, digest_figure, save_images)
+from kallysto.fileio import locked, temp_path
+from kallysto.storage import LocalStorage
+
+# The supported formats for table and figure data files.
+DATA_FORMATS = ('csv', 'parquet', 'feather')
+
+
+def use_agg_backend():
+    """Initialise a figure rendering worker to use the non-GUI Agg backend."""
+    import matplotlib
+    matplotlib.use('Agg')
+    
+    
+def delete_trash(folder):
+    """Delete a trashed datastore folder, in the background."""
+    
+    try:
+        rmtree(folder, ignore_errors=True)
+        
+    finally:
+        trash_being_deleted.discard(folder)
+
+
+def scan_folder(folder):
+    """List the files and sub-folders of a folder, in one scan."""
+    
+    files, folders = [], []
+    
+    for entry in os.scandir(folder):
+        if entry.is_dir(follow_symlinks=False):
+            folders.append(entry.path)
+            
+        elif entry.is_file():
+            files.append(entry.path)
+            
+    return files, folders
+
+
+def scan_files(roots, pool):
+    """List the files beneath roots, scanning each folder as a task in pool."""
+    
+    files = []
+    pending = {pool.submit(scan_folder, root) for root in roots if os.path.isdir(root)}
+    
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        
+        for future in done:
+            folder_files, folders = future.result()
+            
+            files.extend(folder_files)
+            pending.update(pool.submit(scan_folder, folder) for folder in folders)
+            
+    return files
+
+
+# The pool that deletes trashed folders, created on first use, and the
+# folders it has been asked to delete.
+cleanup_pool = None
+trash_being_deleted = set()
+    
+    
+def render_figure(pickled_image, image_paths, dpis, 
+                  digest_parts=None, stored_digest=None, files=()):
+    """Render a pickled matplotlib figure in each format in a worker process.
+    
+    The figure is also digested here, rather than in the notebook's process,
+    if its digest is needed. Its images are not rewritten if its digest
+    matches its stored digest and all of its files are still present.
+    
+    Args:
+        digest_parts: the parts of the figure's digest, other than its image;
+          see `Figure.digest_parts`. None if the figure is not digested.
+        stored_digest: the digest stored for the figure, for change detection.
+        files: the figure's files, which must be present to skip the render.
+        
+    Returns:
+        The figure's digest, or None, and whether its images were written.
+    """
+    
+    image = pickle.loads(pickled_image)
+    digest, rasters = None, {}
+    
+    if digest_parts is not None:
+        digest, rasters = digest_figure(image, *digest_parts)
+        
+        if (stored_digest is not None and digest == stored_digest 
+                and all(os.path.isfile(file) for file in files)):
+            return digest, False
+    
+    save_images(image, image_paths, dpis, rasters)
+    
+    return digest, True
+
+
+class LinkWriters(object):
+    """The definitions and audit loggers shared by the links to a notebook.
+    
+    Creating a Publication again for the same (pub_path, title, notebook),
+    e.g. by re-running a notebook cell, reuses the loggers, and their open
+    files, of the earlier links rather than adding more handlers. There is
+    one logger, with a single handler, for each file. The writers are
+    counted by the links that use them and their files are closed when
+    the last of these links is closed.
+    """
+    
+    def __init__(self, title, notebook, storage):
+        self.title, self.notebook = title, notebook
+        self.storage = storage
+        self.loggers = {}  # {(kind, filepath):logger}
+        self.links = 0
+        
+        
+    def logger(self, kind, filepath):
+        """The logger that writes records to filepath; created on first use.
+        
+        Loggers are created outside of logging's registry, so they are only
+        shared via LinkWriters, and they don't propagate to the root logger.
+        Their handlers append to the file via the storage backend.
+        """
+        
+        key = (kind, os.path.abspath(filepath))
+        
+        if key not in self.loggers:
+            logger = logging.Logger(
+                '{}_{}:{}'.format(kind, self.title, self.notebook), logging.INFO)
+            logger.addHandler(self.storage.log_handler(filepath))
+            
+            self.loggers[key] = logger
+            
+        return self.loggers[key]
+    
+    
+    def close(self):
+        """Close the files of all of the loggers."""
+        
+        for logger in self.loggers.values():
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+                
+        self.loggers = {}
+
+
+# The writers of the open links, by (storage, pub_path, title, notebook).
+link_writers = {}
+
 
 class Publication(object):
     """Link a notebook to a publication and its Kallysto export datastore.
@@ -65,6 +227,15 @@ class Publication(object):
                  write_defs=True,
                  overwrite=False, fresh_start=False,
                  pub_path='../../pubs/',  # From notebook to pubs root
+                 detect_changes=True,
+                 data_format='csv', csv_copy=False,
+                 render_workers=0,
+                 table_max_rows=None, table_max_cols=None, table_truncate='head',
+                 lean=False, blob_store=False,
+                 compact_defs=False, indexed_defs=False,
+                 log_max_bytes=None, log_max_age=None, log_compression='gzip',
+                 segmented_log=False, lazy_setup=False,
+                 storage=None, fast_reset=False, build_stamps=False,
                 ):
 
         """Create a new link from the current notebook/script to a Kallysto publciation.
@@ -87,6 +258,70 @@ class Publication(object):
             pub_root: path from notebook to publication root; the publication data 
             store (title) will be created inside the pub_root.
 
+            detect_changes: skip writing data/image files for exports whose
+            content digest matches the digest stored by their last export.
+
+            data_format: the format of table and figure data files; csv, or
+            one of the columnar formats parquet or feather.
+
+            csv_copy: also write a csv copy of columnar data files?
+
+            render_workers: the number of worker processes used to render
+            figure images in the background; 0 renders figures synchronously.
+            Background exports are completed by `wait`.
+
+            table_max_rows: the default maximum rows shown in table definitions;
+            the full data is always written to the data file.
+
+            table_max_cols: the default maximum columns shown in table definitions.
+
+            table_truncate: how the rows of over-long table definitions are
+            chosen by default; head, tail, or sample.
+
+            lean: release each export's payload once it has been persisted
+            and return a compact `ExportRecord` in place of the export.
+
+            blob_store: store the content of data and image files once, by
+            digest, in the publication's blob store; the per-notebook files
+            become hard links to the blobs.
+
+            compact_defs: compact the notebook's definitions file, keeping only
+            the latest definition of each export, when the link is created.
+
+            indexed_defs: also write the definitions to an indexed definitions
+            file, so that converters can read individual definitions by name.
+
+            log_max_bytes: rotate the audit log into a compressed archive
+            segment before it grows beyond this size.
+
+            log_max_age: rotate the audit log once its first entry is older
+            than this; seconds, or a timedelta or string (e.g. '30 days').
+
+            log_compression: the compression of archived audit log segments;
+            gzip or xz.
+
+            segmented_log: append audit log entries to a log segment for this
+            notebook and process, rather than the shared kallysto.log, so that
+            concurrent writers don't contend for one file; see `compact_log`.
+
+            lazy_setup: defer creating the datastore folders and files, the
+            loggers and the includes entry until the first export, so that
+            links that never export cost (almost) nothing to create.
+
+            storage: the storage backend for the datastore; a LocalStorage
+            (the local file system) by default, or e.g. a MemoryStorage for
+            tests and dry runs. The blob store, background rendering, indexed
+            definitions, the audit log history and log rotation and segments
+            need local storage.
+
+            fast_reset: with overwrite or fresh_start, move the notebook's old
+            datastore folders out of the way, to `_kallysto/trash/`, and
+            delete them in the background; see `wait_for_cleanup`.
+
+            build_stamps: keep a build manifest of the notebook's exports and
+            touch stamp files, in `_kallysto/build/`, when their content or
+            definitions really change; for make/latexmk. See `stale`.
+
         """
         
         # A simple display logger that writes progress to screen.
@@ -95,9 +330,73 @@ class Publication(object):
         self.display_logger.setLevel(logging.INFO)
 
         self.formatter = formatter
+        
+        self.storage = storage or LocalStorage()
+        
+        local_only = dict(
+            blob_store=blob_store, render_workers=render_workers, 
+            indexed_defs=indexed_defs, segmented_log=segmented_log,
+            log_max_bytes=log_max_bytes, log_max_age=log_max_age,
+            build_stamps=build_stamps)
+        
+        for option, value in local_only.items():
+            if value and not self.storage.is_local:
+                self.require_local(option)
 
         self.write_defs = write_defs
         
+        self.detect_changes = detect_changes
+        
+        if data_format not in DATA_FORMATS:
+            raise ValueError('Unknown data format {!r}; expected one of {}.'.format(
+                data_format, ', '.join(DATA_FORMATS)))
+        
+        self.data_format = data_format
+        self.csv_copy = csv_copy
+        
+        # The default rendering budget for table definitions.
+        if table_truncate not in TRUNCATE_STRATEGIES:
+            raise ValueError('Unknown truncate strategy {!r}; expected one of {}.'.format(
+                table_truncate, ', '.join(TRUNCATE_STRATEGIES)))
+        
+        self.table_max_rows = table_max_rows
+        self.table_max_cols = table_max_cols
+        self.table_truncate = table_truncate
+        
+        # Background figure rendering; the pool is started on demand.
+        self.render_workers = render_workers
+        self.render_pool = None
+        self.pending_renders = []  # (future, export) pairs.
+        
+        # Audit log rotation.
+        if log_compression not in audit.COMPRESSIONS:
+            raise ValueError('Unknown log compression {!r}; expected one of {}.'.format(
+                log_compression, ', '.join(audit.COMPRESSIONS)))
+        
+        self.log_max_bytes = log_max_bytes
+        self.log_max_age = (
+            log_max_age if log_max_age is None or isinstance(log_max_age, (int, float))
+            else pd.Timedelta(log_max_age).total_seconds())
+        self.log_compression = log_compression
+        
+        self.lean = lean
+        self.blob_store = blob_store
+        self.indexed_defs = indexed_defs
+        self.build_stamps = build_stamps
+        
+        # Exports are only digested if something uses their digests.
+        self.needs_digests = detect_changes or indexed_defs or build_stamps
+        
+        # Identifies the exports of this run (link) in the audit log.
+        self.run = uuid4().hex
+        
+        # Exports buffered by `batch`; None when not batching.
+        self.batched_exports = None
+        
+        # The link's loggers, shared with other links to the notebook.
+        self.writers = None
+        self.closed = False
+        
         self.title, self.notebook = title, notebook        
         
         # Key Kallyso locations; at various times paths will be needed from/to
@@ -115,9 +414,29 @@ class Publication(object):
         self.figs_path = self.kallysto_path + 'figs/' + self.notebook + '/'
         self.defs_path = self.kallysto_path + 'defs/' + self.notebook + '/'
         self.logs_path = self.kallysto_path + 'logs/'
+        self.blobs_path = self.kallysto_path + 'blobs/'
+        self.build_path = self.kallysto_path + 'build/'
 
         self.defs_file = self.defs_path + self.formatter.defs_filename
+        self.indexed_defs_file = self.defs_path + definitions.RECORDS_FILENAME
+        self.defs_index_file = self.defs_path + definitions.INDEX_FILENAME
         self.logs_file = self.logs_path + 'kallysto.log'
+        self.logs_index_file = self.logs_path + audit.INDEX_FILENAME
+        
+        # The log file this link appends to; the shared log or its own segment.
+        self.log_segment_file = self.logs_file
+        
+        if segmented_log:
+            self.log_segment_file = audit.writer_segment(
+                self.logs_file, '{}-{}'.format(self.notebook, os.getpid()))
+        
+        # The digests of this notebook's exports, for change detection.
+        self.digests_file = self.data_path + '_digests.log'
+        self._digests = None  # Loaded on demand.
+        self.digest_lines = 0  # The lines in the digests file.
+        
+        # Relative paths between folders, by (folder, start); see relative_path.
+        self.relative_folders = {}
         
         # Publication src path, from the notebook.
         self.src_path = self.pub_path + self.title + '/' + self.formatter.src_path
@@ -126,10 +445,38 @@ class Publication(object):
         # Cleanup the data store as required.
         self.overwrite = overwrite
         self.fresh_start = fresh_start
+        self.fast_reset = fast_reset
+        self.trash_path = self.kallysto_path + 'trash/'
+        self.pending_cleanups = []  # Futures of background deletes.
 
         if self.overwrite or self.fresh_start:
             self.cleanup_data_store()
 
+        # Create/setup the Kallysto data store, now or on the first export.
+        self.ready = False
+        
+        if not lazy_setup:
+            self.setup()
+        
+        # Drop superseded definitions.
+        if compact_defs and self.write_defs:
+            self.compact_definitions()
+        
+
+    def require_local(self, feature):
+        """Raise an error, as a feature needs the datastore in local files."""
+        
+        if not self.storage.is_local:
+            raise ValueError('{} needs local storage, not {}.'.format(
+                feature, self.storage.__class__.__name__))
+        
+    
+    def setup(self):
+        """Create the datastore, loggers and includes entry, if not yet done."""
+        
+        if self.ready:
+            return
+        
         # Create/setup the Kallysto data store.
         self.setup_data_store()
 
@@ -139,7 +486,32 @@ class Publication(object):
         # Update kallysto.tex include file.
         self.update_kallyso_includes()
         
+        self.ready = True
+        
 
+    def relative_path(self, filepath, start):
+        """The relative path to a file from start, as os.path.relpath.
+        
+        Every export's definition and log entry refers to its files, and the
+        notebook, relative to the src and logs folders, so the relative paths
+        between these folders are computed once and cached.
+        """
+        
+        folder, filename = os.path.split(filepath)
+        
+        if filename in ('', os.curdir, os.pardir):
+            return os.path.relpath(filepath, start)
+        
+        try:
+            prefix = self.relative_folders[folder, start]
+            
+        except KeyError:
+            prefix = self.relative_folders[folder, start] = os.path.relpath(
+                folder or os.curdir, start)
+            
+        return filename if prefix == os.curdir else prefix + os.sep + filename
+        
+        
     # Generating paths to files within the Kallysto datastore.
     def data_file(self, filename):
         """Generate the Kallyso datastore path to a data file."""
@@ -149,6 +521,42 @@ class Publication(object):
         """Generate the Kallyso datastore path to a fig/image file."""
         return self.figs_path + '/' + filename
     
+    def data_filenames(self, stem):
+        """Generate the data filename, and optional csv copy, for an export."""
+        
+        data_file = '{}.{}'.format(stem, self.data_format)
+        
+        if self.csv_copy and self.data_format != 'csv':
+            return data_file, '{}.csv'.format(stem)
+        
+        return data_file, None
+    
+    def load_data(self, filename, memory_map=True):
+        """Read a table or figure data file back from the Kallysto datastore.
+        
+        Args:
+            filename: the name of the data file (e.g. export.data_file).
+            memory_map: memory-map columnar (parquet/feather) data files.
+            
+        Returns:
+            The dataframe stored in the data file.
+        """
+        
+        filepath = self.data_file(filename)
+        
+        # Local files are read by path, so that they can be memory-mapped.
+        if not self.storage.is_local:
+            filepath = self.storage.open(filepath, 'rb')
+        
+        if filename.endswith('.parquet'):
+            return pd.read_parquet(filepath, memory_map=memory_map)
+        
+        elif filename.endswith('.feather'):
+            from pyarrow import feather
+            return feather.read_table(filepath, memory_map=memory_map).to_pandas()
+        
+        return pd.read_csv(filepath, index_col=0)
+    
             
 # -- Init Helpers --------------------------------------------------------
 
@@ -165,11 +573,80 @@ class Publication(object):
         # If fresh_start then remove the includes file and the logs file.
         if self.fresh_start:
             self.safely_remove_file(self.includes_file)
-            self.safely_remove_file(self.logs_file)
+            for segment_file in audit.log_segments(self.logs_file):
+                self.safely_remove_file(segment_file)
+            self.safely_remove_file(self.logs_index_file)
         
         # Delete the Kallysto folders for the current notebook in the datastore.
-        for folder in [self.data_path, self.figs_path, self.defs_path]:
-            self.safely_remove_dir(folder)
+        if self.fast_reset and self.storage.is_local:
+            self.trash_folders([self.data_path, self.figs_path, self.defs_path])
+            
+        else:
+            for folder in [self.data_path, self.figs_path, self.defs_path]:
+                self.safely_remove_dir(folder)
+            
+            
+    def trash_folders(self, folders):
+        """Move folders to the trash and delete the trash in the background.
+        
+        Each folder is renamed into `_kallysto/trash/`, which is quick however
+        many files it holds, so that the new datastore can be created at once.
+        The trash, including any left by earlier resets that did not finish,
+        is then deleted by a background thread.
+        """
+        
+        os.makedirs(self.trash_path, exist_ok=True)
+        
+        for folder in folders:
+            if os.path.isdir(folder):
+                
+                # Unique names, as other notebooks may be resetting too.
+                trashed = self.trash_path + '{}-{}'.format(
+                    os.path.basename(os.path.normpath(folder)), uuid4().hex)
+                
+                try:
+                    os.rename(folder, trashed)
+                    
+                # Not renamable (e.g. in use on Windows); delete it now.
+                except OSError:
+                    self.safely_remove_dir(folder)
+                    
+        global cleanup_pool
+        
+        if cleanup_pool is None:
+            cleanup_pool = ThreadPoolExecutor(1)
+        
+        for entry in os.scandir(self.trash_path):
+            if entry.path not in trash_being_deleted:
+                trash_being_deleted.add(entry.path)
+                self.pending_cleanups.append(
+                    cleanup_pool.submit(delete_trash, entry.path))
+                
+        self.display_logger.info(
+            'Deleting %d trashed folders in the background.', len(self.pending_cleanups))
+        
+        
+    def cleanup_done(self):
+        """Have the background deletes of the old datastore finished?"""
+        return all(future.done() for future in self.pending_cleanups)
+    
+    
+    def wait_for_cleanup(self, timeout=None):
+        """Wait for the background deletes of the old datastore to finish.
+        
+        Args:
+            timeout: the maximum time to wait, in seconds; None waits forever.
+            
+        Returns:
+            True if the deletes have finished.
+        """
+        
+        done, not_done = wait(self.pending_cleanups, timeout)
+        
+        for future in done:
+            future.result()  # Re-raise any failure.
+            
+        return not not_done
 
         
     def setup_data_store(self):
@@ -188,53 +665,80 @@ class Publication(object):
 
         # Create the pub_root if it doesn't exist.
         self.display_logger.info('Creating %s.', self.pub_path)
-        os.makedirs(self.pub_path, exist_ok=True)
+        self.storage.makedirs(self.pub_path)
 
         # Create the target publication, if it doesn't exist;
         pub_title = self.pub_path + '/' + self.title
         self.display_logger.info('Creating %s.', pub_title)
-        os.makedirs(pub_title, exist_ok=True)
+        self.storage.makedirs(pub_title)
         
         # Create the datastore root.
-        os.makedirs(self.kallysto_path, exist_ok=True)
+        self.storage.makedirs(self.kallysto_path)
         
         # Create the main datastore subdirs.
-        [os.makedirs(folder, exist_ok=True)
+        [self.storage.makedirs(folder)
          for folder in [self.defs_path, self.figs_path, self.data_path, self.logs_path]]
         
+        if self.build_stamps:
+            self.storage.makedirs(self.build_path)
+        
         # Create a blank definitions file, but only if needed.
         if self.write_defs:
             defs_file = self.defs_file
             self.display_logger.info('Creating %s if it does not exist.', defs_file)
-            open(defs_file, 'a').close()
+            self.storage.append(defs_file, '')
+            
+        # The index starts with the definitions written without it, as
+        # converters read the index in place of the definitions file.
+        if self.write_defs and self.indexed_defs and not os.path.isfile(
+                self.defs_index_file):
+            self.seed_indexed_definitions()
+            
+        # An indexed definitions file left by a run with indexed_defs would
+        # be read, by converters, in place of the definitions written now.
+        if self.write_defs and not self.indexed_defs and self.storage.isfile(
+                self.defs_index_file):
+            with self.storage.locked(self.indexed_defs_file):
+                self.safely_remove_file(self.defs_index_file)
+                self.safely_remove_file(self.indexed_defs_file)
 
         # Create the Kallysto src folder.
-        os.makedirs(self.src_path, exist_ok=True)
+        self.storage.makedirs(self.src_path)
         
         # Create the log file.
-        open(self.logs_file, 'a').close()
+        self.storage.append(self.logs_file, '')
 
 
     def setup_logging(self):
         """Setup Kallysto's various loggers for reporting and logging to file."""
 
-        # A file-based logger to create the Kallyso log.
-        self.audit_logger = logging.getLogger(
-            "audit_{}:{}".format(self.title, self.notebook))
-        self.audit_logger.setLevel(logging.INFO)
-
-        # Setup audit logger filehandler based on logs_file.
-        audit_logger_handler = logging.FileHandler(self.logs_file)
-        self.audit_logger.addHandler(audit_logger_handler)
+        # Reuse the loggers of earlier links to the same notebook.
+        self.link_key = (
+            self.storage, os.path.abspath(self.pub_path), self.title, self.notebook)
+        
+        if self.link_key not in link_writers:
+            link_writers[self.link_key] = LinkWriters(
+                self.title, self.notebook, self.storage)
+            
+        self.writers = link_writers[self.link_key]
+        self.writers.links += 1
+        
+        # A file-based logger to create the Kallyso log, which appends to
+        # the log segment file.
+        self.audit_logger = self.writers.logger('audit', self.log_segment_file)
+        
+        # Short-lived writers leave their segments behind, so a new writer
+        # folds them into the log once they are too many to merge at once.
+        if (self.log_segment_file != self.logs_file and len(
+                audit.live_segments(self.logs_file)) > audit.MAX_OPEN_SEGMENTS):
+            folded = audit.compact_log(self.logs_file, self.logs_index_file)
+            
+            self.display_logger.info(
+                'Compacted %s; folded %d log segments.', self.logs_file, folded)
 
         # The definitions logger for writing the export defs.
         if self.write_defs:
-            self.defs_logger = logging.getLogger(
-                "defs_{}:{}".format(self.title, self.notebook))
-            self.defs_logger.setLevel(logging.INFO)
-            defs_logger_handler = logging.FileHandler(
-                self.defs_file)
-            self.defs_logger.addHandler(defs_logger_handler)
+            self.defs_logger = self.writers.logger('defs', self.defs_file)
 
     def update_kallyso_includes(self):
         """Update the publication's includes file.
@@ -249,17 +753,18 @@ class Publication(object):
         # The  Latex include statment for the current defs file.
         current_include = self.formatter.include(self)
         
-        # Open kallysto.tex for appending; create new file if necessary.
-        with open(self.includes_file, "a+") as kallysto:
-            
-            kallysto.seek(0)  # return to top of file first.
+        # Read kallysto.tex, if it exists, and append the include if needed.
+        # The lock stops other notebooks adding includes meanwhile.
+        with self.storage.locked(self.includes_file):
             
-            all_includes = kallysto.read()  # The current set of includes.
+            all_includes = (  # The current set of includes.
+                self.storage.read_text(self.includes_file) 
+                if self.storage.isfile(self.includes_file) else '')
             
             # If the current include is not in the file
             # then add it. Else do nothing.
             if current_include not in all_includes:
-                kallysto.write(current_include)  # Rewrite new include.
+                self.storage.append(self.includes_file, current_include)
 
 
 # -- Publication, Public API ---------------------------------------------
@@ -268,18 +773,853 @@ class Publication(object):
         """Write the export the definition and log the export.
         
         Write the export defintion to the appropriate definitions file, if needed,
-        log the export in the kallysto.log.
+        log the export in the kallysto.log. Inside a `batch` the definition and
+        log entry are buffered and written when the batch ends.
+        
+        Lean publications release the export's payload, which has already been
+        written to the data store, and return an `ExportRecord` instead.
         """
 
+        # Batched exports are released by `batch`, once they are written.
+        if self.batched_exports is not None:
+            self.batched_exports.append(export)
+            
+        else:
+            self.write_exports([export])
+            
+            if self.lean:
+                export.release()
+            
+        if self.lean:
+            return ExportRecord(export, self)
+
+        return export
+    
+    
+    @contextmanager
+    def batch(self):
+        """Buffer definitions and log entries, writing them in bulk at the end.
+        
+        Within a `with pub.batch():` block exports still write their data and
+        image files but their definitions, log entries and digests are held
+        in memory. They are written with a single append to each file when
+        the block exits. If an exception escapes the block then none of them
+        are written. Nested batches are folded into the outermost batch.
+        """
+        
+        if self.batched_exports is not None:
+            yield self
+            return
+        
+        self.batched_exports = exports = []
+        
+        try:
+            yield self
+            
+        except BaseException:
+            self.display_logger.warning(
+                'Discarding %d batched exports.', len(exports))
+            raise
+            
+        finally:
+            self.batched_exports = None
+        
+        try:
+            self.write_exports(exports)
+            
+        finally:
+            if self.lean:
+                for export in exports:
+                    export.release()
+        
+        
+    def write_exports(self, exports):
+        """Write the definitions, log entries and digests of exports in bulk.
+        
+        Each file receives a single append for all of the exports, while
+        holding the file's lock, so that the appends of concurrent writers
+        are not interleaved.
+        """
+        
+        if not exports:
+            return
+        
+        if self.closed:
+            raise ValueError('Cannot export to a closed publication link.')
+
         # If write_defs then write definitions file.
         if self.write_defs:
-            self.defs_logger.info(export.def_str)
+            with self.storage.locked(self.defs_file):
+                self.defs_logger.info('\n'.join(export.def_str for export in exports))
+            
+        # And the indexed definitions; one for each value of a Values export.
+        # The lock keeps the records and their index in step.
+        if self.write_defs and self.indexed_defs:
+            with locked(self.indexed_defs_file):
+                definitions.write_definitions(
+                    self.indexed_defs_file, self.defs_index_file, 
+                    [(export.name, export.__class__.__name__, 
+                      self.formatter.definition_body(export.def_str, export.name),
+                      export.digest)
+                     for export in chain.from_iterable(
+                         getattr(export, 'members', [export]) for export in exports)])
 
-        # Log the export.
-        self.audit_logger.info(export.log_str)
+        # Log the exports; each entry notes whether its files were written.
+        with self.storage.locked(self.log_segment_file):
+            entries = '\n'.join(export.log_str for export in exports)
+            
+            self.rotate_log_if_due(len(entries.encode('utf-8')) + 1)
+            self.audit_logger.info(entries)
+            
+        # Remember the digests of newly written exports. An export written
+        # without a digest forgets the stored one, which no longer matches
+        # its files.
+        self.store_digests([
+            (export.name, export.digest or '') for export in exports
+            if not export.unchanged 
+            and (export.digest is not None or self.stored_digest(export.name))])
+        
+        # Stamp the exports that really changed, for build tools.
+        if self.build_stamps:
+            changed = build.update_manifest(self.build_path, self.notebook, [
+                (export.name, export.__class__.__name__, build.build_digest(
+                    export.digest, 
+                    self.formatter.definition_body(export.def_str, export.name)))
+                for export in chain.from_iterable(
+                    getattr(export, 'members', [export]) for export in exports)])
+            
+            if changed:
+                self.display_logger.info('Stamped %d changed exports.', len(changed))
+            
+            
+    def stale(self, since=None):
+        """Find the publication's exports that changed since the last build.
+        
+        Needs build_stamps; exports from notebooks without it are not seen.
+        
+        Args:
+            since: the time of the last build; seconds since the epoch, or the
+            path of a build output, e.g. the compiled paper. By default the
+            time of the last `mark_built`.
+            
+        Returns:
+            (notebook, name) pairs of the stale exports, sorted.
+        """
+        
+        self.require_local('stale')
+        
+        return build.stale(self.build_path, since)
+    
+    
+    def mark_built(self):
+        """Note that the publication has been built, for `stale`."""
+        
+        self.require_local('mark_built')
+        
+        build.mark_built(self.build_path)
+    
 
-        return export
+    def history(self, name=None, notebook=None, since=None, until=None):
+        """Query the audit log for the exports to this publication.
+        
+        The audit log index is used to find the matching entries, rather
+        than scanning the log.
+        
+        Args:
+            name: only exports with this name.
+            notebook: only exports from this notebook.
+            since: only exports logged at or after this time; a datetime, a
+              string (e.g. '2017-06-01 12:00'), or seconds since the epoch.
+            until: only exports logged before this time, as for since.
+            
+        Returns:
+            A dataframe of the matching log entries, oldest first.
+        """
+        
+        self.require_local('history')
+        self.setup()
+        
+        entries = audit.history(
+            self.logs_file, self.logs_index_file, name=name, notebook=notebook,
+            since=self.timestamp(since), until=self.timestamp(until))
+        
+        return pd.DataFrame(entries)
+    
     
+    def read_log(self):
+        """Iterate over the audit log entries, merged across its segments."""
+        
+        self.require_local('read_log')
+        
+        return audit.read_log(self.logs_file)
+    
+    
+    def compact_log(self):
+        """Fold the log segments of all writers back into kallysto.log.
+        
+        Returns:
+            The number of writer segments folded into the log.
+        """
+        
+        self.require_local('compact_log')
+        self.setup()
+        
+        folded = audit.compact_log(self.logs_file, self.logs_index_file)
+        
+        self.display_logger.info(
+            'Compacted %s; folded %d log segments.', self.logs_file, folded)
+        
+        return folded
+    
+    
+    def rotate_log(self):
+        """Archive the audit log as a compressed segment and start a new log."""
+        
+        self.require_local('rotate_log')
+        
+        archive_file = audit.rotate_log(
+            self.log_segment_file, self.logs_index_file, self.log_compression)
+        
+        self.display_logger.info('Archived the audit log as %s.', archive_file)
+        
+        return archive_file
+    
+    
+    def rotate_log_if_due(self, pending=0):
+        """Rotate the audit log if it is over its size or age limit.
+        
+        Args:
+            pending: the size of the entries about to be appended to the log;
+              the log is rotated first if they would take it over its limit.
+        """
+        
+        if self.log_max_bytes is not None and os.path.isfile(self.log_segment_file):
+            
+            size = os.path.getsize(self.log_segment_file)
+            
+            if size and size + pending > self.log_max_bytes:
+                return self.rotate_log()
+            
+        if self.log_max_age is not None:
+            
+            started = audit.log_started(self.log_segment_file)
+            
+            if started is not None and time() - started >= self.log_max_age:
+                return self.rotate_log()
+    
+    
+    @staticmethod
+    def timestamp(when):
+        """Convert a time to seconds since the epoch; naive times are local."""
+        
+        if when is None or isinstance(when, (int, float)):
+            return when
+        
+        return pd.Timestamp(when).to_pydatetime().timestamp()
+    
+
+# -- Background rendering ------------------------------------------------
+
+    def render(self, export):
+        """Render a figure export's image in a background worker process.
+        
+        The figure is pickled and rendered by a pool of worker processes
+        using the Agg backend. The workers also digest the figure, so that
+        it is never drawn by the notebook. The export's data, definition and
+        log entry are only written once the render has completed, by `wait`.
+        
+        Args:
+            export: a figure export, with its definition.
+            
+        Returns:
+            A Future for the background render.
+        """
+        
+        if self.render_pool is None:
+            self.render_pool = ProcessPoolExecutor(
+                self.render_workers, mp_context=get_context('spawn'),
+                initializer=use_agg_backend)
+        
+        image_paths = export.image_paths(self)
+        
+        for filepath in image_paths.values():
+            self.display_logger.info('Rendering %s in the background.', filepath)
+        
+        # The figure's change detection is done by the worker, as it draws.
+        digest_parts = export.digest_parts() if self.needs_digests else None
+        stored_digest = (
+            self.stored_digest(export.name) if self.detect_changes else None)
+        
+        future = self.render_pool.submit(
+            render_figure, pickle.dumps(export.image), image_paths, export.image_dpis(),
+            digest_parts, stored_digest, export.files(self))
+        
+        self.pending_renders.append((future, export))
+        
+        return future
+    
+    
+    def close(self):
+        """Close the link; complete its exports and release its files.
+        
+        Any background renders are completed, the render workers are shut
+        down and, if this is the last open link to the notebook, the log
+        and definitions files are closed. Closing a link twice is harmless.
+        A Publication can also be used as a context manager, which closes
+        the link when the block exits.
+        """
+        
+        if self.closed:
+            return
+        
+        # The pending renders are completed, while the link is still open.
+        try:
+            self.wait()
+            
+        finally:
+            self.closed = True
+            
+            if self.render_pool is not None:
+                self.render_pool.shutdown()
+                self.render_pool = None
+                
+            # A lazy link that never exported has no writers.
+            if self.writers is not None:
+                self.writers.links -= 1
+                
+                if self.writers.links == 0:
+                    self.writers.close()
+                    
+                    if link_writers.get(self.link_key) is self.writers:
+                        del link_writers[self.link_key]
+                    
+                self.writers = None
+            
+            
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, *exc_info):
+        self.close()
+        
+    
+    def wait(self):
+        """Wait for all background renders and complete their exports.
+        
+        Once this returns every rendered image is on disk and the definitions
+        and log entries of the corresponding exports have been written. Exports
+        whose render failed are not completed; the first failure is re-raised
+        after the successful exports have been completed.
+        
+        Returns:
+            The list of completed exports.
+        """
+        
+        pending, self.pending_renders = self.pending_renders, []
+        
+        completed, failure = [], None
+        
+        for future, export in pending:
+            try:
+                export.digest, written = future.result()
+                export.unchanged = not written
+                
+                if written:
+                    export.save_data(export.data, self)
+                    self.store_blobs(*export.files(self))
+                    
+                export.log_str = export.gen_log_str(self)
+                completed.append(self.export(export))
+                
+            except Exception as e:
+                self.display_logger.warning(
+                    'Could not render %s: %s', export.image_file, e)
+                failure = failure or e
+                
+        if failure is not None:
+            raise failure
+        
+        return completed
+    
+
+# -- Blob store ----------------------------------------------------------
+
+    def blob_file(self, digest):
+        """Generate the Kallysto datastore path to the blob for a digest."""
+        return self.blobs_path + digest[:2] + '/' + digest
+    
+    
+    def file_digest(self, filepath):
+        """Calculate the digest of a file's content."""
+        
+        sha = hashlib.sha1()
+        
+        with open(filepath, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                sha.update(block)
+                
+        return sha.hexdigest()
+        
+        
+    def store_blobs(self, *filepaths):
+        """Move datastore files into the content-addressed blob store.
+        
+        The blob store, `_kallysto/blobs/`, holds a single copy of each
+        distinct file content, named by its digest. Each datastore file is
+        made a hard link to its blob, so identical data and images exported
+        by several notebooks are only stored once, and the number of links
+        to a blob counts its references. Datastore files are always rewritten
+        by replacing them, never in place, so a blob is never modified by a
+        later export. Files that cannot be hard linked
+        (e.g. on file systems without links) are left as they are.
+        
+        Args:
+            filepaths: the datastore files just written by an export.
+        """
+        
+        if not self.blob_store:
+            return
+        
+        for filepath in filepaths:
+            
+            if not os.path.isfile(filepath):
+                continue
+                
+            blob = self.blob_file(self.file_digest(filepath))
+            
+            try:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                
+                try:
+                    os.link(filepath, blob)  # A new blob.
+                    
+                # An existing blob; replace the file with a link to it.
+                except FileExistsError:
+                    if not os.path.samefile(blob, filepath):
+                        linked = temp_path(filepath)
+                        os.link(blob, linked)
+                        os.replace(linked, filepath)
+                        
+            except OSError:
+                self.display_logger.warning(
+                    'Could not link %s to the blob store.', filepath)
+                
+                
+    def reclaim_blobs(self):
+        """Remove blobs that are no longer referenced by any datastore file.
+        
+        Returns:
+            The list of removed blob files.
+        """
+        
+        reclaimed = []
+        
+        if not os.path.isdir(self.blobs_path):
+            return reclaimed
+        
+        for folder, _, blobs in os.walk(self.blobs_path):
+            for blob in blobs:
+                blob = os.path.join(folder, blob)
+                
+                # The blob store's own link is the only one left.
+                if os.stat(blob).st_nlink == 1:
+                    self.display_logger.info('Reclaiming %s.', blob)
+                    os.remove(blob)
+                    reclaimed.append(blob)
+                    
+        return reclaimed
+    
+
+# -- Garbage collection --------------------------------------------------
+
+    def gc(self, retire=(), keep_versions=None, since=None, archive=False, 
+           dry_run=False, workers=4):
+        """Remove the notebook's datastore files that are no longer referenced.
+        
+        The audit log records the files written by each export, so the files
+        referenced by the latest export of each name are kept, along with
+        the datastore's own files; any other files in the notebook's data
+        and figs folders (e.g. of renamed exports, or of formats no longer
+        exported) are removed, or archived to `_kallysto/attic/`. Current
+        exports are only removed, with their definitions, if they are
+        retired by name.
+        
+        The archived, superseded, versions of each file are kept according
+        to a retention policy: the last keep_versions versions of each file,
+        and any version archived since the given time, are kept in the
+        attic and older versions are removed. Without a policy the attic is
+        left alone.
+        
+        Args:
+            retire: the names of exports to remove, with their files.
+            keep_versions: keep the last keep_versions archived versions of
+              each file.
+            since: keep the versions archived since this time; a datetime, a
+              string (e.g. '2017-06-01'), or seconds since the epoch.
+            archive: move unreferenced files to the attic, don't delete them.
+            dry_run: only report the files that would be removed.
+            workers: the number of threads used to scan and remove files.
+            
+        Returns:
+            The list of unreferenced files, and expired archived versions,
+            that were (or would be) removed.
+        """
+        
+        self.require_local('gc')
+        self.setup()
+        
+        since = self.timestamp(since)
+        retire = set(retire)
+        
+        # The latest log entry of each export from this notebook.
+        latest = OrderedDict()
+        
+        for entry in self.read_log():
+            if entry.get('notebook') == self.notebook and 'name' in entry:
+                latest.pop(entry['name'], None)
+                latest[entry['name']] = entry
+                
+        referenced = {os.path.abspath(self.digests_file)}
+        
+        for name, entry in latest.items():
+            if name not in retire:
+                referenced.update(
+                    os.path.abspath(os.path.join(self.logs_path, path))
+                    for path in entry.get('files') or [
+                        entry.get('data_path'), entry.get('image_path')]
+                    if path)
+        
+        # Exports defined, but not logged (e.g. by an older version of
+        # Kallysto), keep any of their files.
+        defined = set()
+        
+        if self.storage.isfile(self.defs_file):
+            defined = set(re.findall(
+                self.formatter.name_pattern, self.storage.read_text(self.defs_file), 
+                re.MULTILINE)) - set(latest) - retire
+            
+        def unreferenced(filepath):
+            filename = os.path.basename(filepath)
+            
+            return not (
+                filename.startswith('.')  # Temporary and lock files.
+                or os.path.abspath(filepath) in referenced
+                or filename.split('.')[0] in defined)
+        
+        attic_path = self.kallysto_path + 'attic/'
+        
+        with ThreadPoolExecutor(workers) as pool:
+            
+            # Scan the folders in parallel, one folder per task.
+            candidates = sorted(filter(unreferenced, scan_files(
+                [self.data_path, self.figs_path], pool)))
+            
+            expired = sorted(self.expired_versions(
+                scan_files([attic_path], pool), keep_versions, since))
+            
+            if dry_run:
+                return candidates + expired
+            
+            attic = attic_path + strftime('%Y%m%dT%H%M%S') + '/'
+            
+            def collect(filepath):
+                if archive:
+                    archived = attic + os.path.relpath(filepath, self.kallysto_path)
+                    os.makedirs(os.path.dirname(archived), exist_ok=True)
+                    os.replace(filepath, archived)
+                    
+                else:
+                    os.remove(filepath)
+                    
+            list(pool.map(collect, candidates))
+            list(pool.map(os.remove, expired))
+            
+        # Expired versions may leave empty attic folders behind.
+        if expired:
+            for folder, _, _ in sorted(os.walk(attic_path), reverse=True):
+                if folder != attic_path and not os.listdir(folder):
+                    os.rmdir(folder)
+            
+        # Retired exports are no longer defined.
+        if retire and self.write_defs:
+            self.compact_definitions(drop=retire)
+            
+        if self.blob_store:
+            self.reclaim_blobs()
+            
+        self.display_logger.info(
+            '%s %d unreferenced files; removed %d archived versions.', 
+            'Archived' if archive else 'Removed', len(candidates), len(expired))
+        
+        return candidates + expired
+    
+    
+    def expired_versions(self, archived, keep_versions=None, since=None):
+        """Find the archived versions of the notebook's files that have expired.
+        
+        Archived files are at `attic/<time>/<path>`, where path is the file's
+        path within `_kallysto/`, so the versions of a file share its path.
+        
+        Args:
+            archived: the files in the attic.
+            keep_versions: keep the latest keep_versions versions of each file.
+            since: keep the versions archived at or after this time, in seconds
+              since the epoch.
+            
+        Returns:
+            The archived files that are kept by neither policy.
+        """
+        
+        if keep_versions is None and since is None:
+            return []
+        
+        attic_path = os.path.abspath(self.kallysto_path + 'attic')
+        notebook_folders = [
+            os.path.relpath(folder, self.kallysto_path) + os.sep 
+            for folder in [self.data_path, self.figs_path]]
+        
+        # The versions of each of the notebook's files, by archive time.
+        versions = {}
+        
+        for filepath in archived:
+            archived_at, _, path = os.path.relpath(
+                os.path.abspath(filepath), attic_path).partition(os.sep)
+            
+            if any(path.startswith(folder) for folder in notebook_folders):
+                versions.setdefault(path, []).append((archived_at, filepath))
+            
+        expired = []
+        
+        for path_versions in versions.values():
+            path_versions.sort(reverse=True)
+            
+            for i, (archived_at, filepath) in enumerate(path_versions):
+                
+                if keep_versions is not None and i < keep_versions:
+                    continue
+                    
+                if since is not None and mktime(
+                        strptime(archived_at, '%Y%m%dT%H%M%S')) >= since:
+                    continue
+                    
+                expired.append(filepath)
+                
+        return expired
+    
+
+# -- Change detection ----------------------------------------------------
+
+    def stored_digest(self, name):
+        """The digest recorded for the most recent export of name, if any."""
+        
+        # Load the digests file once; forgotten digests are blank.
+        if self._digests is None:
+            self._digests, self.digest_lines = self.read_digests()
+                        
+        return self._digests.get(name) or None
+    
+    
+    def read_digests(self):
+        """Read the digests file.
+        
+        Returns:
+            The latest digest of each name, as later digests override earlier
+            ones, and the number of lines in the file.
+        """
+        
+        digests, lines = {}, 0
+        
+        if self.storage.isfile(self.digests_file):
+            with self.storage.open(self.digests_file, 'r') as file:
+                for lines, line in enumerate(file, 1):
+                    name, _, digest = line.rstrip('\n').rpartition(',')
+                    digests[name] = digest
+                    
+        return digests, lines
+    
+    
+    def store_digests(self, digests):
+        """Record the digests, (name, digest) pairs, of the latest exports.
+        
+        The digests are appended to the digests file, which is compacted once
+        most of its lines have been superseded.
+        """
+        
+        if not digests:
+            return
+        
+        self.stored_digest(None)  # Make sure the digests are loaded.
+        
+        with self.storage.locked(self.digests_file):
+            self.storage.append(self.digests_file, ''.join(
+                '{},{}\n'.format(name, digest) for name, digest in digests))
+            
+        self._digests.update(digests)
+        self.digest_lines += len(digests)
+        
+        if self.digest_lines > 2 * len(self._digests) + 100:
+            self.compact_digests()
+            
+            
+    def compact_digests(self, drop=()):
+        """Rewrite the digests file with just the latest digest of each name.
+        
+        The file is re-read while holding its lock, so that the digests
+        appended by other links to the notebook are kept.
+        
+        Args:
+            drop: the names of exports whose digests are removed entirely.
+        """
+        
+        with self.storage.locked(self.digests_file):
+            digests, _ = self.read_digests()
+            
+            self._digests = OrderedDict(
+                (name, digest) for name, digest in digests.items() 
+                if digest and name not in drop)
+            
+            with self.storage.write(self.digests_file) as file:
+                file.write(''.join(
+                    '{},{}\n'.format(name, digest) 
+                    for name, digest in self._digests.items()))
+                
+        self.digest_lines = len(self._digests)
+        
+        
+    def is_unchanged(self, export, *files):
+        """Can the data/image writes for the export be skipped?
+        
+        An export is unchanged if change detection is enabled, its digest
+        matches the stored digest for its name, and all of its files are
+        still present in the datastore.
+        
+        Args:
+            export: the export, with its digest already calculated.
+            files: the datastore files that the export would write.
+        """
+        
+        return (self.detect_changes
+                and export.digest == self.stored_digest(export.name)
+                and all(self.storage.isfile(file) for file in files))
+    
+
+    def compact_definitions(self, drop=()):
+        """Rewrite the notebook's definitions file with one definition per name.
+        
+        Every export appends a new definition, so repeated exports leave a
+        trail of superseded definitions behind. Compaction keeps only the
+        most recent definition of each export name, in the order in which
+        they were last exported. The new file is written alongside the old
+        one and renamed over it, so that readers see either the old or the
+        new definitions; the definitions logger reopens the new file. The
+        definitions file's lock is held throughout so that no definitions are
+        written meanwhile. Only this notebook's definitions file is rewritten
+        so other notebooks can keep exporting to the publication meanwhile.
+        
+        Args:
+            drop: the names of exports whose definitions are removed entirely.
+        
+        Returns:
+            The number of superseded (and dropped) definitions removed.
+        """
+        
+        if not self.storage.isfile(self.defs_file):
+            return 0
+        
+        with self.storage.locked(self.defs_file):
+            blocks, latest = self.latest_definitions()
+                
+            for name in drop:
+                latest.pop(name, None)
+                
+            with self.storage.write(self.defs_file) as defs:
+                defs.write(''.join(latest.values()))
+                
+        removed = blocks - len(latest)
+        
+        # Indexed definitions are only kept in local storage.
+        if self.storage.is_local and os.path.isfile(self.defs_index_file):
+            self.compact_indexed_definitions(drop)
+            
+        # The digests file grows with every changed export too.
+        if self.storage.isfile(self.digests_file):
+            self.compact_digests(drop)
+        
+        self.display_logger.info(
+            'Compacted %s; removed %d definitions.', self.defs_file, removed)
+        
+        return removed
+            
+
+    def latest_definitions(self):
+        """Read the latest definition of each name from the definitions file.
+        
+        Returns:
+            The number of definitions in the file, and a dict of the latest
+            definition of each name, {name:def_str}, in export order.
+        """
+        
+        blocks = list(filter(str.strip, re.split(
+            r'(?m)^(?=% Uid: )', self.storage.read_text(self.defs_file))))
+        
+        latest = OrderedDict()
+        
+        for block in blocks:
+            match = re.search(self.formatter.name_pattern, block, re.MULTILINE)
+            name = match.group(1) if match else block
+            
+            latest.pop(name, None)
+            latest[name] = block
+            
+        return len(blocks), latest
+    
+    
+    def seed_indexed_definitions(self):
+        """Start the indexed definitions with the current definitions, if any.
+        
+        The definitions file holds no export types, so they are left blank,
+        and only the digests of the exports' own names are known.
+        """
+        
+        with locked(self.indexed_defs_file):
+            if os.path.isfile(self.defs_index_file):
+                return
+            
+            _, latest = self.latest_definitions()
+            
+            # Definitions end with their body, then blank lines.
+            definitions.write_definitions(
+                self.indexed_defs_file, self.defs_index_file,
+                [(name, None, 
+                  self.formatter.definition_body(def_str.rstrip('\n') + '\n\n', name),
+                  self.stored_digest(name))
+                 for name, def_str in latest.items() if name != def_str])
+            
+
+    def compact_indexed_definitions(self, drop=()):
+        """Rewrite the indexed definitions file with one definition per name.
+        
+        The lock is held throughout, so that readers that also take it never
+        see the new records with the old index, or vice versa.
+        """
+        
+        with locked(self.indexed_defs_file):
+            index = definitions.read_index(self.defs_index_file)
+            bodies = definitions.read_definitions(
+                self.indexed_defs_file, self.defs_index_file)
+            
+            compacted = temp_path(self.indexed_defs_file)
+            compacted_index = temp_path(self.defs_index_file)
+            
+            definitions.write_definitions(
+                compacted, compacted_index,
+                [(name, entry['export'], bodies[name], entry['digest'])
+                 for name, entry in index.items() if name not in drop])
+            
+            os.replace(compacted, self.indexed_defs_file)
+            os.replace(compacted_index, self.defs_index_file)
+            
 
     def safely_remove_file(self, file):
         """Attempt to delete file; capture/notify exceptions as appropriate.
@@ -288,11 +1628,11 @@ class Publication(object):
         based on outcome.
         """
 
-        if os.path.isfile(file):
+        if self.storage.isfile(file):
             try:
                 self.display_logger.info('Trying to remove %s.', file)
                 
-                os.remove(file)
+                self.storage.remove(file)
                 
                 self.display_logger.info('Removed %s.', file)
 
@@ -310,7 +1650,7 @@ class Publication(object):
         """
         try:
             self.display_logger.info('Trying to remove %s.', folder)
-            rmtree(folder)
+            self.storage.rmtree(folder)
             self.display_logger.info('Removed %s.', dir)
 
         except OSError:
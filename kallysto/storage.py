@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+
+# $$\                $$\ $$\                       $$\
+# $$ |               $$ |$$ |                      $$ |
+# $$ |  $$\ $$$$$$\  $$ |$$ |$$\   $$\  $$$$$$$\ $$$$$$\    $$$$$$\
+# $$ | $$  |\____$$\ $$ |$$ |$$ |  $$ |$$  _____|\_$$  _|  $$  __$$\
+# $$$$$$  / $$$$$$$ |$$ |$$ |$$ |  $$ |\$$$$$$\    $$ |    $$ /  $$ |
+# $$  _$$< $$  __$$ |$$ |$$ |$$ |  $$ | \____$$\   $$ |$$\ $$ |  $$ |
+# $$ | \$$\\$$$$$$$ |$$ |$$ |\$$$$$$$ |$$$$$$$  |  \$$$$  |\$$$$$$  |
+# \__|  \__|\_______|\__|\__| \____$$ |\_______/    \____/  \______/
+#                            $$\   $$ |
+#                            \$$$$$$  |
+#                             \______/
+#
+# Copyright 2017 Barry Smnyth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice & this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Storage backends for the Kallysto datastore.
+
+Publications and exports read and write the datastore through a storage
+backend rather than the file system directly. `LocalStorage`, the default,
+stores the datastore in the local file system, as folders and files
+beneath the publication's pub_path. `MemoryStorage` keeps the datastore in
+memory, as a dict of paths to file contents, so that test suites and dry
+runs can export without any disk I/O.
+
+Backends are used through a small set of file operations:
+
+    storage.makedirs(path)
+    storage.isfile(path)
+    storage.open(path, mode)          # For reading ('r', 'rb').
+    storage.write(path, mode)         # A context manager; 'w' or 'wb'.
+    storage.append(path, text)
+    storage.locked(path)              # A context manager.
+    storage.remove(path), storage.rmtree(path)
+    storage.log_handler(path)
+
+Writes via `write` are atomic: the file is only replaced if the block
+succeeds, so readers see either the old file or the new one.
+"""
+
+import io
+import logging
+import logging.handlers
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from shutil import rmtree
+
+from kallysto.fileio import atomic_path, locked
+
+
+# -- Storage interface ---------------------------------------------------
+
+class Storage(ABC):
+    """The interface of a datastore storage backend.
+    
+    Attributes:
+        is_local: does the backend store files in the local file system?
+          Some features, such as the blob store, background rendering and
+          the audit log index, need local files.
+    """
+    
+    is_local = False
+    
+    @abstractmethod
+    def makedirs(self, path):
+        """Create a folder, and its parents, if they don't exist."""
+        
+    @abstractmethod
+    def isfile(self, path):
+        """Is there a file at path?"""
+        
+    @abstractmethod
+    def open(self, path, mode='r'):
+        """Open a file for reading, in text ('r') or binary ('rb') mode."""
+        
+    @abstractmethod
+    def write(self, path, mode='w'):
+        """A context manager that yields a file to write the file at path.
+        
+        The file is written in text ('w') or binary ('wb') mode, and it
+        replaces any existing file at path only if the block succeeds.
+        """
+        
+    @abstractmethod
+    def append(self, path, text):
+        """Append text to a file, creating it if necessary."""
+        
+    @abstractmethod
+    def locked(self, path):
+        """A context manager that holds an exclusive lock on a file."""
+        
+    @abstractmethod
+    def remove(self, path):
+        """Remove a file."""
+        
+    @abstractmethod
+    def rmtree(self, path):
+        """Remove a folder and everything in it."""
+        
+    @abstractmethod
+    def log_handler(self, path):
+        """A logging handler that appends log records to a file."""
+        
+    def read_text(self, path):
+        """The text content of a file."""
+        
+        with self.open(path, 'r') as file:
+            return file.read()
+    
+    
+# -- Local storage -------------------------------------------------------
+
+class LocalStorage(Storage):
+    """Store the datastore in the local file system."""
+    
+    is_local = True
+    
+    # All local storages are the same store.
+    def __eq__(self, other):
+        return isinstance(other, LocalStorage)
+    
+    def __hash__(self):
+        return hash(LocalStorage)
+    
+    def makedirs(self, path):
+        os.makedirs(path, exist_ok=True)
+        
+    def isfile(self, path):
+        return os.path.isfile(path)
+    
+    def open(self, path, mode='r'):
+        return open(path, mode)
+    
+    @contextmanager
+    def write(self, path, mode='w'):
+        
+        # Text files are written without newline translation, as pandas does.
+        newline = None if 'b' in mode else ''
+        
+        with atomic_path(path) as temp:
+            with open(temp, mode, newline=newline) as file:
+                yield file
+                
+    def append(self, path, text):
+        with open(path, 'a') as file:
+            file.write(text)
+            
+    def locked(self, path):
+        return locked(path)
+    
+    def remove(self, path):
+        os.remove(path)
+        
+    def rmtree(self, path):
+        rmtree(path)
+        
+    def log_handler(self, path):
+        
+        # A watched handler reopens its file when it is rotated or compacted,
+        # and the file is only opened when its first record is written.
+        return logging.handlers.WatchedFileHandler(path, delay=True)
+    
+    
+# -- Memory storage ------------------------------------------------------
+
+class MemoryStorage(Storage):
+    """Store the datastore in memory, for tests and dry runs.
+    
+    Attributes:
+        files: a dict of the stored files, {normalised path:bytes}.
+        folders: the set of (normalised) folder paths.
+    """
+    
+    def __init__(self):
+        self.files = {}
+        self.folders = set()
+        self.locks = {}
+        self.mutex = threading.Lock()
+        
+    @staticmethod
+    def key(path):
+        return os.path.normpath(path)
+    
+    def makedirs(self, path):
+        path = self.key(path)
+        
+        while path not in self.folders and path not in ('', '.', os.sep):
+            self.folders.add(path)
+            path = os.path.dirname(path)
+            
+    def isfile(self, path):
+        return self.key(path) in self.files
+    
+    def open(self, path, mode='r'):
+        
+        if self.key(path) not in self.files:
+            raise FileNotFoundError(path)
+        
+        content = self.files[self.key(path)]
+        
+        return io.BytesIO(content) if 'b' in mode else io.StringIO(
+            content.decode('utf-8'), newline=None)
+    
+    @contextmanager
+    def write(self, path, mode='w'):
+        
+        raw = io.BytesIO()
+        
+        if 'b' in mode:
+            yield raw
+            content = raw.getvalue()
+            
+        else:
+            text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+            yield text
+            text.flush()
+            content = raw.getvalue()
+            text.detach()
+            
+        self.files[self.key(path)] = content
+        
+    def append(self, path, text):
+        with self.mutex:
+            key = self.key(path)
+            self.files[key] = self.files.get(key, b'') + text.encode('utf-8')
+            
+    @contextmanager
+    def locked(self, path):
+        
+        with self.mutex:
+            lock = self.locks.setdefault(self.key(path), threading.RLock())
+            
+        with lock:
+            yield
+            
+    def remove(self, path):
+        
+        if self.key(path) not in self.files:
+            raise FileNotFoundError(path)
+        
+        del self.files[self.key(path)]
+        
+    def rmtree(self, path):
+        
+        prefix = self.key(path) + os.sep
+        
+        if self.key(path) not in self.folders:
+            raise FileNotFoundError(path)
+        
+        for key in [key for key in self.files if key.startswith(prefix)]:
+            del self.files[key]
+            
+        self.folders = {
+            folder for folder in self.folders 
+            if folder != self.key(path) and not folder.startswith(prefix)}
+        
+    def log_handler(self, path):
+        return MemoryLogHandler(self, path)
+    
+    
+class MemoryLogHandler(logging.Handler):
+    """A logging handler that appends log records to a file in memory storage."""
+    
+    def __init__(self, storage, path):
+        super().__init__()
+        self.storage, self.path = storage, path
+        
+    def emit(self, record):
+        try:
+            self.storage.append(self.path, self.format(record) + '\n')
+            
+        except Exception:
+            self.handleError(record)
@@ -12,6 +12,7 @@ from matplotlib.pylab import plt
 from kallysto.publication import Publication
 from kallysto.export import Export, Value, Table, Figure
 from kallysto.formatter import Latex, Markdown
+from kallysto.storage import MemoryStorage
 
 @pytest.fixture(scope="module")
 def pub_with_defs():
@@ -159,4 +160,275 @@ def pub_using_markdown():
     yield pub
     
     # Teardown the title
-    rmtree(pub.pub_path + '/' + pub.title)
\ No newline at end of file
+    rmtree(pub.pub_path + '/' + pub.title)
+
+@pytest.fixture(scope="module")
+def pub_for_change_detection():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_change_detection', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def pub_for_parquet():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_parquet', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True,
+            data_format='parquet')
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def pub_for_feather():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_feather', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True,
+            data_format='feather', csv_copy=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def typed_df():
+    return pd.DataFrame({
+        'when': pd.to_datetime(['2018-01-01', '2018-06-30']),
+        'kind': pd.Categorical(['a', 'b']),
+        'score': [0.5, 0.25]}, index=['x', 'y'])
+
+
+@pytest.fixture(scope="module")
+def pub_for_background_rendering():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_background_rendering', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True,
+            render_workers=2)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def pub_for_batch():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_batch', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def pub_with_table_budget():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_with_table_budget', 
+            pub_path='./tests/pub/',
+            formatter=Markdown,
+            overwrite=True, fresh_start=True, write_defs=True,
+            table_max_rows=5, table_max_cols=1)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def lean_pub():
+    pub = Publication(
+            notebook='nb', 
+            title='lean_pub', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True,
+            lean=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def blob_pubs():
+    pubs = [Publication(
+            notebook=notebook, 
+            title='blob_pub', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True,
+            blob_store=True) for notebook in ['nb1', 'nb2']]
+    
+    yield pubs
+    
+    # Teardown the title
+    rmtree(pubs[0].pub_path + '/' + pubs[0].title)
+
+
+@pytest.fixture(scope="module")
+def pub_for_values():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_values', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def pub_for_compaction():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_compaction', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def pub_with_indexed_defs():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_with_indexed_defs', 
+            pub_path='./tests/pub/',
+            formatter=Markdown,
+            overwrite=True, fresh_start=True, write_defs=True,
+            indexed_defs=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def pubs_for_history():
+    pubs = [Publication(
+            notebook=notebook, 
+            title='pub_for_history', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=(notebook == 'nb1'), write_defs=True)
+            for notebook in ['nb1', 'nb2']]
+    
+    yield pubs
+    
+    # Teardown the title
+    rmtree(pubs[0].pub_path + '/' + pubs[0].title)
+
+
+@pytest.fixture(scope="module")
+def pub_with_log_rotation():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_with_log_rotation', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True,
+            log_max_bytes=2000, log_compression='xz')
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope="module")
+def lazy_pub():
+    pub = Publication(
+            notebook='nb', 
+            title='lazy_pub', 
+            pub_path='./tests/pub/', 
+            write_defs=True, lazy_setup=True)
+    
+    yield pub
+    
+    # Teardown the title
+    pub.close()
+    rmtree(pub.pub_path + '/' + pub.title, ignore_errors=True)
+
+
+@pytest.fixture(scope="module")
+def memory_pub():
+    pub = Publication(
+            notebook='nb', 
+            title='memory_pub', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True,
+            storage=MemoryStorage())
+    
+    yield pub
+    
+    pub.close()
+
+
+@pytest.fixture(scope="module")
+def pub_for_gc():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_gc', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, write_defs=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope='module')
+def pub_for_fast_reset():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_fast_reset', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+@pytest.fixture(scope='module')
+def pub_with_build_stamps():
+    pub = Publication(
+            notebook='nb', 
+            title='pub_with_build_stamps', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, build_stamps=True)
+    
+    yield pub
+    
+    # Teardown the title
+    rmtree(pub.pub_path + '/' + pub.title)
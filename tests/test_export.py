@@ -1,11 +1,13 @@
+import json
 import os
+from shutil import rmtree
 import pytest
 import pandas as pd
 from matplotlib.pylab import plt
 from matplotlib.figure import Figure as Fig
 
 from kallysto.publication import Publication
-from kallysto.export import Export, Value, Table, Figure
+from kallysto.export import Export, ExportRecord, Value, Values, Table, Figure
 
 
     
@@ -132,4 +134,535 @@ def test_numeric_value_export_to_markdown(numeric_value, markdown_pub_for_numeri
 
     # Test the contents match the value data.
     with open(value_file,"r") as vf:
-        assert str(numeric_value.value) == vf.read()
\ No newline at end of file
+        assert str(numeric_value.value) == vf.read()
+
+# Test change detection for repeated exports.
+
+def test_unchanged_table_export_is_skipped(df, pub_for_change_detection):
+    
+    pub = pub_for_change_detection
+    
+    first = Export.table("ChangeTable", data=df, caption="A table caption.")
+    first > pub
+    assert first.unchanged is False
+    
+    data_file = pub.data_file(first.data_file)
+    os.utime(data_file, (0, 0))  # Mark the data file as old.
+    
+    # Re-exporting the same data should skip the data write ...
+    second = Export.table("ChangeTable", data=df.copy(), caption="A table caption.")
+    second > pub
+    assert second.unchanged is True
+    assert second.digest == first.digest
+    assert os.path.getmtime(data_file) == 0
+    
+    # ... but still record the export in the log.
+    with open(pub.logs_file, 'r') as log:
+        assert json.loads(log.read().splitlines()[-1])['status'] == 'unchanged'
+    
+    
+def test_changed_table_export_is_written(df, pub_for_change_detection):
+    
+    pub = pub_for_change_detection
+    
+    Export.table("ChangedTable", data=df, caption="A table caption.") > pub
+
+    changed_df = df * 2
+    changed = Export.table("ChangedTable", data=changed_df, caption="A table caption.")
+    changed > pub
+    assert changed.unchanged is False
+    
+    df_from_file = pd.read_csv(pub.data_file(changed.data_file), index_col=0)
+    assert changed_df.equals(df_from_file)
+    
+    
+def test_missing_file_is_rewritten(pub_for_change_detection):
+    
+    pub = pub_for_change_detection
+    
+    Export.value("MissingValue", 42) > pub
+    os.remove(pub.data_file("MissingValue.txt"))
+    
+    value = Export.value("MissingValue", 42)
+    value > pub
+    assert value.unchanged is False
+    assert os.path.isfile(pub.data_file(value.data_file))
+    
+    
+def test_unchanged_figure_export_is_skipped(figure, pub_for_change_detection):
+    
+    pub = pub_for_change_detection
+    
+    figure > pub
+    figure > pub
+    assert figure.unchanged is True
+    
+    
+def test_digests_persist_across_publications(df, pub_for_change_detection):
+    
+    pub = pub_for_change_detection
+    
+    Export.table("PersistedTable", data=df, caption="A caption.") > pub
+    
+    # A new link to the same publication should see the stored digests.
+    relinked = Publication(notebook='nb', title=pub.title, pub_path=pub.pub_path)
+    
+    table = Export.table("PersistedTable", data=df, caption="A caption.")
+    table > relinked
+    assert table.unchanged is True
+
+
+def test_exports_without_change_detection_are_not_digested(
+        df, pub_for_change_detection, monkeypatch):
+    
+    pub = pub_for_change_detection
+    
+    Export.value("UndigestedValue", 1) > pub
+    
+    unchecked = Publication(
+        notebook='nb', title=pub.title, pub_path=pub.pub_path, detect_changes=False)
+    
+    fig, ax = plt.subplots()
+    df.plot(ax=ax)
+    
+    # The figure is only drawn once, to save it.
+    formats = []
+    savefig = fig.savefig
+    monkeypatch.setattr(fig, 'savefig', lambda file, format=None, **kwargs: (
+        formats.append(format), savefig(file, format=format, **kwargs)))
+    
+    figure = Export.figure("UndigestedFigure", image=fig, data=df, caption="A caption.")
+    figure > unchecked
+    
+    assert formats == ['pdf'] and figure.digest is None
+    
+    # A value written without a digest forgets its stored digest, so that
+    # its files are not mistaken for those of the digested value.
+    Export.value("UndigestedValue", 2) > unchecked
+    
+    relinked = Publication(notebook='nb', title=pub.title, pub_path=pub.pub_path)
+    
+    value = Export.value("UndigestedValue", 1)
+    value > relinked
+    assert value.unchanged is False
+    
+    with open(pub.data_file(value.data_file), 'r') as value_file:
+        assert value_file.read() == '1'
+        
+        
+def test_digests_file_is_compacted(pub_for_change_detection):
+    
+    pub = pub_for_change_detection
+    
+    for i in range(300):
+        Export.value("CompactedDigestValue", i) > pub
+        
+    with open(pub.digests_file, 'r') as digests:
+        lines = digests.read().splitlines()
+        
+    assert len(lines) < 300
+    assert lines.count('CompactedDigestValue,{}'.format(
+        pub.stored_digest('CompactedDigestValue'))) == 1
+
+
+# Test the columnar data formats.
+
+def test_table_export_to_parquet(typed_df, pub_for_parquet):
+    
+    table = Export.table("ParquetTable", data=typed_df, caption="A caption.")
+    table > pub_for_parquet
+    
+    assert table.data_file == 'ParquetTable.parquet'
+    assert table.csv_file is None
+    
+    # The dtypes survive the round trip.
+    df = pub_for_parquet.load_data(table.data_file)
+    assert df.equals(typed_df)
+    assert (df.dtypes == typed_df.dtypes).all()
+
+
+def test_table_export_to_feather_with_csv_copy(typed_df, pub_for_feather):
+    
+    table = Export.table("FeatherTable", data=typed_df, caption="A caption.")
+    table > pub_for_feather
+    
+    assert table.data_file == 'FeatherTable.feather'
+    
+    df = pub_for_feather.load_data(table.data_file)
+    assert df.equals(typed_df)
+    
+    # The secondary csv copy.
+    assert table.csv_file == 'FeatherTable.csv'
+    assert os.path.isfile(pub_for_feather.data_file(table.csv_file))
+    
+    
+def test_figure_export_to_feather(figure, pub_for_feather):
+    
+    figure > pub_for_feather
+    
+    assert figure.data_file == 'Figure.fig.feather'
+    assert pub_for_feather.load_data(figure.data_file).equals(figure.data)
+    
+    
+def test_unknown_data_format():
+    
+    with pytest.raises(ValueError):
+        Publication(notebook='nb', title='pub_unknown_format',
+                    pub_path='./tests/pub/', data_format='xlsx')
+
+
+# Test background figure rendering.
+
+def test_background_figure_export(df, pub_for_background_rendering, monkeypatch):
+    
+    import kallysto.export
+    
+    pub = pub_for_background_rendering
+    
+    # Count the Agg draws in the notebook's process.
+    draws = []
+    render_raster = kallysto.export.render_raster
+    
+    def counting_render_raster(image, dpi):
+        draws.append(dpi)
+        return render_raster(image, dpi)
+    
+    monkeypatch.setattr(kallysto.export, 'render_raster', counting_render_raster)
+    
+    fig, ax = plt.subplots(figsize=(4, 4))
+    df.plot(ax=ax)
+    
+    figure = Export.figure("BackgroundFigure", image=fig, data=df, caption="A caption.")
+    
+    render = figure > pub
+    assert render is not figure  # A handle for the render.
+    
+    # The figure is digested by the render worker, not drawn here.
+    assert draws == [] and figure.digest is None
+    
+    assert pub.wait() == [figure]
+    assert render.done()
+    assert figure.digest is not None and figure.unchanged is False
+    
+    # After the barrier the image, definition and log entry are all written.
+    assert os.path.isfile(pub.fig_file(figure.image_file))
+    
+    with open(pub.defs_file, 'r') as defs:
+        assert '\\renewcommand{\\BackgroundFigure}' in defs.read()
+        
+    with open(pub.logs_file, 'r') as log:
+        assert figure.image_file in log.read()
+        
+    assert pub.pending_renders == []
+    
+    # The worker skips re-rendering an unchanged figure.
+    image_file = pub.fig_file(figure.image_file)
+    os.utime(image_file, (0, 0))
+    
+    again = Export.figure("BackgroundFigure", image=fig, data=df, caption="A caption.")
+    again > pub
+    
+    assert pub.wait() == [again]
+    assert again.unchanged is True and again.digest == figure.digest
+    assert os.path.getmtime(image_file) == 0
+    assert draws == []
+
+
+# Test streaming table exports.
+
+@pytest.fixture(scope="module")
+def long_df():
+    return pd.DataFrame({'a': range(100), 'b': [i / 2 for i in range(100)]})
+
+
+def test_streamed_table_export(long_df, pub_for_change_detection):
+    
+    pub = pub_for_change_detection
+    
+    chunks = (long_df.iloc[i:i + 30] for i in range(0, len(long_df), 30))
+    table = Export.table("StreamedTable", data=chunks, caption="A caption.")
+    table > pub
+    
+    # The full data is streamed to the data file ...
+    assert table.rows == len(long_df)
+    assert pub.load_data(table.data_file).equals(long_df)
+    
+    # ... while the table only keeps a bounded preview.
+    assert len(table.data) == Table.preview_rows
+    
+    # Streamed tables cannot be re-exported.
+    with pytest.raises(ValueError):
+        table > pub
+        
+        
+def test_streamed_table_from_csv_chunks(long_df, pub_for_parquet, tmpdir):
+    
+    csv_file = str(tmpdir.join('long.csv'))
+    long_df.to_csv(csv_file, index=False)
+    
+    table = Export.table(
+        "CsvStreamedTable", 
+        data=pd.read_csv(csv_file, chunksize=25), 
+        caption="A caption.")
+    table > pub_for_parquet
+    
+    assert table.rows == len(long_df)
+    assert pub_for_parquet.load_data(table.data_file).equals(long_df)
+
+
+# Test table rendering budgets.
+
+def test_table_definition_is_truncated(long_df, pub_with_table_budget):
+    
+    pub = pub_with_table_budget
+    
+    table = Export.table("TruncatedTable", data=long_df, caption="A caption.")
+    table > pub
+    
+    data, truncated = table.preview(pub)
+    assert data.equals(long_df[['a']].head(5))
+    assert truncated == '5 of 100 rows, 1 of 2 columns (head)'
+    
+    # The definition records the truncation ...
+    assert '% Truncated: {}\n'.format(truncated) in table.def_str
+    assert '|  99 |' not in table.def_str
+    
+    # ... but the data file has the complete data.
+    assert pub.load_data(table.data_file).equals(long_df)
+    
+    
+def test_table_budget_per_export(long_df, pub_with_table_budget):
+    
+    pub = pub_with_table_budget
+    
+    tail = Export.table("TailTable", data=long_df, caption="A caption.",
+                        max_rows=3, max_cols=2, truncate='tail')
+    assert tail.preview(pub)[0].equals(long_df.tail(3))
+    
+    sample = Export.table("SampleTable", data=long_df, caption="A caption.",
+                          max_rows=10, truncate='sample')
+    data, truncated = sample.preview(pub)
+    assert len(data) == 10 and data.index.is_monotonic_increasing
+    assert data.equals(sample.preview(pub)[0])  # Reproducible.
+    
+    small = Export.table("SmallTable", data=long_df.head(3), caption="A caption.",
+                         max_cols=2)
+    data, truncated = small.preview(pub)
+    assert data.equals(small.data) and truncated is None
+    
+    with pytest.raises(ValueError):
+        Export.table("BadTable", data=long_df, caption="A caption.", truncate='middle')
+
+
+# Test lean exports.
+
+def test_lean_table_export(df, lean_pub):
+    
+    table = Export.table("LeanTable", data=df.copy(), caption="A caption.")
+    record = table > lean_pub
+    
+    # The export drops its payload and a compact record is returned.
+    assert table.data is None
+    assert type(record) == ExportRecord
+    assert not hasattr(record, '__dict__')
+    assert (record.name, record.kind, record.digest) == ('LeanTable', 'Table', table.digest)
+    
+    # The data can be reloaded from the data store.
+    assert record.load().equals(df)
+    
+    
+def test_lean_value_and_figure_exports(df, lean_pub):
+    
+    record = Export.value("LeanValue", 3.14) > lean_pub
+    assert record.load() == '3.14'
+    
+    fig, ax = plt.subplots()
+    df.plot(ax=ax)
+    
+    figure = Export.figure("LeanFigure", image=fig, data=df, caption="A caption.")
+    record = figure > lean_pub
+    
+    assert figure.image is None and figure.data is None
+    assert not plt.fignum_exists(fig.number)  # Closed, so it can be freed.
+    assert os.path.isfile(record.image_path)
+    assert record.load().equals(df)
+
+
+# Test multi-format figures.
+
+def test_multi_format_figure_export(df, pub_for_figure, pub_using_markdown, monkeypatch):
+    
+    import kallysto.export
+    
+    # Count the Agg draws.
+    draws = []
+    render_raster = kallysto.export.render_raster
+    
+    def counting_render_raster(image, dpi):
+        draws.append(dpi)
+        return render_raster(image, dpi)
+    
+    monkeypatch.setattr(kallysto.export, 'render_raster', counting_render_raster)
+    
+    fig, ax = plt.subplots(figsize=(4, 3), dpi=50)
+    df.plot(ax=ax)
+    
+    figure = Export.figure("MultiFigure", image=fig, data=df, caption="A caption.",
+                           format=['pdf', 'png', 'jpg'], dpi={'pdf': 72})
+    
+    assert figure.format == 'pdf'
+    assert figure.image_file == 'MultiFigure.pdf'
+    
+    figure > pub_for_figure
+    
+    for format in ['pdf', 'png', 'jpg']:
+        assert os.path.isfile(pub_for_figure.fig_file('MultiFigure.' + format))
+        
+    # The png and jpg share a single raster, which was also used for the digest.
+    assert draws == [50]
+    
+    from PIL import Image
+    assert Image.open(pub_for_figure.fig_file('MultiFigure.png')).size == (200, 150)
+    
+    # Each formatter picks its preferred format.
+    assert 'MultiFigure.pdf}' in figure.def_str
+    
+    figure > pub_using_markdown
+    assert 'MultiFigure.png "A caption."' in figure.def_str
+    
+    
+def test_tif_and_jpg_figure_export(df, pub_for_figure):
+    
+    fig, ax = plt.subplots(figsize=(4, 3), dpi=50)
+    df.plot(ax=ax)
+    
+    Export.figure("TifFigure", image=fig, data=df, caption="A caption.",
+                  format=['pdf', 'tif', 'jpg']) > pub_for_figure
+    
+    from PIL import Image
+    
+    for format, encoding in [('tif', 'TIFF'), ('jpg', 'JPEG')]:
+        assert Image.open(pub_for_figure.fig_file('TifFigure.' + format)).format == encoding
+
+
+def test_unchanged_value_export_is_skipped(pub_for_change_detection):
+    
+    pub = pub_for_change_detection
+    
+    Export.value("SkippedValue", 'text') > pub
+    
+    value = Export.value("SkippedValue", 'text')
+    value > pub
+    assert value.unchanged is True
+    
+    changed = Export.value("SkippedValue", 'new text')
+    changed > pub
+    assert changed.unchanged is False
+
+
+# Test bulk value exports.
+
+def test_values_from_dataframe(pub_for_values):
+    
+    pub = pub_for_values
+    
+    acc = pd.DataFrame([[0.9, 0.8], [0.7, 0.6]], 
+                       columns=['ModelA', 'ModelB'], index=['acc', 'prec'])
+    
+    with open(pub.logs_file, 'r') as log:
+        logged_before = len(log.read().splitlines())
+    
+    values = Export.values(acc, name_template='{row}{col}', name='accuracy')
+    assert type(values) == Values
+    values > pub
+    
+    names = ['accModelA', 'accModelB', 'precModelA', 'precModelB']
+    assert [member.name for member in values.members] == names
+    
+    # Every value is defined ...
+    with open(pub.defs_file, 'r') as defs:
+        defs = defs.read()
+        
+    for name, value in zip(names, [0.9, 0.8, 0.7, 0.6]):
+        assert '\\renewcommand{{\\{}}}{{\n{}}}'.format(name, value) in defs
+        
+    # ... and logged, using one consolidated data file.
+    with open(pub.logs_file, 'r') as log:
+        assert len(log.read().splitlines()) == logged_before + 4
+    
+    data = pd.read_csv(pub.data_file(values.data_file), index_col=0)
+    assert list(data.index) == names
+    assert list(data['value']) == [0.9, 0.8, 0.7, 0.6]
+    
+    
+def test_values_from_dict_and_series(pub_for_values):
+    
+    pub = pub_for_values
+    
+    values = Export.values({'A': 1, 'B': 'two'}, name_template='dict{key}')
+    values > pub
+    assert [member.name for member in values.members] == ['dictA', 'dictB']
+    assert values.data_file.endswith('.values.csv')
+    
+    series = Export.values(pd.Series([3, 4], index=['C', 'D']))
+    series > pub
+    assert [member.value for member in series.members] == [3, 4]
+    
+    # Re-exporting the same values is detected as unchanged.
+    again = Export.values(pd.Series([3, 4], index=['C', 'D']))
+    again > pub
+    assert again.name == series.name and again.unchanged is True
+
+
+def test_close_completes_background_renders(df):
+    
+    with Publication(
+            notebook='nb', title='pub_for_close_with_renders', 
+            pub_path='./tests/pub/', overwrite=True, fresh_start=True,
+            render_workers=2) as pub:
+        
+        fig, ax = plt.subplots(figsize=(4, 4))
+        df.plot(ax=ax)
+        
+        figure = Export.figure("ClosedFigure", image=fig, data=df, caption="A caption.")
+        figure > pub
+        
+    # Leaving the block completes the pending render's export.
+    assert pub.closed and pub.pending_renders == []
+    assert os.path.isfile(pub.fig_file(figure.image_file))
+    
+    with open(pub.defs_file, 'r') as defs:
+        assert '\\renewcommand{\\ClosedFigure}' in defs.read()
+        
+    with open(pub.logs_file, 'r') as log:
+        assert figure.image_file in log.read()
+        
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+def test_lean_batch_export():
+    
+    pub = Publication(
+            notebook='nb', title='lean_batch_pub', pub_path='./tests/pub/',
+            overwrite=True, fresh_start=True, lean=True, indexed_defs=True, 
+            build_stamps=True)
+    
+    with pub.batch():
+        values = Export.values({'LeanA': 1, 'LeanB': 2})
+        record = values > pub
+        
+        # The payload is kept until the batch is written ...
+        assert values.members is not None
+        
+    # ... and released after.
+    assert values.members is None and values.data is None
+    assert type(record) == ExportRecord
+    
+    with open(pub.defs_file, 'r') as defs:
+        defs = defs.read()
+        
+    assert '\\renewcommand{\\LeanA}' in defs and '\\renewcommand{\\LeanB}' in defs
+    assert pub.stale() == [('nb', 'LeanA'), ('nb', 'LeanB')]
+    
+    pub.close()
+    rmtree(pub.pub_path + '/' + pub.title)
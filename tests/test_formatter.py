@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tabulate import tabulate
+
+from kallysto.formatter import Latex, Markdown, Template, latex_tabular, pipe_table
+
+
+def mixed_frames():
+    """Dataframes of the common dtypes, awkward values and labels."""
+    
+    mixed = pd.DataFrame(
+        {'a_1': [1, 2], 'b': [1.5, np.nan], 'c': ['x_y & % ~^\\ {}# ~ ^ ', '$z'], 
+         'd': [True, False], 'e': pd.to_datetime(['2020-01-01', '2021-02-03'])}, 
+        index=['r1', 'r_2'])
+    
+    named = mixed.copy()
+    named.columns.name = 'cols'
+    named.index.name = 'i_x'
+    
+    return [
+        mixed, named,
+        pd.DataFrame({
+            'a': pd.array([1, None], dtype='Int64'), 'b': pd.Categorical(['u', 'v']),
+            'c': [1e20, -3e-9], 'o': [1, 'x'], 's': [' lead', 'multi\nline'], 
+            'x': [1 + 2j, 3j], 'f32': np.array([1.5, np.nan], dtype='float32')}),
+        pd.DataFrame({'a': ['x', None, np.nan], 'b': pd.array(['p', None, 'q'], dtype='string'),
+                      'd': [{'k': 1}, [1], (2,)]}),
+        pd.DataFrame({1: [1], 2.5: [2]}),
+        pd.DataFrame({'a': [np.inf, -np.inf, -0.0]}, index=[1.25, 2, 3]),
+        pd.DataFrame(np.random.randn(20, 3), index=pd.date_range('2020', periods=20)),
+        pd.DataFrame({'a': [1, 2]}, index=pd.MultiIndex.from_tuples([(1, 'a'), (2, 'b')])),
+        pd.DataFrame(columns=['a']), pd.DataFrame(), 
+    ]
+
+
+def test_template_formats_as_str_format():
+    
+    values = dict(uid='a1', name='Value', value=12.5, caption='100% {braces}')
+    
+    for template in [
+            '{uid}', '% Uid: {uid}\n{{{name}:{value}}}\n\n', 
+            '\\renewcommand{{\\{name}}}{{\n{value}}}\n\\caption{{{caption}}}',
+            'No fields, 50%.']:
+        
+        fields = {field: values[field] for field in Template(template).fields}
+        
+        assert Template(template).format(**fields) == template.format(**fields)
+        
+        
+def test_formatter_templates_are_compiled():
+    
+    for formatter in [Latex, Markdown]:
+        for kind in ['value', 'table', 'figure']:
+            assert isinstance(getattr(formatter, kind + '_template'), Template)
+            
+            
+def test_template_rejects_format_specs():
+    
+    with pytest.raises(ValueError):
+        Template('{value:.2f}')
+
+
+@pytest.mark.parametrize('escape', [True, False])
+def test_latex_tabular_matches_to_latex(escape):
+    
+    for data in mixed_frames():
+        expected = data.to_latex(escape=escape)
+        
+        assert latex_tabular(data, escape=escape) == expected
+        assert (latex_tabular(data, escape=escape, indent='\t\t\t') 
+                == '\t\t\t'.join(expected.splitlines(True)))
+
+
+def test_pipe_table_matches_tabulate():
+    
+    frames = mixed_frames() + [
+        pd.DataFrame({'x': [1e20, 1e-5, 0.1, 100, -0.0, np.nan]}),
+        pd.DataFrame({'b': [True, False]}),
+        pd.DataFrame({'b': [True, 1], 'u': np.array([1, 2], dtype='uint8')}),
+        pd.DataFrame({'i': [1234567, 2], 'f': [1.5, 2]}),
+        pd.DataFrame({'i': [1234567, 2], 's': ['  pad ', None]}),
+        pd.DataFrame({'s': ['1', '2.5', 'abc'], 't': ['True', '1,000', 'h\u00e9llo']}),
+    ]
+    
+    for data in frames:
+        assert pipe_table(data) == tabulate(data, headers='keys', tablefmt='pipe')
@@ -0,0 +1,133 @@
+import os
+import pytest
+import pandas as pd
+from shutil import rmtree
+
+from kallysto import definitions
+from kallysto.export import Export
+from kallysto.formatter import Markdown
+from kallysto.markdown import to_markdown
+from kallysto.publication import Publication
+
+
+def test_indexed_definitions(pub_with_indexed_defs):
+    
+    pub = pub_with_indexed_defs
+    
+    braces = pd.DataFrame({'set': ['{a, b}', '{}']})
+    
+    Export.value('indexedValue', 1) > pub
+    Export.value('indexedValue', 2) > pub
+    Export.table('bracesTable', data=braces, caption='A caption.') > pub
+    Export.values({'A': 'x', 'B': 'y'}, name_template='member{key}') > pub
+    
+    index = definitions.read_index(pub.defs_index_file)
+    assert list(index) == ['indexedValue', 'bracesTable', 'memberA', 'memberB']
+    assert index['bracesTable']['export'] == 'Table'
+    
+    # Only the requested definitions are read, including brace-y ones.
+    defs = definitions.read_definitions(
+        pub.indexed_defs_file, pub.defs_index_file, ['indexedValue', 'bracesTable'])
+    
+    assert defs['indexedValue'] == '2'
+    assert '{a, b}' in defs['bracesTable']
+    assert 'memberA' not in defs
+    
+    
+def test_to_markdown_with_indexed_definitions(pub_with_indexed_defs):
+    
+    pub = pub_with_indexed_defs
+    
+    Export.value('convertedValue', 42) > pub
+    
+    kmd_file = os.path.join(pub.src_path, 'paper.kmd')
+    
+    with open(kmd_file, 'w') as kmd:
+        kmd.write('The answer is {convertedValue}.\n\n{bracesTable}\n')
+        
+    with open(to_markdown(kmd_file, pub.includes_file), 'r') as md:
+        md = md.read()
+        
+    assert md.startswith('The answer is 42.\n')
+    assert '{a, b}' in md
+    
+    
+def test_compact_indexed_definitions(pub_with_indexed_defs):
+    
+    pub = pub_with_indexed_defs
+    
+    for i in range(3):
+        Export.value('compactedValue', i) > pub
+        
+    pub.compact_definitions()
+    
+    index = definitions.read_index(pub.defs_index_file)
+    
+    with open(pub.defs_index_file, 'r') as index_lines:
+        assert len(index_lines.readlines()) == len(index)
+        
+    defs = definitions.read_definitions(pub.indexed_defs_file, pub.defs_index_file)
+    assert defs['compactedValue'] == '2'
+    assert defs['indexedValue'] == '2'
+    
+    
+def test_to_markdown_after_indexed_definitions_turned_off():
+    
+    options = dict(notebook='nb', title='pub_for_stale_index', pub_path='./tests/pub/',
+                   formatter=Markdown, write_defs=True)
+    
+    pub = Publication(overwrite=True, fresh_start=True, indexed_defs=True, **options)
+    
+    try:
+        Export.value('acc', 1) > pub
+        pub.close()
+        
+        # A later run without the index must not be shadowed by it.
+        pub = Publication(**options)
+        Export.value('acc', 2) > pub
+        Export.value('newval', 3) > pub
+        
+        assert not os.path.isfile(pub.defs_index_file)
+        
+        kmd_file = os.path.join(pub.src_path, 'paper.kmd')
+        
+        with open(kmd_file, 'w') as kmd:
+            kmd.write('acc={acc} new={newval}\n')
+            
+        with open(to_markdown(kmd_file, pub.includes_file), 'r') as md:
+            assert md.read().startswith('acc=2 new=3')
+            
+    finally:
+        pub.close()
+        rmtree(pub.pub_path + '/' + pub.title)
+    
+    
+def test_to_markdown_after_indexed_definitions_turned_on():
+    
+    options = dict(notebook='nb', title='pub_for_new_index', pub_path='./tests/pub/',
+                   formatter=Markdown, write_defs=True)
+    
+    pub = Publication(overwrite=True, fresh_start=True, **options)
+    
+    try:
+        Export.value('a', 1) > pub
+        Export.value('b', 2) > pub
+        pub.close()
+        
+        # The index starts with the definitions written before it.
+        pub = Publication(indexed_defs=True, **options)
+        Export.value('a', 3) > pub
+        
+        kmd_file = os.path.join(pub.src_path, 'paper.kmd')
+        
+        with open(kmd_file, 'w') as kmd:
+            kmd.write('a={a} b={b}\n')
+            
+        with open(to_markdown(kmd_file, pub.includes_file), 'r') as md:
+            assert md.read().startswith('a=3 b=2')
+            
+        assert list(definitions.read_index(pub.defs_index_file)) == ['b', 'a']
+            
+    finally:
+        pub.close()
+        rmtree(pub.pub_path + '/' + pub.title)
@@ -1,7 +1,18 @@
+import json
 import os
 import pytest
+import pandas as pd
+from multiprocessing import get_all_start_methods, get_context
+from shutil import rmtree
+from time import mktime, sleep, strptime, time
 
+from matplotlib.figure import Figure as Fig
+from tabulate import tabulate
+
+from kallysto import audit
 from kallysto.publication import Publication
+from kallysto.export import Export
+from kallysto.fileio import atomic_path
 
 def test_publication_is_a_publication(pub_with_defs):
     assert type(pub_with_defs) == Publication
@@ -339,3 +350,739 @@ def test_figure_log_for_image_file(pub_using_markdown, figure):
 
 
 
+
+
+# Test batched exports.
+
+def read_lines(file):
+    with open(file, 'r') as f:
+        return f.read().splitlines()
+    
+
+def test_batch_writes_at_exit(pub_for_batch):
+    
+    defs_before = read_lines(pub_for_batch.defs_file)
+    logs_before = read_lines(pub_for_batch.logs_file)
+    
+    with pub_for_batch.batch():
+        for i in range(10):
+            Export.value('batchValue{}'.format(chr(ord('A') + i)), i) > pub_for_batch
+            
+        # Nothing is written until the batch ends.
+        assert read_lines(pub_for_batch.defs_file) == defs_before
+        assert read_lines(pub_for_batch.logs_file) == logs_before
+        
+    defs = '\n'.join(read_lines(pub_for_batch.defs_file))
+    assert all('\\renewcommand{{\\batchValue{}}}'.format(chr(ord('A') + i)) in defs
+               for i in range(10))
+    
+    assert len(read_lines(pub_for_batch.logs_file)) == len(logs_before) + 10
+    
+
+def test_batch_is_all_or_nothing(pub_for_batch):
+    
+    defs_before = read_lines(pub_for_batch.defs_file)
+    logs_before = read_lines(pub_for_batch.logs_file)
+    
+    with pytest.raises(RuntimeError):
+        with pub_for_batch.batch():
+            Export.value('discardedValue', 1) > pub_for_batch
+            raise RuntimeError('Abort the batch.')
+            
+    assert read_lines(pub_for_batch.defs_file) == defs_before
+    assert read_lines(pub_for_batch.logs_file) == logs_before
+    assert pub_for_batch.stored_digest('discardedValue') is None
+
+
+# Test the content-addressed blob store.
+
+def test_blob_store_shares_identical_files(blob_pubs, df):
+    
+    nb1, nb2 = blob_pubs
+    
+    for pub in blob_pubs:
+        Export.table('blobTable', data=df, caption='A caption.') > pub
+        
+    file1 = nb1.data_file('blobTable.csv')
+    file2 = nb2.data_file('blobTable.csv')
+    
+    # Both notebooks' files link to the same blob.
+    assert os.path.samefile(file1, file2)
+    assert os.stat(file1).st_nlink == 3
+    assert os.path.samefile(file1, nb1.blob_file(nb1.file_digest(file1)))
+    
+    
+def test_blob_store_rewrites_do_not_share(blob_pubs, df):
+    
+    nb1, nb2 = blob_pubs
+    
+    for pub in blob_pubs:
+        Export.table('rewrittenTable', data=df, caption='A caption.') > pub
+    
+    # Rewriting one notebook's file leaves the other's content alone.
+    Export.table('rewrittenTable', data=df * 2, caption='A caption.') > nb1
+    
+    assert nb1.load_data('rewrittenTable.csv').equals(df * 2)
+    assert nb2.load_data('rewrittenTable.csv').equals(df)
+    
+    
+def test_reclaim_blobs(blob_pubs):
+    
+    nb1, nb2 = blob_pubs
+    
+    Export.value('reclaimedValue', 'unique value') > nb1
+    
+    value_file = nb1.data_file('reclaimedValue.txt')
+    blob = nb1.blob_file(nb1.file_digest(value_file))
+    
+    os.remove(value_file)
+    
+    assert blob in nb1.reclaim_blobs()
+    assert not os.path.exists(blob)
+    assert os.path.isfile(nb1.data_file('blobTable.csv'))
+
+
+# Test definitions compaction.
+
+def test_compact_definitions(pub_for_compaction, df):
+    
+    pub = pub_for_compaction
+    
+    for i in range(3):
+        Export.value('compactValue', i) > pub
+        Export.table('compactTable', data=df + i, caption='A caption.') > pub
+        
+    Export.value('otherValue', 'other') > pub
+        
+    assert pub.compact_definitions() == 4
+    
+    defs = '\n'.join(read_lines(pub.defs_file))
+    
+    # One definition per name, the latest one, in export order.
+    assert defs.count('\\renewcommand{\\compactValue}') == 1
+    assert defs.count('\\renewcommand{\\compactTable}') == 1
+    assert '\\renewcommand{\\compactValue}{\n2}' in defs
+    assert defs.index('compactTable}') < defs.index('otherValue}')
+    
+    # Exports after compaction are still written to the definitions file.
+    Export.value('laterValue', 'later') > pub
+    assert '\\renewcommand{\\laterValue}' in '\n'.join(read_lines(pub.defs_file))
+    
+    
+def test_compact_markdown_definitions(pub_using_markdown):
+    
+    pub = pub_using_markdown
+    
+    Export.value('mdValue', 1) > pub
+    Export.value('mdValue', 2) > pub
+    
+    pub.compact_definitions()
+    
+    defs = '\n'.join(read_lines(pub.defs_file))
+    assert '{mdValue:1}' not in defs
+    assert defs.count('{mdValue:2}') == 1
+    
+    
+# Test the audit log history.
+
+def test_log_entries_are_json(pubs_for_history, df):
+    
+    pub = pubs_for_history[0]
+    
+    figure = Export.figure('LoggedFigure', image=Fig(), data=df, caption='A caption.')
+    figure > pub
+    
+    with open(pub.logs_file, 'r') as log:
+        entry = json.loads(log.read().splitlines()[-1])
+        
+    assert entry['name'] == 'LoggedFigure'
+    assert entry['notebook'] == 'nb1'
+    assert entry['export'] == 'Figure'
+    assert entry['status'] == 'written'
+    assert entry['image_path'].endswith(figure.image_file)
+    assert entry['data_path'].endswith(figure.data_file)
+    
+    
+def test_history(pubs_for_history):
+    
+    nb1, nb2 = pubs_for_history
+    
+    Export.value('accModelA', 0.9) > nb1
+    Export.value('accModelB', 0.8) > nb1
+    
+    since = time()
+    Export.value('accModelA', 0.95) > nb2
+    
+    history = nb1.history(name='accModelA')
+    assert list(history['notebook']) == ['nb1', 'nb2']
+    assert list(history['status']) == ['written', 'written']
+    
+    # Any publication linked to the title can query its history.
+    recent = nb2.history(name='accModelA', since=since)
+    assert list(recent['notebook']) == ['nb2']
+    
+    assert set(nb1.history(notebook='nb1')['name']) >= {'accModelA', 'accModelB'}
+    assert nb1.history(name='accModelC').empty
+
+
+def test_history_index_is_incremental(pubs_for_history):
+    
+    pub = pubs_for_history[0]
+    
+    before = len(pub.history())
+    
+    Export.value('IncrementalValue', 1) > pub
+    assert len(pub.history()) == before + 1
+    
+    # The index is rebuilt if it is deleted.
+    os.remove(pub.logs_index_file)
+    assert len(pub.history()) == before + 1
+    
+
+# Test audit log rotation.
+
+def test_log_rotation(pub_with_log_rotation):
+    
+    pub = pub_with_log_rotation
+    
+    for i in range(20):
+        Export.value('RotatedValue{}'.format(i), i) > pub
+        
+    archives = audit.log_segments(pub.logs_file)[:-1]
+    assert len(archives) > 1
+    assert all(archive.endswith('.xz') for archive in archives)
+    
+    # The live log is kept under its size limit ...
+    assert os.path.getsize(pub.logs_file) < 2000
+    
+    # ... and the entries can be read across the archives and live log ...
+    names = [entry['name'] for entry in pub.read_log()]
+    assert names == ['RotatedValue{}'.format(i) for i in range(20)]
+    
+    # ... and queried.
+    assert list(pub.history(name='RotatedValue0')['name']) == ['RotatedValue0']
+    assert len(pub.history()) == 20
+    
+    # Including when the index is rebuilt.
+    os.remove(pub.logs_index_file)
+    assert list(pub.history(name='RotatedValue19')['name']) == ['RotatedValue19']
+    assert len(pub.history()) == 20
+
+
+def test_rotate_log_by_age(pubs_for_history):
+    
+    pub = pubs_for_history[0]
+    
+    Export.value('AgedValue', 1) > pub
+    
+    entries = len(list(pub.read_log()))
+    
+    pub.log_max_age = 0
+    pub.rotate_log_if_due()
+    pub.log_max_age = None
+    
+    assert os.path.getsize(pub.logs_file) == 0
+    assert len(audit.log_segments(pub.logs_file)) == 2
+    assert len(list(pub.read_log())) == entries
+    assert list(pub.history(name='AgedValue')['name']) == ['AgedValue']
+
+
+# Test concurrent writers.
+
+def export_values_concurrently(notebook, title='pub_for_concurrency', **options):
+    pub = Publication(
+            notebook=notebook, 
+            title=title, 
+            pub_path='./tests/pub/', 
+            write_defs=True, **options)
+    
+    for i in range(25):
+        Export.value('{}Value{}'.format(notebook, i), i) > pub
+        
+        
+@pytest.mark.skipif(
+    'fork' not in get_all_start_methods(), reason='Needs forked processes.')
+def test_concurrent_writers():
+    
+    notebooks = ['nb{}'.format(i) for i in range(4)]
+    
+    workers = [get_context('fork').Process(
+        target=export_values_concurrently, args=(notebook,)) 
+        for notebook in notebooks]
+    
+    for worker in workers:
+        worker.start()
+        
+    for worker in workers:
+        worker.join()
+        
+    assert [worker.exitcode for worker in workers] == [0] * len(workers)
+    
+    pub = Publication(
+            notebook='nb0', 
+            title='pub_for_concurrency', 
+            pub_path='./tests/pub/', 
+            write_defs=True)
+    
+    try:
+        # Every log entry is intact ...
+        entries = list(pub.read_log())
+        assert len(entries) == 100
+        
+        with open(pub.logs_file, 'r') as log:
+            assert len(log.read().splitlines()) == 100
+        
+        # ... and each notebook's definitions are included once.
+        with open(pub.includes_file, 'r') as includes:
+            includes = includes.read().splitlines()
+            
+        assert len(includes) == len(set(includes)) == len(notebooks)
+        
+    finally:
+        rmtree(pub.pub_path + '/' + pub.title)
+        
+        
+def test_atomic_path_discards_failed_writes(pub_with_defs):
+    
+    filepath = pub_with_defs.data_file('atomic.csv')
+    
+    with atomic_path(filepath) as temp:
+        with open(temp, 'w') as file:
+            file.write('complete')
+            
+    with pytest.raises(ValueError):
+        with atomic_path(filepath) as temp:
+            with open(temp, 'w') as file:
+                file.write('partial')
+            raise ValueError()
+            
+    with open(filepath, 'r') as file:
+        assert file.read() == 'complete'
+        
+    assert not [file for file in os.listdir(pub_with_defs.data_path)
+                if file.startswith('.tmp-')]
+
+
+@pytest.mark.skipif(
+    'fork' not in get_all_start_methods(), reason='Needs forked processes.')
+def test_segmented_log():
+    
+    notebooks = ['nb{}'.format(i) for i in range(4)]
+    
+    workers = [get_context('fork').Process(
+        target=export_values_concurrently, args=(notebook, 'pub_for_segments'),
+        kwargs={'segmented_log': True})
+        for notebook in notebooks]
+    
+    for worker in workers:
+        worker.start()
+        
+    for worker in workers:
+        worker.join()
+        
+    assert [worker.exitcode for worker in workers] == [0] * len(workers)
+    
+    pub = Publication(
+            notebook='nb0', 
+            title='pub_for_segments', 
+            pub_path='./tests/pub/', 
+            write_defs=True, segmented_log=True)
+    
+    try:
+        # Each writer logged to its own segment ...
+        assert os.path.getsize(pub.logs_file) == 0
+        assert len(audit.live_segments(pub.logs_file)) == len(notebooks) + 1
+        
+        # ... which are merged, in time order, when read.
+        entries = list(pub.read_log())
+        assert len(entries) == 100
+        assert [entry['time'] for entry in entries] == sorted(
+            entry['time'] for entry in entries)
+        
+        assert list(pub.history(name='nb2Value3')['notebook']) == ['nb2']
+        
+        # Compaction folds the segments into the log.
+        assert pub.compact_log() == len(notebooks)
+        assert audit.live_segments(pub.logs_file) == [pub.logs_file]
+        
+        with open(pub.logs_file, 'r') as log:
+            assert [json.loads(line)['time'] for line in log] == [
+                entry['time'] for entry in entries]
+            
+        assert list(pub.history(name='nb2Value3')['notebook']) == ['nb2']
+        assert len(pub.history()) == 100
+        
+        # Writers start a new segment with their next entry.
+        Export.value('AfterCompaction', 1) > pub
+        assert len(audit.live_segments(pub.logs_file)) == 2
+        assert len(pub.history()) == 101
+        
+    finally:
+        rmtree(pub.pub_path + '/' + pub.title)
+
+
+def test_many_log_segments(monkeypatch):
+    
+    def link(notebook, **options):
+        return Publication(
+            notebook=notebook, title='pub_for_many_segments', pub_path='./tests/pub/', 
+            segmented_log=True, **options)
+    
+    for i in range(7):
+        with link('nb{}'.format(i), overwrite=True, fresh_start=i == 0) as pub:
+            for j in range(3):
+                Export.value('Value{}'.format(j), j) > pub
+                
+    # Count the segments open at once.
+    monkeypatch.setattr(audit, 'MAX_OPEN_SEGMENTS', 3)
+    
+    open_segments, most_open = [], []
+    open_segment = audit.open_segment
+    
+    class CountedSegment(object):
+        def __init__(self, segment_file):
+            self.segment = open_segment(segment_file)
+            
+        def __enter__(self):
+            open_segments.append(self)
+            most_open.append(len(open_segments))
+            return self.segment.__enter__()
+        
+        def __exit__(self, *exc_info):
+            open_segments.remove(self)
+            return self.segment.__exit__(*exc_info)
+        
+    monkeypatch.setattr(audit, 'open_segment', CountedSegment)
+    
+    try:
+        # The segments are merged in batches ...
+        entries = list(pub.read_log())
+        
+        assert len(entries) == 21 and max(most_open) <= 3
+        assert [entry['time'] for entry in entries] == sorted(
+            entry['time'] for entry in entries)
+        
+        # ... and a new writer folds them into the log, once there are too many.
+        with link('nb7') as pub:
+            assert audit.live_segments(pub.logs_file) == [pub.logs_file]
+            assert [entry['time'] for entry in pub.read_log()] == [
+                entry['time'] for entry in entries]
+            
+        assert max(most_open) <= 3
+        
+    finally:
+        rmtree(pub.pub_path + '/' + pub.title)
+
+
+# Test repeated links to a notebook.
+
+def link_to_pub_for_reuse():
+    return Publication(
+            notebook='nb', 
+            title='pub_for_reuse', 
+            pub_path='./tests/pub/', 
+            write_defs=True)
+
+
+def test_repeated_links_reuse_writers():
+    
+    links = [link_to_pub_for_reuse() for _ in range(5)]
+    
+    try:
+        # The links share one writer per file, with one handler each ...
+        assert len({id(link.audit_logger) for link in links}) == 1
+        assert len(links[0].audit_logger.handlers) == 1
+        assert len(links[0].defs_logger.handlers) == 1
+        
+        # ... so each definition and log entry is only written once.
+        Export.value('ReusedValue', 1) > links[-1]
+        
+        with open(links[0].defs_file, 'r') as defs:
+            assert defs.read().count('\\renewcommand{\\ReusedValue}') == 1
+            
+        assert len(list(links[0].read_log())) == 1
+        
+    finally:
+        for link in links:
+            link.close()
+            
+    rmtree(links[0].pub_path + '/' + links[0].title)
+    
+
+@pytest.mark.skipif(
+    not os.path.isdir('/proc/self/fd'), reason='Needs /proc to count open files.')
+def test_repeated_links_do_not_leak_files():
+    
+    def open_files():
+        return len(os.listdir('/proc/self/fd'))
+    
+    with link_to_pub_for_reuse() as pub:
+        Export.value('LeakValue', 1) > pub
+        
+    before = open_files()
+    
+    for i in range(20):
+        with link_to_pub_for_reuse() as pub:
+            Export.value('LeakValue', i) > pub
+            
+    assert open_files() == before
+    
+    # A closed link cannot export.
+    with pytest.raises(ValueError):
+        Export.value('LeakValue', 1) > pub
+    
+    rmtree(pub.pub_path + '/' + pub.title)
+
+
+# Test lazy setup.
+
+def test_lazy_setup(lazy_pub):
+    
+    # Nothing is created until the first export ...
+    assert not os.path.exists(lazy_pub.pub_path + '/' + lazy_pub.title)
+    assert lazy_pub.writers is None
+    
+    Export.value('LazyValue', 1) > lazy_pub
+    
+    # ... which creates the datastore, includes entry and loggers.
+    for name in ['data', 'figs', 'defs', 'logs']:
+        assert os.path.isdir(getattr(lazy_pub, '{}_path'.format(name)))
+        
+    with open(lazy_pub.includes_file, 'r') as includes:
+        assert lazy_pub.formatter.include(lazy_pub) in includes.read()
+        
+    assert list(lazy_pub.history()['name']) == ['LazyValue']
+
+
+# Test garbage collection.
+
+def test_gc(pub_for_gc, df):
+    
+    pub = pub_for_gc
+    
+    Export.table('KeptTable', data=df, caption='A caption.') > pub
+    renamed = Export.table('RenamedTable', data=df, caption='A caption.') > pub
+    Export.figure('GcFigure', image=Fig(), data=df, caption='A caption.', 
+                  format=['pdf', 'png']) > pub
+    
+    # The png is no longer exported, and a file is left by an old export.
+    figure = Export.figure(
+        'GcFigure', image=Fig(), data=df, caption='A caption.', format='pdf') > pub
+    
+    stray = pub.data_file('Stray.csv')
+    df.to_csv(stray)
+    
+    unreferenced = [
+        os.path.abspath(pub.data_file('Stray.csv')), 
+        os.path.abspath(pub.fig_file('GcFigure.png'))]
+    
+    assert sorted(map(os.path.abspath, pub.gc(dry_run=True))) == sorted(unreferenced)
+    assert os.path.isfile(stray)
+    
+    # Unreferenced files can be archived to the attic ...
+    archived = pub.gc(archive=True)
+    assert sorted(map(os.path.abspath, archived)) == sorted(unreferenced)
+    assert not os.path.isfile(stray)
+    assert os.path.isdir(pub.kallysto_path + 'attic/')
+    
+    assert all(os.path.isfile(filepath) for filepath in figure.files(pub))
+    assert pub.gc(dry_run=True) == []
+    
+    # Re-running the notebook, without re-exporting everything, keeps the
+    # exports that were not re-exported ...
+    with Publication(
+            notebook='nb', title='pub_for_gc', pub_path='./tests/pub/') as rerun:
+        Export.table('KeptTable', data=df, caption='A caption.') > rerun
+        
+        assert rerun.gc() == []
+        
+        # ... unless they are retired by name.
+        removed = rerun.gc(retire=['RenamedTable', 'GcFigure'])
+        
+    assert os.path.abspath(pub.data_file(renamed.data_file)) in map(os.path.abspath, removed)
+    assert not any(os.path.isfile(filepath) for filepath in figure.files(pub))
+    assert os.path.isfile(pub.data_file('KeptTable.csv'))
+    
+    with open(pub.defs_file, 'r') as defs:
+        defs = defs.read()
+        
+    assert '\\renewcommand{\\KeptTable}' in defs
+    assert '\\renewcommand{\\RenamedTable}' not in defs
+
+
+def test_gc_retention(pub_for_gc, df):
+    
+    pub = pub_for_gc
+    attic = pub.kallysto_path + 'attic/'
+    
+    # Archive three versions of a stray file, a second apart.
+    for i in range(3):
+        df.to_csv(pub.data_file('Version.csv'))
+        pub.gc(archive=True)
+        sleep(1)
+        
+    def versions():
+        return sorted(
+            folder for folder in os.listdir(attic)
+            if os.path.isfile(attic + folder + '/data/nb/Version.csv'))
+    
+    archived = versions()
+    assert len(archived) == 3
+    
+    # The latest versions are kept ...
+    expired = pub.gc(keep_versions=2, dry_run=True)
+    assert len(expired) == 1 and archived[0] in expired[0]
+    
+    pub.gc(keep_versions=2)
+    assert versions() == archived[1:]
+    
+    # ... as are those archived since a given time.
+    pub.gc(keep_versions=0, since=mktime(strptime(archived[2], '%Y%m%dT%H%M%S')))
+    assert versions() == archived[2:]
+    
+    pub.gc(keep_versions=0)
+    assert versions() == []
+
+
+def test_fast_reset(pub_for_fast_reset, df):
+    
+    pub = pub_for_fast_reset
+    
+    for i in range(5):
+        Export.table('ResetTable{}'.format(i), data=df, caption='A caption.') > pub
+        
+    old_file = pub.data_file('ResetTable0.csv')
+    assert os.path.isfile(old_file)
+    
+    with Publication(notebook='nb', title='pub_for_fast_reset', pub_path='./tests/pub/',
+                     overwrite=True, fast_reset=True) as reset:
+        
+        # The old folders are out of the way at once ...
+        assert not os.path.isfile(old_file)
+        assert os.path.isdir(reset.data_path)
+        
+        Export.table('NewTable', data=df, caption='A caption.') > reset
+        
+        # ... and the trash is deleted in the background.
+        assert reset.wait_for_cleanup(timeout=30)
+        assert reset.cleanup_done()
+        assert os.listdir(reset.trash_path) == []
+        
+        assert os.path.isfile(reset.data_file('NewTable.csv'))
+
+
+def test_build_stamps(pub_with_build_stamps, df):
+    
+    pub = pub_with_build_stamps
+    
+    # Nothing has been built, so every export is stale.
+    Export.value('StampValue', 1) > pub
+    Export.table('StampTable', data=df, caption='A caption.') > pub
+    
+    assert pub.stale() == [('nb', 'StampTable'), ('nb', 'StampValue')]
+    
+    stamp = pub.build_path + 'kallysto.stamp'
+    value_stamp = pub.build_path + 'nb/StampValue.stamp'
+    table_stamp = pub.build_path + 'nb/StampTable.stamp'
+    
+    assert os.path.isfile(stamp) and os.path.isfile(pub.build_path + 'nb.stamp')
+    
+    pub.mark_built()
+    assert pub.stale() == []
+    
+    stamped = os.path.getmtime(stamp), os.path.getmtime(table_stamp)
+    
+    # Exporting the same content again touches nothing ...
+    Export.value('StampValue', 1) > pub
+    Export.table('StampTable', data=df, caption='A caption.') > pub
+    
+    assert (os.path.getmtime(stamp), os.path.getmtime(table_stamp)) == stamped
+    assert pub.stale() == []
+    
+    # ... unlike new content, or a new definition of the same content.
+    Export.value('StampValue', 2) > pub
+    Export.table('StampTable', data=df, caption='A new caption.') > pub
+    
+    assert pub.stale() == [('nb', 'StampTable'), ('nb', 'StampValue')]
+    assert os.path.getmtime(value_stamp) > stamped[0]
+    assert os.path.getmtime(stamp) > stamped[0]
+    
+    # Staleness can also be judged against a build output.
+    assert pub.stale(since=pub.build_path + 'nb.stamp') == []
+
+
+def test_relative_path(pub_using_markdown):
+    
+    pub = pub_using_markdown
+    
+    paths = [
+        pub.notebook_file, pub.data_file('Value.txt'), pub.fig_file('Figure.pdf'), 
+        pub.data_file('sub/Table.csv'), pub.defs_path, 'Local.txt']
+    
+    for start in [pub.src_path, pub.logs_path]:
+        for path in paths:
+            assert pub.relative_path(path, start) == os.path.relpath(path, start)
+            
+            # And again, from the cache.
+            assert pub.relative_path(path, start) == os.path.relpath(path, start)
+
+
+def test_series_table(pub_for_figure, pub_using_markdown):
+    
+    series = pd.Series([1, 2, 3], name='x')
+    
+    latex = Export.table('SeriesTable', series, 'A caption.') > pub_for_figure
+    assert series.to_latex(escape=True) in latex.def_str.replace('\t\t\t', '')
+    
+    markdown = Export.table('SeriesTable', series, 'A caption.') > pub_using_markdown
+    assert tabulate(series.to_frame(), headers='keys', tablefmt='pipe') in markdown.def_str
+
+
+def test_rotate_then_compact_segmented_log(df):
+    
+    pub = Publication(
+            notebook='nb', 
+            title='pub_for_rotate_then_compact', 
+            pub_path='./tests/pub/', 
+            overwrite=True, fresh_start=True, segmented_log=True)
+    
+    try:
+        for i in range(3):
+            Export.value('RotatedValue{}'.format(i), i) > pub
+            
+        archive = pub.rotate_log()
+        
+        Export.value('CompactedValue', 3) > pub
+        
+        assert pub.compact_log() == 1
+        
+        # The archive outlives the writer segment it was rotated from.
+        assert archive in audit.log_segments(pub.logs_file)
+        assert len(list(pub.read_log())) == 4
+        assert len(pub.history()) == 4
+        
+    finally:
+        pub.close()
+        rmtree(pub.pub_path + '/' + pub.title)
+
+
+def test_includes_survive_a_fresh_start():
+    
+    def link(notebook, **options):
+        return Publication(
+            notebook=notebook, title='pub_for_includes', pub_path='./tests/pub/', 
+            **options)
+    
+    first = link('nb1', overwrite=True, fresh_start=True)
+    second = link('nb2', fresh_start=True)  # Removes the includes file.
+    
+    # Linking nb1 again registers it again.
+    link('nb1')
+    
+    with open(first.includes_file, 'r') as includes:
+        includes = includes.read()
+        
+    assert first.formatter.include(first) in includes
+    assert second.formatter.include(second) in includes
+    
+    rmtree(first.pub_path + '/' + first.title)
@@ -0,0 +1,144 @@
+import json
+import os
+from shutil import rmtree
+import pytest
+import pandas as pd
+from matplotlib.figure import Figure as Fig
+
+from kallysto.publication import Publication
+from kallysto.export import Export
+from kallysto.storage import MemoryStorage
+
+
+def on_disk(pub):
+    return os.path.exists(pub.pub_path + '/' + pub.title)
+
+
+def test_memory_storage_exports(memory_pub, df):
+    
+    pub = memory_pub
+    
+    value = Export.value('MemoryValue', 42) > pub
+    table = Export.table('MemoryTable', data=df, caption='A caption.') > pub
+    figure = Export.figure(
+        'MemoryFigure', image=Fig(), data=df, caption='A caption.', 
+        format=['pdf', 'png'], dpi=50) > pub
+    
+    # Nothing is written to disk ...
+    assert not on_disk(pub)
+    
+    # ... but every file is in the storage.
+    for export in [value, table, figure]:
+        for filepath in export.files(pub):
+            assert pub.storage.isfile(filepath)
+            
+    assert pub.storage.read_text(pub.data_file(value.data_file)) == '42'
+    assert df.equals(pub.load_data(table.data_file))
+    
+    with pub.storage.open(pub.fig_file(figure.image_files['png']), 'rb') as png:
+        assert png.read(4) == b'\x89PNG'
+        
+    defs = pub.storage.read_text(pub.defs_file)
+    for name in ['MemoryValue', 'MemoryTable', 'MemoryFigure']:
+        assert '\\renewcommand{{\\{}}}'.format(name) in defs
+        
+    log = pub.storage.read_text(pub.logs_file).splitlines()
+    assert [json.loads(line)['name'] for line in log] == [
+        'MemoryValue', 'MemoryTable', 'MemoryFigure']
+    
+    assert pub.formatter.include(pub) in pub.storage.read_text(pub.includes_file)
+    
+    
+def test_memory_storage_change_detection(memory_pub, df):
+    
+    pub = memory_pub
+    
+    Export.table('UnchangedTable', data=df, caption='A caption.') > pub
+    again = Export.table('UnchangedTable', data=df, caption='A caption.') > pub
+    
+    assert again.unchanged is True
+    assert not on_disk(pub)
+    
+    
+def test_memory_storage_columnar_and_streamed_data(df):
+    
+    pub = Publication(
+            notebook='nb', 
+            title='memory_parquet_pub', 
+            pub_path='./tests/pub/', 
+            write_defs=True, data_format='parquet', csv_copy=True,
+            storage=MemoryStorage())
+    
+    with pub:
+        table = Export.table('ParquetTable', data=df, caption='A caption.') > pub
+        assert df.equals(pub.load_data(table.data_file))
+        
+        chunks = (df.iloc[i:i + 1] for i in range(len(df)))
+        streamed = Export.table('StreamedTable', data=chunks, caption='A caption.') > pub
+        assert df.equals(pub.load_data(streamed.data_file))
+        assert df.equals(pub.load_data(streamed.csv_file))
+        
+    assert not on_disk(pub)
+    
+    
+def test_memory_storage_rejects_local_features():
+    
+    with pytest.raises(ValueError):
+        Publication(
+            notebook='nb', title='memory_blob_pub', pub_path='./tests/pub/', 
+            blob_store=True, storage=MemoryStorage())
+    
+    
+def test_memory_storage_overwrite(df):
+    
+    storage = MemoryStorage()
+    
+    pub = Publication(
+            notebook='nb', title='memory_overwrite_pub', pub_path='./tests/pub/', 
+            storage=storage)
+    
+    with pub:
+        table = Export.table('OverwrittenTable', data=df, caption='A caption.') > pub
+    
+    with Publication(
+            notebook='nb', title='memory_overwrite_pub', pub_path='./tests/pub/', 
+            overwrite=True, storage=storage) as pub:
+        assert not pub.storage.isfile(pub.data_file(table.data_file))
+        assert pub.storage.isfile(pub.logs_file)
+
+
+def test_incomplete_storage_backend():
+    
+    from kallysto.storage import Storage
+    
+    class ReadOnlyStorage(Storage):
+        def isfile(self, path):
+            return False
+        
+    # Fails when created, not part way through an export.
+    with pytest.raises(TypeError):
+        ReadOnlyStorage()
+
+
+def test_memory_storage_leaves_disk_alone(df):
+    
+    options = dict(notebook='nb', title='pub_for_shadowed_memory', pub_path='./tests/pub/')
+    
+    # A datastore on disk, with indexed definitions ...
+    with Publication(overwrite=True, fresh_start=True, indexed_defs=True, **options) as pub:
+        Export.value('DiskValue', 1) > pub
+        Export.value('DiskValue', 2) > pub
+        
+    with open(pub.defs_index_file, 'r') as index:
+        disk_index = index.read()
+        
+    # ... is not touched by a memory publication at the same path.
+    memory = Publication(storage=MemoryStorage(), **options)
+    Export.value('MemoryValue', 1) > memory
+    memory.compact_definitions()
+    
+    with open(pub.defs_index_file, 'r') as index:
+        assert index.read() == disk_index
+        
+    memory.close()
+    rmtree(pub.pub_path + '/' + pub.title)